@@ -0,0 +1,107 @@
+"""Negotiated compression of the responses of Capstone.
+
+CompressionMiddleware compresses the pages, and the other text responses,
+with brotli when the brotli package is installed and the browser accepts
+it, with gzip otherwise, according to the Accept-Encoding header of the
+request. Unlike django.middleware.gzip.GZipMiddleware, which only knows
+gzip, it prefers brotli, whose output is smaller, and honours the quality
+values of the header, e.g. "gzip;q=0" to refuse an encoding.
+
+Static files are not compressed on each request: they are compressed once
+by collectstatic, see concert/staticfiles.py.
+
+Like GZipMiddleware, compressing pages which reflect secrets, such as the
+CSRF token, could expose them to the BREACH attack; Django masks the CSRF
+token differently in each response, which defeats it.
+"""
+import gzip
+
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+# Bodies smaller than this are never compressed
+COMPRESS_MIN_SIZE = 1024
+
+# Content types worth compressing
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript",
+                      "image/svg+xml")
+
+# Supported encodings, preferred first, with the suffix of the files
+# compressed by collectstatic
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def choose_encoding(accept_encoding, encodings=ENCODINGS):
+    """Returns the one of encodings that the Accept-Encoding header value
+    accept_encoding gives the highest quality value, the first one on a
+    tie, or None if the client accepts none of them. The same negotiation
+    as in Pictures/backend/compression.py, which Capstone, built on its
+    own, cannot import."""
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, best=False):
+    """Compresses data with one of ENCODINGS. With best, it is compressed
+    as much as possible, which takes much longer, e.g. for static files
+    compressed once."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+def is_compressible(content_type):
+    return content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compresses the responses for the browsers which accept it."""
+
+    def process_response(self, request, response):
+        if (response.streaming
+                or response.has_header("Content-Encoding")
+                or not is_compressible(response.get("Content-Type", ""))
+                or len(response.content) < COMPRESS_MIN_SIZE):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING"))
+        if encoding is None:
+            return response
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(compressed))
+        response.headers["Content-Encoding"] = encoding
+        # The ETag was computed from the uncompressed body: it is weakened,
+        # as GZipMiddleware does
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        return response
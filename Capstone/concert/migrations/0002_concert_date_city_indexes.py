@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("concert", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="concert",
+            index=models.Index(fields=["date"], name="concert_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="concert",
+            index=models.Index(fields=["city", "date"],
+                               name="concert_city_date_idx"),
+        ),
+    ]
@@ -13,6 +13,15 @@ class Concert(models.Model):
     city = models.CharField(max_length=255)
     date = models.DateField(default=datetime.now)
 
+    class Meta:
+        # Serve the concerts list, which is ordered by date and can be
+        # filtered by city and date range
+        indexes = [
+            models.Index(fields=["date"], name="concert_date_idx"),
+            models.Index(fields=["city", "date"],
+                         name="concert_city_date_idx"),
+        ]
+
     def __str__(self):
         return self.concert_name
 
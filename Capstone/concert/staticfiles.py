@@ -0,0 +1,117 @@
+"""Precompressed, hashed static files.
+
+With STATIC_PRECOMPRESSED set (see settings.py), collectstatic stores the
+static files with PrecompressedManifestStaticFilesStorage: as with
+ManifestStaticFilesStorage, each file is copied under a name containing
+the hash of its content, which the {% static %} tag links to unless
+DEBUG is set. The text files, such as the Bootstrap CSS and JS bundles,
+are also written compressed next to both copies, with the best gzip and
+brotli settings, since this happens once, at build time.
+
+serve_static() then serves STATIC_ROOT in production, where runserver is
+not there to do it: it sends the compressed file the browser accepts, if
+any, without compressing anything itself, and lets browsers cache the
+hashed files forever, since their content never changes.
+"""
+import mimetypes
+import os
+import posixpath
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+                                                staticfiles_storage)
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .compression import ENCODINGS, SUFFIXES, choose_encoding, compress
+
+# Compressed files must save at least this fraction of the original size
+# to be kept
+MIN_SAVING = 0.05
+
+# Seconds for which browsers may cache the static files whose name is not
+# hashed, e.g. those linked to without the {% static %} tag
+UNHASHED_MAX_AGE = 60
+
+# Seconds for which browsers may cache the hashed files: one year
+HASHED_MAX_AGE = 365 * 24 * 3600
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Writes the compressed forms of the static files, with the suffixes
+    of SUFFIXES."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        for name, hashed_name in self.hashed_files.items():
+            if is_text_file(name):
+                self.compress_file(name)
+                self.compress_file(hashed_name)
+
+    def compress_file(self, name):
+        with self.open(name) as original:
+            data = original.read()
+
+        for encoding in ENCODINGS:
+            path = self.path(name + SUFFIXES[encoding])
+            compressed = compress(data, encoding, best=True)
+            if len(compressed) <= len(data) * (1 - MIN_SAVING):
+                with open(path, "wb") as compressed_file:
+                    compressed_file.write(compressed)
+            elif os.path.exists(path):
+                os.remove(path)
+
+
+def is_text_file(name):
+    content_type, encoding = mimetypes.guess_type(name)
+    return (encoding is None and content_type is not None
+            and (content_type.startswith("text/")
+                 or content_type in ("application/javascript",
+                                     "application/json", "image/svg+xml")))
+
+
+def serve_static(request, path):
+    """Serves the static file path of STATIC_ROOT, compressed if a
+    compressed form of it is there and accepted by the browser."""
+    path = posixpath.normpath(path).lstrip("/")
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404(path)
+    if not os.path.isfile(fullpath):
+        raise Http404(path)
+
+    available = [encoding for encoding in ENCODINGS
+                 if os.path.isfile(fullpath + SUFFIXES[encoding])]
+    encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING"),
+                               available)
+    if encoding is not None:
+        fullpath += SUFFIXES[encoding]
+
+    stat = os.stat(fullpath)
+    if not was_modified_since(request.META.get("HTTP_IF_MODIFIED_SINCE"),
+                              stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        # Named after the original file, whose type is sent
+        response = FileResponse(open(fullpath, "rb"),
+                                filename=posixpath.basename(path))
+        response.headers["Last-Modified"] = http_date(stat.st_mtime)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+
+    if available:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    if path in getattr(staticfiles_storage, "hashed_files", {}).values():
+        patch_cache_control(response, public=True, max_age=HASHED_MAX_AGE,
+                            immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=UNHASHED_MAX_AGE)
+    return response
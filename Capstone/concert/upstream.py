@@ -0,0 +1,322 @@
+"""Access to the Songs and Pictures services proxied by Capstone pages.
+
+Responses are kept in a Django cache (settings.UPSTREAM_CACHE_ALIAS) so
+that page views do not each call another service:
+
+- within TTL seconds of being fetched, a response is served as is;
+- within the following STALE_TTL seconds, it is still served at once,
+  while a background thread revalidates it (stale-while-revalidate), and
+  it is also served if the service cannot be reached;
+- revalidations send the upstream ETag in If-None-Match, so that a
+  "304 Not Modified" answer only refreshes the age of the cached copy.
+
+Requests go through a shared Session, which keeps connections alive in a
+pool, with connect and read timeouts, retries after a jittered
+exponential backoff, and a circuit breaker per service: once a service
+has failed BREAKER_THRESHOLD times in a row, it is not called for
+BREAKER_RESET seconds, so that a hung service cannot tie up workers.
+
+Async views use the coroutines afetch_json() and aget(), which share the
+cache and the circuit breakers, and send their requests with an httpx
+AsyncClient, one per event loop, closed when the loop finishes, so that
+several services can be called concurrently.
+
+Services are configured in settings.UPSTREAM_SERVICES.
+"""
+import asyncio
+import random
+import threading
+import time
+
+import httpx
+import requests as req
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+
+# Default configuration of a service, see settings.UPSTREAM_SERVICES
+SERVICE_DEFAULTS = {
+    "TTL": 30,
+    "STALE_TTL": 300,
+    "CONNECT_TIMEOUT": 2.0,
+    "READ_TIMEOUT": 5.0,
+    "RETRIES": 2,
+    "BACKOFF": 0.1,
+    "BREAKER_THRESHOLD": 5,
+    "BREAKER_RESET": 30,
+}
+
+# Answers meaning that the service is temporarily unavailable
+RETRY_STATUSES = {502, 503, 504}
+
+# Shared by all the threads of the process; each service host gets its
+# own pool of up to UPSTREAM_POOL_SIZE kept-alive connections
+session = req.Session()
+_adapter = HTTPAdapter(
+    pool_connections=getattr(settings, "UPSTREAM_POOL_CONNECTIONS", 10),
+    pool_maxsize=getattr(settings, "UPSTREAM_POOL_SIZE", 10))
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+
+class UpstreamError(Exception):
+    """Raised when a service cannot be reached and no cached copy of its
+    response is available."""
+
+
+class CircuitBreaker:
+    """Stops calling a service after threshold consecutive failures.
+
+    The circuit then stays open for reset_timeout seconds, after which
+    a single trial call is let through: it closes the circuit if it
+    succeeds, and opens it again otherwise.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: lets this call through, and keeps the others
+                # out until it has completed
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_service(service):
+    # Returns the configuration of service, with its default values
+    config = dict(SERVICE_DEFAULTS)
+    config.update(settings.UPSTREAM_SERVICES[service])
+    return config
+
+
+def get_timeout(config):
+    return (config["CONNECT_TIMEOUT"], config["READ_TIMEOUT"])
+
+
+def get_backoff(config, attempt):
+    # Full jitter keeps the retries of many workers from hitting the
+    # service all at once
+    return random.uniform(0, config["BACKOFF"] * 2 ** attempt)
+
+
+def get_breaker(service):
+    with _breakers_lock:
+        if service not in breakers:
+            config = get_service(service)
+            breakers[service] = CircuitBreaker(config["BREAKER_THRESHOLD"],
+                                               config["BREAKER_RESET"])
+        return breakers[service]
+
+
+def get(service, headers=None):
+    """Sends a GET request to service and returns its response.
+
+    Connection errors, timeouts and 502/503/504 answers are retried up to
+    RETRIES times. Raises UpstreamError if they persist, or if the
+    circuit breaker of the service is open.
+    """
+    config = get_service(service)
+    breaker = get_breaker(service)
+    if not breaker.allow():
+        raise UpstreamError(f"{service} service circuit is open")
+
+    for attempt in range(config["RETRIES"] + 1):
+        if attempt:
+            time.sleep(get_backoff(config, attempt))
+        try:
+            response = session.get(config["URL"], headers=headers,
+                                   timeout=get_timeout(config))
+        except (req.exceptions.ConnectionError, req.exceptions.Timeout) as e:
+            error = e
+            continue
+
+        if response.status_code not in RETRY_STATUSES:
+            breaker.record_success()
+            return response
+        error = f"status code {response.status_code}"
+
+    breaker.record_failure()
+    raise UpstreamError(f"{service} service request failed: {error}")
+
+
+# The AsyncClient of each running event loop, with the task which closes
+# it. Under runserver and WSGI, asgiref runs each async view in an event
+# loop of its own, with asyncio.run(); uvicorn runs one per worker. Both
+# cancel the tasks left when they finish, which closes the client and
+# removes it from here before the loop is closed.
+_async_clients = {}
+
+
+async def _close_with_loop(loop, client):
+    # Waits until the event loop cancels the task as it finishes
+    try:
+        await loop.create_future()
+    finally:
+        del _async_clients[loop]
+        await client.aclose()
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        pool_size = getattr(settings, "UPSTREAM_POOL_SIZE", 10)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size))
+        # The task is kept here, since the loop only holds a weak
+        # reference to it
+        entry = _async_clients[loop] = (
+            client, loop.create_task(_close_with_loop(loop, client)))
+    return entry[0]
+
+
+async def aget(service, headers=None):
+    """Coroutine version of get(), sending the request with httpx."""
+    config = get_service(service)
+    breaker = get_breaker(service)
+    if not breaker.allow():
+        raise UpstreamError(f"{service} service circuit is open")
+
+    connect_timeout, read_timeout = get_timeout(config)
+    timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+    for attempt in range(config["RETRIES"] + 1):
+        if attempt:
+            await asyncio.sleep(get_backoff(config, attempt))
+        try:
+            response = await get_async_client().get(
+                config["URL"], headers=headers, timeout=timeout)
+        except httpx.TransportError as e:
+            error = e
+            continue
+
+        if response.status_code not in RETRY_STATUSES:
+            breaker.record_success()
+            return response
+        error = f"status code {response.status_code}"
+
+    breaker.record_failure()
+    raise UpstreamError(f"{service} service request failed: {error}")
+
+
+def get_cache():
+    return caches[getattr(settings, "UPSTREAM_CACHE_ALIAS", "default")]
+
+
+def cache_key(service):
+    return f"upstream:{service}"
+
+
+def conditional_headers(cached):
+    # Sends the ETag of the cached entry so that the service may answer 304
+    if cached and cached.get("etag"):
+        return {"If-None-Match": cached["etag"]}
+    return {}
+
+
+def make_entry(response, cached):
+    # Builds the cache entry matching the response of service
+    if cached and response.status_code == 304:
+        data, etag = cached["data"], cached["etag"]
+    else:
+        response.raise_for_status()
+        data, etag = response.json(), response.headers.get("ETag")
+    return {"data": data, "etag": etag, "fetched_at": time.time()}
+
+
+def get_entry_timeout(service):
+    config = get_service(service)
+    return config["TTL"] + config["STALE_TTL"]
+
+
+def fetch(service, cached=None):
+    # Calls service and stores its response in the cache. If a cached
+    # entry is given, its ETag is sent so that the service may answer 304.
+    try:
+        response = get(service, conditional_headers(cached))
+        entry = make_entry(response, cached)
+    except (req.exceptions.RequestException, ValueError) as e:
+        raise UpstreamError(f"{service} service request failed: {e}") from e
+
+    get_cache().set(cache_key(service), entry, get_entry_timeout(service))
+    return entry
+
+
+async def afetch(service, cached=None):
+    # Coroutine version of fetch()
+    try:
+        response = await aget(service, conditional_headers(cached))
+        entry = make_entry(response, cached)
+    except (httpx.HTTPError, ValueError) as e:
+        raise UpstreamError(f"{service} service request failed: {e}") from e
+
+    await get_cache().aset(cache_key(service), entry,
+                           get_entry_timeout(service))
+    return entry
+
+
+def revalidate(service, cached):
+    # Refreshes a stale entry; failures leave the stale entry in place
+    try:
+        fetch(service, cached)
+    except UpstreamError as e:
+        print(f"Revalidation failed: {e}")
+    finally:
+        get_cache().delete(cache_key(service) + ":revalidating")
+
+
+def serve_cached(service, cached):
+    # Returns the data of a cached entry. If the entry is stale, a single
+    # thread revalidates it in the background, the add() acting as a lock
+    # against concurrent revalidations.
+    config = get_service(service)
+    age = time.time() - cached["fetched_at"]
+    if age >= config["TTL"] and get_cache().add(
+            cache_key(service) + ":revalidating", True, config["STALE_TTL"]):
+        threading.Thread(target=revalidate, args=(service, cached),
+                         daemon=True).start()
+    return cached["data"]
+
+
+def fetch_json(service):
+    """Returns the JSON document served by service, through the cache.
+
+    Raises UpstreamError if the service cannot be reached and no cached
+    copy of its response is available.
+    """
+    cached = get_cache().get(cache_key(service))
+    if cached is None:
+        return fetch(service)["data"]
+    return serve_cached(service, cached)
+
+
+async def afetch_json(service):
+    """Coroutine version of fetch_json()."""
+    cached = await get_cache().aget(cache_key(service))
+    if cached is None:
+        return (await afetch(service))["data"]
+    return serve_cached(service, cached)
@@ -5,6 +5,9 @@ urlpatterns = [
     re_path(r"^$", views.index, name="index"),
     path("songs/", views.songs, name="songs"),
     path("photos/", views.photos, name="photos"),
+    path("songs/async/", views.songs_async, name="songs_async"),
+    path("photos/async/", views.photos_async, name="photos_async"),
+    path("dashboard/", views.dashboard, name="dashboard"),
     path("login/", views.login_view, name="login"),
     path("logout/", views.logout_view, name="logout"),
     path("signup/", views.signup, name="signup"),
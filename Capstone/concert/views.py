@@ -1,13 +1,21 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.paginator import Paginator
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import reverse
 from django.contrib.auth.hashers import make_password
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
 
 from concert.forms import LoginForm, SignUpForm
+from concert import upstream
 from concert.models import Concert, ConcertAttending
-import requests as req
 
 
 # Create your views here.
@@ -38,23 +46,14 @@ def index(request):
 
 
 def songs(request):
-    # Define the URL for fetching songs data
-    song_url = "http://songs:8000/song"
-
     try:
-        # Send a GET request to the specified URL
-        response = req.get(song_url)
-
-        # Check if the request was successful
-        response.raise_for_status()
-
-        # Parse the JSON response into a Python dictionary
-        songs = response.json()
+        # Fetches the songs data from the Songs service, through the cache
+        songs = upstream.fetch_json("songs")
 
         # Render the songs data into the template
         return render(request, "songs.html", {"songs": songs["songs"]})
 
-    except req.exceptions.RequestException as e:
+    except upstream.UpstreamError as e:
         # Print any request-related errors to the console
         print(f"Request failed: {e}")
 
@@ -65,12 +64,72 @@ def songs(request):
 
 
 def photos(request):
-    picture_url = "http://pictures:3000/picture"
+    try:
+        # Fetches the pictures from the Pictures service, through the cache
+        photos = upstream.fetch_json("pictures")
+    except upstream.UpstreamError as e:
+        print(f"Request failed: {e}")
+        photos = []
 
-    photos = req.get(picture_url).json()
     return render(request, "photos.html", {"photos": photos})
 
 
+async def songs_async(request):
+    # Same page as songs, served without blocking a worker thread
+    # while the Songs service answers
+    try:
+        songs = (await upstream.afetch_json("songs"))["songs"]
+    except upstream.UpstreamError as e:
+        print(f"Request failed: {e}")
+        songs = []
+
+    return await sync_to_async(render)(request, "songs.html",
+                                       {"songs": songs})
+
+
+async def photos_async(request):
+    # Same page as photos, served without blocking a worker thread
+    # while the Pictures service answers
+    try:
+        photos = await upstream.afetch_json("pictures")
+    except upstream.UpstreamError as e:
+        print(f"Request failed: {e}")
+        photos = []
+
+    return await sync_to_async(render)(request, "photos.html",
+                                       {"photos": photos})
+
+
+async def dashboard(request):
+    # Fetches the songs and the photos concurrently, so that the page
+    # takes as long as the slower of the two services, not their sum
+    songs, photos = await asyncio.gather(
+        upstream.afetch_json("songs"),
+        upstream.afetch_json("pictures"),
+        return_exceptions=True)
+
+    if isinstance(songs, upstream.UpstreamError):
+        print(f"Request failed: {songs}")
+        songs = []
+    elif isinstance(songs, BaseException):
+        raise songs
+    else:
+        songs = songs["songs"]
+
+    if isinstance(photos, upstream.UpstreamError):
+        print(f"Request failed: {photos}")
+        photos = []
+    elif isinstance(photos, BaseException):
+        raise photos
+
+    # Rendering reads request.user, hence the session from the database,
+    # which must be done from a synchronous context
+    return await sync_to_async(render)(request, "dashboard.html", {
+        "songs": songs,
+        "photos": photos
+    })
+
+
 def login_view(request):
     # Initializes the form. If it's a POST request, it's pre-filled with data.
     # For a GET request, it's empty.
@@ -99,21 +158,60 @@ def logout_view(request):
     return HttpResponseRedirect(reverse("login"))
 
 
+def parse_date_filter(value):
+    # Returns the date given as YYYY-MM-DD in a query string argument,
+    # or None if it is missing or invalid, so that the filter is ignored
+    try:
+        return parse_date(value or "")
+    except ValueError:
+        return None
+
+
 def concerts(request):
     if request.user.is_authenticated:
-        lst_of_concert = []
+        # Filters and orders the concerts in the database, where they are
+        # served by the indexes on date and (city, date)
         concert_objects = Concert.objects.all()
-        for item in concert_objects:
-            try:
-                status = item.attendee.filter(
-                    user=request.user).first().attending
-            except AttributeError:
-                status = "-"
-            lst_of_concert.append({
-                "concert": item,
-                "status": status
-            })
-        return render(request, "concerts.html", {"concerts": lst_of_concert})
+        city = request.GET.get("city", "").strip()
+        date_from = parse_date_filter(request.GET.get("from"))
+        date_to = parse_date_filter(request.GET.get("to"))
+        if city:
+            concert_objects = concert_objects.filter(city=city)
+        if date_from:
+            concert_objects = concert_objects.filter(date__gte=date_from)
+        if date_to:
+            concert_objects = concert_objects.filter(date__lte=date_to)
+
+        # Fetches the concerts together with the attending status of the
+        # current user in a single query, instead of one query per concert
+        user_status = ConcertAttending.objects.filter(
+            concert=OuterRef("pk"), user=request.user).values("attending")[:1]
+        concert_objects = concert_objects.annotate(
+            status=Coalesce(Subquery(user_status),
+                            Value(ConcertAttending.AttendingChoices.NOTHING))
+        ).order_by("date", "id")
+
+        # Only the rows of the requested page are fetched
+        paginator = Paginator(concert_objects,
+                              getattr(settings, "CONCERTS_PAGE_SIZE", 25))
+        page_obj = paginator.get_page(request.GET.get("page"))
+        lst_of_concert = [{
+            "concert": item,
+            "status": item.status
+        } for item in page_obj]
+
+        # Keeps the filters in the links to the other pages
+        filters = request.GET.copy()
+        filters.pop("page", None)
+
+        return render(request, "concerts.html", {
+            "concerts": lst_of_concert,
+            "page_obj": page_obj,
+            "city": city,
+            "date_from": date_from,
+            "date_to": date_to,
+            "filters": filters.urlencode()
+        })
     else:
         return HttpResponseRedirect(reverse("login"))
 
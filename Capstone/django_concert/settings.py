@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # Compresses the pages with brotli or gzip, see concert/compression.py
+    "concert.compression.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -129,11 +131,76 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 STATIC_ROOT = os.path.join(PROJECT_ROOT, 'static')
 
+# STATIC_PRECOMPRESSED: collectstatic writes hashed and precompressed
+# copies of the static files into STATIC_ROOT, which Capstone then serves
+# itself, see concert/staticfiles.py. Set by the Docker image build,
+# which runs collectstatic, and by serve.sh in production.
+STATIC_PRECOMPRESSED = (
+    os.environ.get("STATIC_PRECOMPRESSED", "false").lower() == "true")
+if STATIC_PRECOMPRESSED:
+    STORAGES = {
+        "default": {
+            "BACKEND": "django.core.files.storage.FileSystemStorage",
+        },
+        "staticfiles": {
+            "BACKEND": ("concert.staticfiles."
+                        "PrecompressedManifestStaticFilesStorage"),
+        },
+    }
+
 # Actual directory user files go to
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), "media")
 # URL used to access the media
 MEDIA_URL = "/media/"
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The "upstream" cache holds the responses of the Songs and Pictures
+# services. A FileBasedCache can be used instead, to share it between
+# worker processes and keep it across restarts.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "upstream": {
+        "BACKEND": os.environ.get(
+            "UPSTREAM_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("UPSTREAM_CACHE_LOCATION", "upstream"),
+    },
+}
+
+# Services whose responses are proxied by the songs and photos pages.
+# Responses are served from the cache for TTL seconds, then served stale
+# while being revalidated for STALE_TTL more seconds. Each service may
+# also set CONNECT_TIMEOUT and READ_TIMEOUT (seconds), RETRIES, BACKOFF
+# (seconds), BREAKER_THRESHOLD and BREAKER_RESET (seconds), whose default
+# values are in concert/upstream.py.
+UPSTREAM_CACHE_ALIAS = "upstream"
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "10"))
+UPSTREAM_SERVICES = {
+    "songs": {
+        "URL": os.environ.get("SONGS_URL", "http://songs:8000/song"),
+        "TTL": int(os.environ.get("SONGS_CACHE_TTL", "30")),
+        "STALE_TTL": int(os.environ.get("SONGS_CACHE_STALE_TTL", "300")),
+        "CONNECT_TIMEOUT": float(os.environ.get("SONGS_CONNECT_TIMEOUT", "2")),
+        "READ_TIMEOUT": float(os.environ.get("SONGS_READ_TIMEOUT", "5")),
+    },
+    "pictures": {
+        "URL": os.environ.get("PICTURES_URL",
+                              "http://pictures:3000/picture"),
+        "TTL": int(os.environ.get("PICTURES_CACHE_TTL", "30")),
+        "STALE_TTL": int(os.environ.get("PICTURES_CACHE_STALE_TTL", "300")),
+        "CONNECT_TIMEOUT": float(
+            os.environ.get("PICTURES_CONNECT_TIMEOUT", "2")),
+        "READ_TIMEOUT": float(os.environ.get("PICTURES_READ_TIMEOUT", "5")),
+    },
+}
+
+# Number of concerts displayed per page of the concerts list
+CONCERTS_PAGE_SIZE = 25
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -14,11 +14,20 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+import re
+
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from concert.staticfiles import serve_static
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("concert.urls")),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+# Precompressed static files, collected when the image is built
+if settings.STATIC_PRECOMPRESSED:
+    urlpatterns.append(re_path(
+        r"^%s(?P<path>.*)$" % re.escape(settings.STATIC_URL.lstrip("/")),
+        serve_static))
@@ -0,0 +1,47 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings of the production serving mode of Capstone
+(SERVER_MODE=production, see serve.sh).
+
+Gunicorn manages uvicorn workers, which serve the ASGI application of
+django_concert/asgi.py: the async views, which the navigation bar links
+to, wait for the Songs and Pictures services without holding a worker.
+The sync views, such as the concerts, login and admin pages, are run by
+Django on a single thread per worker, one request at a time, so that a
+slow one delays the others of its worker: the workers are sized for them.
+Each setting can be overridden with the environment variable named in its
+comment, and sending SIGHUP to the master process replaces the workers
+gracefully.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+wsgi_app = "django_concert.asgi:application"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# GUNICORN_WORKERS: the usual (2 x cores) + 1, since each worker only
+# runs one sync view at a time
+workers = int(os.environ.get("GUNICORN_WORKERS",
+                             multiprocessing.cpu_count() * 2 + 1))
+
+# GUNICORN_PRELOAD: imports Django once in the master process, before
+# forking the workers
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# GUNICORN_KEEPALIVE: seconds an idle browser connection is kept open
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+# GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT: a silent worker is killed
+# after timeout seconds; on reload or shutdown, workers get
+# graceful_timeout seconds to finish their in-flight requests
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# GUNICORN_MAX_REQUESTS: workers are recycled after this many requests,
+# with some jitter so that they do not all restart at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
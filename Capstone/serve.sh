@@ -0,0 +1,21 @@
+#!/bin/sh
+# Starts Capstone with the server selected by SERVER_MODE:
+# - development (default): Django's runserver, with autoreload;
+# - production: gunicorn with uvicorn workers, see gunicorn.conf.py.
+
+if [ "$SERVER_MODE" = "production" ]; then
+  # Capstone serves the hashed and precompressed static files itself,
+  # collected when the image is built. Mounting the source tree over the
+  # image, as docker-compose.yml does, hides them: collect them again.
+  export STATIC_PRECOMPRESSED=true
+  if [ ! -f django_concert/static/staticfiles.json ]; then
+    echo "Collecting the static files..."
+    python manage.py collectstatic --noinput
+  fi
+
+  echo "Starting Capstone with gunicorn and uvicorn workers..."
+  exec gunicorn -c gunicorn.conf.py
+fi
+
+echo "Starting Capstone with the development server..."
+exec python manage.py runserver 0.0.0.0:"${PORT:-8000}"
@@ -1,10 +1,27 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import os
+import tempfile
+import threading
+import time
+
+import httpx
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
 from concert.models import Concert, ConcertAttending
+from concert import upstream
+from concert.staticfiles import serve_static
 from concert.forms import LoginForm
 from datetime import date
 from unittest.mock import patch, MagicMock
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.test import RequestFactory
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 
 # Checks that the "index" view uses the right template
@@ -31,7 +48,11 @@ class SongViewTest(TestCase):
     # This test ensures the songs view is accessible, renders the correct
     #  template and passes the expected song data to the template context.
 
-    @patch('requests.get')
+    def setUp(self: 'SongViewTest') -> None:
+        # Make sure the songs are fetched, not read from a previous test
+        caches[settings.UPSTREAM_CACHE_ALIAS].clear()
+
+    @patch('concert.upstream.session.get')
     def test_songs_view_renders_correctly_with_data(
         self: 'SongViewTest',
         mock_get: MagicMock
@@ -54,6 +75,8 @@ class SongViewTest(TestCase):
 
         # The returned object must have a .json() method that returns our expected data
         mock_response.json.return_value = {"songs": expected_songs_list}
+        mock_response.status_code = 200
+        mock_response.headers = {}
 
         # Simulate a GET request to the 'songs' URL
         # This call will now use the MOCKED requests.get function.
@@ -85,11 +108,15 @@ class PhotosViewTest(TestCase):
     # This test ensures the photos view is accessible, renders the correct
     # template and passes the expected photo data to the template context.
 
+    def setUp(self: 'PhotosViewTest') -> None:
+        # Make sure the photos are fetched, not read from a previous test
+        caches[settings.UPSTREAM_CACHE_ALIAS].clear()
+
     # This test uses mocking to simulate the external API call :
     # Uses @patch to simulate the 'request.get' calL within the photos view.
     # The mocked function is passed as an argument (mock_get)
 
-    @patch('requests.get')
+    @patch('concert.upstream.session.get')
     def test_photos_view_renders_correctly_with_data(
         self: 'PhotosViewTest',
         mock_get: MagicMock
@@ -111,6 +138,8 @@ class PhotosViewTest(TestCase):
 
         # The returned object must have a .json() method that returns our expected data
         mock_response.json.return_value = expected_photos_data
+        mock_response.status_code = 200
+        mock_response.headers = {}
 
         # 3. Simulate a GET request to the 'photos' URL.
         response = self.client.get(reverse('photos'))
@@ -132,6 +161,214 @@ class PhotosViewTest(TestCase):
         self.assertContains(response, "dummyimage.com")
 
 
+# Checks that the responses of the upstream services are cached
+# and revalidated with their ETag
+class UpstreamCacheTest(TestCase):
+    def setUp(self: 'UpstreamCacheTest') -> None:
+        caches[settings.UPSTREAM_CACHE_ALIAS].clear()
+        upstream.breakers.clear()
+
+    def mock_response(self: 'UpstreamCacheTest',
+                      mock_get: MagicMock,
+                      status_code: int = 200) -> MagicMock:
+        mock_response = mock_get.return_value
+        mock_response.status_code = status_code
+        mock_response.headers = {"ETag": '"v1"'}
+        mock_response.json.return_value = [{"id": 1}]
+        return mock_response
+
+    # A fresh cached response is served without calling the service
+    @patch('concert.upstream.session.get')
+    def test_fresh_response_is_served_from_cache(
+        self: 'UpstreamCacheTest',
+        mock_get: MagicMock
+    ) -> None:
+        self.mock_response(mock_get)
+        self.assertEqual(upstream.fetch_json("pictures"), [{"id": 1}])
+        self.assertEqual(upstream.fetch_json("pictures"), [{"id": 1}])
+        self.assertEqual(mock_get.call_count, 1)
+
+    # An expired response is revalidated with If-None-Match,
+    # and kept when the service answers 304
+    @patch('concert.upstream.session.get')
+    def test_expired_response_is_revalidated_with_etag(
+        self: 'UpstreamCacheTest',
+        mock_get: MagicMock
+    ) -> None:
+        self.mock_response(mock_get)
+        entry = upstream.fetch("pictures")
+
+        self.mock_response(mock_get, status_code=304)
+        entry = upstream.fetch("pictures", entry)
+        self.assertEqual(entry["data"], [{"id": 1}])
+        self.assertEqual(mock_get.call_args.kwargs["headers"],
+                         {"If-None-Match": '"v1"'})
+
+    # A stale response is served right away, even if the service is down
+    @patch('concert.upstream.session.get')
+    def test_stale_response_is_served_when_service_fails(
+        self: 'UpstreamCacheTest',
+        mock_get: MagicMock
+    ) -> None:
+        self.mock_response(mock_get)
+        entry = upstream.fetch("pictures")
+        entry["fetched_at"] -= settings.UPSTREAM_SERVICES["pictures"]["TTL"]
+        caches[settings.UPSTREAM_CACHE_ALIAS].set(
+            upstream.cache_key("pictures"), entry)
+
+        mock_get.side_effect = upstream.req.exceptions.ConnectionError()
+        mock_get.reset_mock()
+        # The revalidation thread is joined while the service is mocked
+        threads = []
+        thread_class = threading.Thread
+
+        def start_thread(*args, **kwargs) -> threading.Thread:
+            threads.append(thread_class(*args, **kwargs))
+            return threads[-1]
+
+        with patch('concert.upstream.threading.Thread',
+                   side_effect=start_thread):
+            response = self.client.get(reverse('photos'))
+        self.assertEqual(response.context['photos'], [{"id": 1}])
+        for thread in threads:
+            thread.join()
+
+        # A single revalidation, with the ETag, left the stale entry in
+        # place and released its lock
+        self.assertEqual(len(threads), 1)
+        self.assertEqual(mock_get.call_args.kwargs["headers"],
+                         {"If-None-Match": '"v1"'})
+        cache = caches[settings.UPSTREAM_CACHE_ALIAS]
+        self.assertEqual(cache.get(upstream.cache_key("pictures"))["data"],
+                         [{"id": 1}])
+        self.assertIsNone(cache.get(upstream.cache_key("pictures")
+                                    + ":revalidating"))
+
+    # Without cached response, a failing service gives an empty page
+    @patch('concert.upstream.session.get')
+    def test_photos_view_renders_when_service_fails(
+        self: 'UpstreamCacheTest',
+        mock_get: MagicMock
+    ) -> None:
+        mock_get.side_effect = upstream.req.exceptions.ConnectionError()
+        response = self.client.get(reverse('photos'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['photos'], [])
+
+
+# Checks the retries, timeouts and circuit breaker of upstream requests
+@override_settings(UPSTREAM_SERVICES={
+    "pictures": {"URL": "http://pictures:3000/picture", "RETRIES": 2,
+                 "BACKOFF": 0, "BREAKER_THRESHOLD": 2, "BREAKER_RESET": 60,
+                 "CONNECT_TIMEOUT": 1, "READ_TIMEOUT": 3}
+})
+class UpstreamClientTest(TestCase):
+    def setUp(self: 'UpstreamClientTest') -> None:
+        upstream.breakers.clear()
+
+    # Failures are retried, with the configured timeouts
+    @patch('concert.upstream.session.get')
+    def test_get_retries_then_succeeds(
+        self: 'UpstreamClientTest',
+        mock_get: MagicMock
+    ) -> None:
+        unavailable, ok = MagicMock(status_code=503), MagicMock(status_code=200)
+        mock_get.side_effect = [upstream.req.exceptions.Timeout(),
+                                unavailable, ok]
+        self.assertIs(upstream.get("pictures"), ok)
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(mock_get.call_args.kwargs["timeout"], (1, 3))
+
+    # After BREAKER_THRESHOLD failed requests, the service is not called
+    @patch('concert.upstream.session.get')
+    def test_circuit_opens_after_failures(
+        self: 'UpstreamClientTest',
+        mock_get: MagicMock
+    ) -> None:
+        mock_get.side_effect = upstream.req.exceptions.ConnectionError()
+        for _ in range(2):
+            with self.assertRaises(upstream.UpstreamError):
+                upstream.get("pictures")
+        self.assertEqual(mock_get.call_count, 6)
+
+        with self.assertRaises(upstream.UpstreamError):
+            upstream.get("pictures")
+        self.assertEqual(mock_get.call_count, 6)
+
+    # Each event loop gets its client, closed when the loop finishes
+    def test_async_client_closed_with_its_loop(
+        self: 'UpstreamClientTest'
+    ) -> None:
+        async def get_client() -> httpx.AsyncClient:
+            client = upstream.get_async_client()
+            self.assertIs(upstream.get_async_client(), client)
+            return client
+
+        first = asyncio.run(get_client())
+        second = asyncio.run(get_client())
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed and second.is_closed)
+        self.assertEqual(upstream._async_clients, {})
+
+
+# Checks that the async views fetch the upstream services concurrently
+class AsyncViewsTest(TestCase):
+    def setUp(self: 'AsyncViewsTest') -> None:
+        caches[settings.UPSTREAM_CACHE_ALIAS].clear()
+        upstream.breakers.clear()
+
+        async def get(url: str, **kwargs) -> httpx.Response:
+            # Each service takes 0.3 second to answer
+            await asyncio.sleep(0.3)
+            if "song" in url:
+                payload = {"songs": [{"id": 1, "title": "Async Song",
+                                      "lyrics": "Async lyrics"}]}
+            else:
+                payload = [{"id": 1, "pic_url": "http://dummyimage.com/1.png",
+                            "event_city": "Lyon", "event_state": "Rhone",
+                            "event_date": "11/2/2022"}]
+            return httpx.Response(200, json=payload,
+                                  request=httpx.Request("GET", url))
+
+        patcher = patch('concert.upstream.get_async_client')
+        self.mock_client = patcher.start().return_value
+        self.mock_client.get.side_effect = get
+        self.addCleanup(patcher.stop)
+
+    def test_dashboard_fetches_services_concurrently(
+        self: 'AsyncViewsTest'
+    ) -> None:
+        started = time.monotonic()
+        response = self.client.get(reverse('dashboard'))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'dashboard.html')
+        self.assertContains(response, "Async Song")
+        self.assertContains(response, "Lyon")
+        self.assertEqual(self.mock_client.get.call_count, 2)
+        # Sequential calls would take at least 0.6 second
+        self.assertLess(elapsed, 0.55)
+
+    def test_async_songs_and_photos_views(self: 'AsyncViewsTest') -> None:
+        response = self.client.get(reverse('songs_async'))
+        self.assertTemplateUsed(response, 'songs.html')
+        self.assertContains(response, "Async lyrics")
+
+        response = self.client.get(reverse('photos_async'))
+        self.assertTemplateUsed(response, 'photos.html')
+        self.assertContains(response, "Lyon")
+
+    def test_dashboard_renders_when_a_service_fails(
+        self: 'AsyncViewsTest'
+    ) -> None:
+        self.mock_client.get.side_effect = httpx.ConnectError("refused")
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['songs'], [])
+        self.assertEqual(response.context['photos'], [])
+
+
 # Checks that the "login" view uses the right template
 # and handles authentication scenarios
 class LoginViewTest(TestCase):
@@ -422,3 +659,116 @@ class ConcertsViewTest(TestCase):
                             self.concert2.concert_name)
         self.assertContains(response,
                             ConcertAttending.AttendingChoices.NOTHING)
+
+    # This test ensures that the number of SQL queries run by the concerts
+    # view does not depend on the number of concerts.
+    def test_concerts_view_query_count_is_constant(self: 'ConcertsViewTest') -> None:
+        self.client.force_login(self.user)
+
+        with CaptureQueriesContext(connection) as few_concerts:
+            self.client.get(reverse('concerts'))
+
+        for index in range(10):
+            concert = Concert.objects.create(
+                concert_name=f"Concert {index}",
+                duration=60,
+                city="Nantes",
+                date=date(2025, 10, index + 1)
+            )
+            ConcertAttending.objects.create(
+                concert=concert,
+                user=self.user,
+                attending=ConcertAttending.AttendingChoices.NOT_ATTENDING
+            )
+
+        with CaptureQueriesContext(connection) as many_concerts:
+            response = self.client.get(reverse('concerts'))
+
+        self.assertEqual(len(response.context['concerts']), 12)
+        self.assertEqual(len(many_concerts), len(few_concerts))
+
+    # This test ensures that the concerts are filtered by city and date
+    # range, ordered by date and split into pages.
+    @override_settings(CONCERTS_PAGE_SIZE=1)
+    def test_concerts_view_filters_and_paginates(self: 'ConcertsViewTest') -> None:
+        self.client.force_login(self.user)
+        Concert.objects.create(concert_name="Opera Gala", duration=150,
+                               city="Paris", date=date(2025, 7, 1))
+
+        response = self.client.get(reverse('concerts'), {'city': 'Paris'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+        self.assertEqual(
+            [item['concert'].concert_name
+             for item in response.context['concerts']],
+            ["Opera Gala"])
+
+        response = self.client.get(reverse('concerts'),
+                                   {'city': 'Paris', 'page': 2})
+        self.assertEqual(
+            [item['concert'].concert_name
+             for item in response.context['concerts']],
+            ["Rock Festival"])
+        self.assertContains(response, "?city=Paris&page=1")
+
+        response = self.client.get(reverse('concerts'),
+                                   {'from': '2025-08-01', 'to': '2025-08-31'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        self.assertEqual(response.context['concerts'][0]['concert'],
+                         self.concert1)
+
+        # Invalid dates are ignored
+        response = self.client.get(reverse('concerts'), {'from': '2025-02-30'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 3)
+
+
+# Checks that pages and static files are sent compressed to the browsers
+# which accept it
+class CompressionTest(TestCase):
+    def test_page_is_compressed_when_accepted(self: 'CompressionTest') -> None:
+        response = self.client.get(reverse('index'),
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn(b'</html>', gzip.decompress(response.content))
+
+        response = self.client.get(reverse('index'),
+                                   HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn(b'</html>', response.content)
+
+    def test_collected_static_files_are_precompressed(
+            self: 'CompressionTest') -> None:
+        with tempfile.TemporaryDirectory() as source, \
+                tempfile.TemporaryDirectory() as root:
+            css = "body { color: black; }\n" * 200
+            with open(os.path.join(source, 'site.css'), 'w') as css_file:
+                css_file.write(css)
+
+            storages = dict(settings.STORAGES, staticfiles={
+                'BACKEND': ('concert.staticfiles.'
+                            'PrecompressedManifestStaticFilesStorage')})
+            with override_settings(STATICFILES_DIRS=[source],
+                                   STATIC_ROOT=root, STORAGES=storages):
+                call_command('collectstatic', interactive=False, verbosity=0)
+                hashed_name = staticfiles_storage.stored_name('site.css')
+                self.assertTrue(os.path.isfile(
+                    os.path.join(root, hashed_name + '.gz')))
+
+                request = RequestFactory().get(
+                    '/static/' + hashed_name, HTTP_ACCEPT_ENCODING='gzip')
+                response = serve_static(request, hashed_name)
+                body = b''.join(response.streaming_content)
+                response.close()
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertEqual(response['Content-Type'], 'text/css')
+                self.assertIn('immutable', response['Cache-Control'])
+                self.assertEqual(gzip.decompress(body).decode(), css)
+
+                # Unhashed names are compressed too, but not cached long
+                request = RequestFactory().get('/static/site.css')
+                response = serve_static(request, 'site.css')
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertNotIn('immutable', response['Cache-Control'])
+                self.assertTrue(os.path.isfile(
+                    os.path.join(root, 'site.css.gz')))
+                response.close()
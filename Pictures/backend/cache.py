@@ -0,0 +1,98 @@
+import hashlib
+from typing import Any, Dict, Optional, Tuple
+
+from flask import Response, json as flask_json, request
+
+from .compression import COMPRESS_MIN_SIZE, choose_encoding, compress
+from .store import PictureSnapshot, PictureStore, picture_key
+
+
+class EncodedBody:
+    """A JSON body encoded once, with its strong ETag and, on demand, its
+    compressed forms."""
+
+    def __init__(self, payload: Any) -> None:
+        self.body: bytes = (flask_json.dumps(payload) + "\n").encode("utf-8")
+        self.etag: str = hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        self._compressed: Dict[str, bytes] = {}
+
+    def compressed(self, encoding: str) -> bytes:
+        """Returns the body compressed with encoding, one of ENCODINGS."""
+        data = self._compressed.get(encoding)
+        if data is None:
+            data = self._compressed[encoding] = compress(self.body, encoding)
+        return data
+
+    def to_response(self, status: int = 200) -> Response:
+        """Builds the response for the current request, compressed when
+        the client accepts it and answered with 304 Not Modified when its
+        If-None-Match header matches the ETag."""
+        encoding = None
+        if len(self.body) >= COMPRESS_MIN_SIZE:
+            encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is not None:
+            response = Response(self.compressed(encoding), status=status,
+                                mimetype="application/json")
+            response.headers["Content-Encoding"] = encoding
+            # Each encoding is a distinct representation, hence its own ETag
+            response.set_etag(f"{self.etag}-{encoding}")
+        else:
+            response = Response(self.body, status=status,
+                                mimetype="application/json")
+            response.set_etag(self.etag)
+
+        response.vary.add("Accept-Encoding")
+        return response.make_conditional(request)
+
+
+class _Entries:
+    """The bodies encoded from one version of the store."""
+
+    def __init__(self, version: int) -> None:
+        self.version = version
+        self.catalogue: Optional[EncodedBody] = None
+        self.pictures: Dict[Any, EncodedBody] = {}
+
+
+class ResponseCache:
+    """Pre-encoded bodies of the catalogue and of single pictures.
+
+    Entries are tagged with the version of the store they were encoded
+    from. Any write to the store bumps its version, which discards every
+    entry on the next read, so the routes never serve stale data.
+
+    Each read encodes from a single snapshot of the store, and only uses
+    entries of the same version, so that requests served by concurrent
+    threads need no lock: at worst, two of them encode the same body.
+    """
+
+    def __init__(self, store: PictureStore) -> None:
+        self._store = store
+        self._entries = _Entries(-1)
+
+    def _current(self) -> Tuple[PictureSnapshot, _Entries]:
+        snapshot = self._store.snapshot()
+        entries = self._entries
+        if entries.version != snapshot.version:
+            entries = self._entries = _Entries(snapshot.version)
+        return snapshot, entries
+
+    def catalogue(self) -> EncodedBody:
+        """Returns the encoded list of every picture."""
+        snapshot, entries = self._current()
+        if entries.catalogue is None:
+            entries.catalogue = EncodedBody(snapshot.to_list())
+        return entries.catalogue
+
+    def picture(self, picture_id: Any) -> Optional[EncodedBody]:
+        """Returns the encoded picture whose ID is picture_id, or None if
+        no picture has this ID."""
+        snapshot, entries = self._current()
+        key = picture_key(picture_id)
+        encoded = entries.pictures.get(key)
+        if encoded is None:
+            picture = snapshot.get(key)
+            if picture is None:
+                return None
+            encoded = entries.pictures[key] = EncodedBody(picture)
+        return encoded
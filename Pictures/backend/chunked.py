@@ -0,0 +1,378 @@
+"""Copy-on-write containers holding the indexes of the picture catalogue.
+
+A published PictureSnapshot is never changed: writes are applied to a
+copy of it. Copying plain dicts and lists of a million entries takes tens
+of milliseconds, so the indexes are split into pieces of at most a few
+thousand entries instead. copy() only copies the list of the pieces,
+which are then shared by both containers, and a write copies a piece the
+first time it changes it. A single write thus costs time proportional to
+the number and size of the pieces, about the square root of the size of
+the catalogue, instead of its size.
+
+The dicts are split by hash, and only their changes are: a whole
+catalogue loaded at startup is wrapped as it is, without being split.
+"""
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Set, Tuple)
+
+# Number of dicts a ShardedDict is split into, a power of two
+SHARDS = 1024
+_SHARD_MASK = SHARDS - 1
+
+# Number of entries of the chunks of a new SortedChunks. Chunks growing
+# past twice this size are split.
+CHUNK_SIZE = 512
+
+# Marks the keys of the base of a ShardedDict deleted since
+_DELETED = object()
+
+_Span = Tuple[List[Any], List[Any], int, int]
+
+
+class ShardedDict:
+    """A dict made of a base dict, shared by all the copies and never
+    changed, and of the changes made since, split into up to SHARDS dicts
+    by the hash of the keys.
+
+    The changes are merged into a new base by the copy() which finds them
+    more numerous than the entries of the base, so that they never take
+    more memory than the base, and the copies made between two merges
+    cost O(SHARDS) at most: only the shards holding changes are listed.
+    Iteration follows neither the insertion order nor the order of the
+    keys.
+    """
+
+    __slots__ = ("_base", "shards", "_owned", "_changes", "_len")
+
+    def __init__(self, base: Optional[Dict[Any, Any]] = None) -> None:
+        """Wraps base, which must not be changed afterwards."""
+        self._base: Dict[Any, Any] = {} if base is None else base
+        # Index -> changed keys of the shard, with their new value or
+        # _DELETED
+        self.shards: Dict[int, Dict[Any, Any]] = {}
+        # Indexes of the shards which no other container shares
+        self._owned: Set[int] = set()
+        self._changes = 0
+        self._len = len(self._base)
+
+    def copy(self) -> "ShardedDict":
+        """Returns a copy sharing the shards of this dict, which both
+        copy before changing them."""
+        if self._changes > len(self._base):
+            return ShardedDict(dict(self.items()))
+
+        copy = ShardedDict.__new__(ShardedDict)
+        copy._base = self._base
+        copy.shards = dict(self.shards)
+        copy._owned = set()
+        copy._changes = self._changes
+        copy._len = self._len
+        self._owned = set()
+        return copy
+
+    def _writable(self, key: Any) -> Dict[Any, Any]:
+        index = hash(key) & _SHARD_MASK
+        if index not in self._owned:
+            self.shards[index] = dict(self.shards.get(index, ()))
+            self._owned.add(index)
+        return self.shards[index]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        shard = self.shards.get(hash(key) & _SHARD_MASK)
+        if shard is not None and key in shard:
+            value = shard[key]
+            return default if value is _DELETED else value
+        return self._base.get(key, default)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _DELETED) is not _DELETED
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self.get(key, _DELETED)
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        if key not in self:
+            self._len += 1
+        shard = self._writable(key)
+        if key not in shard:
+            self._changes += 1
+        shard[key] = value
+
+    def __delitem__(self, key: Any) -> None:
+        if key not in self:
+            raise KeyError(key)
+        shard = self._writable(key)
+        if key in self._base:
+            if key not in shard:
+                self._changes += 1
+            shard[key] = _DELETED
+        else:
+            del shard[key]
+            self._changes -= 1
+        self._len -= 1
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        """Removes key and returns its value, or default if it is absent."""
+        value = self.get(key, _DELETED)
+        if value is _DELETED:
+            return default
+        del self[key]
+        return value
+
+    def __iter__(self) -> Iterator[Any]:
+        return (key for key, _ in self.items())
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        shards = self.shards
+        if not shards:
+            yield from self._base.items()
+            return
+
+        for key, value in self._base.items():
+            shard = shards.get(hash(key) & _SHARD_MASK)
+            if shard is None or key not in shard:
+                yield key, value
+        for shard in shards.values():
+            for key, value in shard.items():
+                if value is not _DELETED:
+                    yield key, value
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (ShardedDict, dict)):
+            return len(self) == len(other) and dict(self.items()) == dict(
+                other.items())
+        return NotImplemented
+
+
+class SortedChunks:
+    """A list of (key, value) entries sorted by key, split into chunks.
+
+    Entries with equal keys stay in the order they were inserted in, as
+    after a stable sort. Positions are those of the whole list.
+    """
+
+    __slots__ = ("chunks", "_values", "_maxes", "_owned", "_len")
+
+    def __init__(self, keys: Iterable[Any] = (),
+                 values: Optional[Iterable[Any]] = None) -> None:
+        """Builds the list from keys, already sorted, and their values,
+        the keys themselves by default."""
+        keys = list(keys)
+        values = keys if values is None else list(values)
+        bounds = range(0, len(keys), CHUNK_SIZE)
+        # Chunks of keys, and of their values
+        self.chunks = [keys[i:i + CHUNK_SIZE] for i in bounds]
+        self._values = [values[i:i + CHUNK_SIZE] for i in bounds]
+        # Last key of each chunk
+        self._maxes = [chunk[-1] for chunk in self.chunks]
+        # IDs of the chunks of keys which no other list shares
+        self._owned: Set[int] = {id(chunk) for chunk in self.chunks}
+        self._len = len(keys)
+
+    def copy(self) -> "SortedChunks":
+        """Returns a copy sharing the chunks of this list, which both copy
+        before changing them."""
+        copy = SortedChunks.__new__(SortedChunks)
+        copy.chunks = list(self.chunks)
+        copy._values = list(self._values)
+        copy._maxes = list(self._maxes)
+        copy._owned = set()
+        copy._len = self._len
+        self._owned = set()
+        return copy
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, SortedChunks):
+            return len(self) == len(other) and list(self.items()) == list(
+                other.items())
+        return NotImplemented
+
+    def _writable(self, index: int) -> Tuple[List[Any], List[Any]]:
+        if id(self.chunks[index]) not in self._owned:
+            self.chunks[index] = list(self.chunks[index])
+            self._values[index] = list(self._values[index])
+            self._owned.add(id(self.chunks[index]))
+        return self.chunks[index], self._values[index]
+
+    def _offset(self, index: int) -> int:
+        # Position of the first entry of the chunk index
+        return sum(map(len, islice(self.chunks, index)))
+
+    def bisect_left(self, key: Any) -> int:
+        """Returns the position of the first entry whose key is not less
+        than key."""
+        index = bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            return self._len
+        return self._offset(index) + bisect_left(self.chunks[index], key)
+
+    def bisect_right(self, key: Any) -> int:
+        """Returns the position of the first entry whose key is greater
+        than key."""
+        index = bisect_right(self._maxes, key)
+        if index == len(self._maxes):
+            return self._len
+        return self._offset(index) + bisect_right(self.chunks[index], key)
+
+    def insert(self, key: Any, value: Any,
+               rank: Optional[Callable[[Any], Any]] = None) -> None:
+        """Inserts an entry after those with the same key, or with rank,
+        among them, before the first whose value has a greater rank.
+
+        Args:
+            key (Any): The key of the entry.
+            value (Any): Its value.
+            rank (Callable): The function of the values by which the
+                entries with the same key are kept sorted, if any.
+        """
+        if not self.chunks:
+            self.chunks.append([key])
+            self._values.append([value])
+            self._maxes.append(key)
+            self._owned.add(id(self.chunks[0]))
+            self._len = 1
+            return
+
+        if rank is None:
+            index = min(bisect_right(self._maxes, key), len(self._maxes) - 1)
+            position = bisect_right(self.chunks[index], key)
+        else:
+            value_rank = rank(value)
+            index, position = self._ranked_position(
+                key, lambda other: rank(other) > value_rank)
+        keys, values = self._writable(index)
+        keys.insert(position, key)
+        values.insert(position, value)
+        self._maxes[index] = keys[-1]
+        self._len += 1
+
+        if len(keys) > 2 * CHUNK_SIZE:
+            tail_keys, tail_values = keys[CHUNK_SIZE:], values[CHUNK_SIZE:]
+            del keys[CHUNK_SIZE:], values[CHUNK_SIZE:]
+            self.chunks.insert(index + 1, tail_keys)
+            self._values.insert(index + 1, tail_values)
+            self._maxes.insert(index, keys[-1])
+            self._owned.add(id(tail_keys))
+
+    def _ranked_position(self, key: Any,
+                         found: Callable[[Any], bool]) -> Tuple[int, int]:
+        # The chunk, and the position within it, of the first entry with
+        # this key whose value is found, found being true of all the
+        # entries with this key after it, or else just after the last
+        # entry with this key. The chunks from first to last, excluded,
+        # all end with entries with this key: the first one ending with a
+        # value found is looked for by bisection, then the position within
+        # it.
+        high = min(bisect_right(self._maxes, key), len(self._maxes) - 1)
+        low = min(bisect_left(self._maxes, key), high)
+        while low < high:
+            middle = (low + high) // 2
+            if found(self._values[middle][-1]):
+                high = middle
+            else:
+                low = middle + 1
+
+        keys, values = self.chunks[low], self._values[low]
+        start, stop = bisect_left(keys, key), bisect_right(keys, key)
+        while start < stop:
+            middle = (start + stop) // 2
+            if found(values[middle]):
+                stop = middle
+            else:
+                start = middle + 1
+        return low, start
+
+    def remove(self, key: Any, value: Any,
+               rank: Optional[Callable[[Any], Any]] = None) -> bool:
+        """Removes the entry (key, value). With the rank the entries with
+        the same key were inserted with, it is found by bisection rather
+        than by reading them all.
+
+        Returns:
+            bool: False if there is no such entry.
+        """
+        if rank is not None and self.chunks:
+            value_rank = rank(value)
+            index, position = self._ranked_position(
+                key, lambda other: rank(other) >= value_rank)
+            keys = self.chunks[index]
+            if (position < len(keys) and keys[position] == key
+                    and self._values[index][position] == value):
+                self._delete(index, position)
+                return True
+            return False
+
+        index = bisect_left(self._maxes, key)
+        while index < len(self.chunks):
+            keys = self.chunks[index]
+            start = bisect_left(keys, key)
+            stop = bisect_right(keys, key)
+            values = self._values[index]
+            for position in range(start, stop):
+                if values[position] == value:
+                    self._delete(index, position)
+                    return True
+            if stop < len(keys):
+                return False
+            # Entries with this key may go on in the next chunk
+            index += 1
+        return False
+
+    def _delete(self, index: int, position: int) -> None:
+        keys, values = self._writable(index)
+        del keys[position], values[position]
+        self._len -= 1
+        if keys:
+            self._maxes[index] = keys[-1]
+        else:
+            self._owned.discard(id(keys))
+            del self.chunks[index], self._values[index], self._maxes[index]
+
+    def _spans(self, start: int, stop: int) -> Iterator[_Span]:
+        # The chunks holding the positions from start to stop, with the
+        # range of each of them within these positions, read lazily
+        offset = 0
+        for keys, values in zip(self.chunks, self._values):
+            end = offset + len(keys)
+            if end > start:
+                yield (keys, values, max(start - offset, 0),
+                       min(stop, end) - offset)
+            if end >= stop:
+                return
+            offset = end
+
+    def values(self, start: int = 0,
+               stop: Optional[int] = None) -> Iterator[Any]:
+        """Yields the values of the entries from position start to stop."""
+        stop = self._len if stop is None else min(stop, self._len)
+        if start >= stop:
+            return
+        for _, values, low, high in self._spans(start, stop):
+            yield from values[low:high]
+
+    def items(self, start: int = 0, stop: Optional[int] = None,
+              reverse: bool = False) -> Iterator[Tuple[Any, Any]]:
+        """Yields the (key, value) entries from position start to stop,
+        from the last one with reverse."""
+        stop = self._len if stop is None else min(stop, self._len)
+        if start >= stop:
+            return
+        if reverse:
+            for keys, values, low, high in reversed(list(
+                    self._spans(start, stop))):
+                yield from reversed(list(zip(keys[low:high],
+                                             values[low:high])))
+        else:
+            for keys, values, low, high in self._spans(start, stop):
+                yield from zip(keys[low:high], values[low:high])
@@ -0,0 +1,120 @@
+"""Negotiated compression of the responses.
+
+Responses are compressed with brotli when the brotli package is installed
+and the client accepts it, with gzip otherwise, according to the
+Accept-Encoding header of the request. Bodies already encoded, such as
+those of the ResponseCache, are left as they are.
+
+Each service is built from its own directory, so the Songs service has a
+short copy of this module, and Capstone one of choose_encoding(), which
+refer to this one for the reasons of the choices made.
+"""
+import gzip
+import zlib
+from typing import Iterable, Iterator, Optional, Union
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+# Bodies smaller than this are never compressed, it would not pay off
+COMPRESS_MIN_SIZE = 1024
+
+# Content types worth compressing
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson")
+
+# Supported encodings, preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Picks the content coding of a response.
+
+    Args:
+        accept_encoding (str): The Accept-Encoding header of the request.
+
+    Returns:
+        Optional[str]: The one of ENCODINGS with the highest quality value,
+        the first one on a tie, or None if the client accepts none.
+    """
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compresses data with one of ENCODINGS."""
+    if encoding == "br":
+        # Quality 5 of 11 is about as fast as gzip, and smaller
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def compress_stream(chunks: Iterable[Union[bytes, str]],
+                    encoding: str) -> Iterator[bytes]:
+    """Compresses a streamed body chunk by chunk. Each chunk is flushed,
+    so that the client can decode what it received so far."""
+    chunks = (chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+              for chunk in chunks)
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+
+    # wbits=31 writes the gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def compress_response(response: Response) -> Response:
+    """Compresses the JSON responses for the clients which accept it, to
+    be registered with app.after_request."""
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.status_code in (204, 304)):
+        return response
+    if (not response.is_streamed
+            and response.calculate_content_length() < COMPRESS_MIN_SIZE):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+
+    # Each encoding is a distinct representation, hence its own ETag
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
@@ -0,0 +1,197 @@
+"""Loading of the picture catalogue at startup.
+
+The seed file is parsed incrementally by iter_json_records(), so only the
+pictures being built are held in memory besides the catalogue itself,
+never the whole file or the list of its dicts. It may be a JSON array, as
+pictures.json is, or hold one JSON object per line (NDJSON).
+
+Parsing JSON and building the indexes still takes seconds for a million
+pictures. load_catalogue() can therefore keep a snapshot file next to the
+seed file, written the first time and rebuilt whenever the seed file is
+newer: the records in columns, one list per field, and the indexes of
+the catalogue, already sorted, serialised with marshal. The file is mapped
+into memory and decoded by marshal in C. Records are then created directly
+from the columns, and strings shared between them, such as countries and
+cities, are only decoded once. The snapshot only serves the in-memory
+catalogue: a PersistentPictureStore loads its pictures from the database,
+see backend/storage.py.
+
+The garbage collector is paused meanwhile: the millions of objects created
+would otherwise trigger collections which traverse all of them again and
+again, and take longer than the loading itself.
+"""
+import gc
+import json
+import logging
+import marshal
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional, TextIO
+
+from .records import FIELDS, PictureRecord
+from .store import PictureSnapshot
+
+# Marks the snapshot files, and the version of their format
+SNAPSHOT_MAGIC = b"PICSNAP1"
+
+# Number of characters read from the seed file at a time
+CHUNK_SIZE = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+
+def iter_json_records(path: str,
+                      chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Yields the records of a JSON array, or of an NDJSON file, as they
+    are parsed.
+
+    Raises:
+        ValueError: If the file is not valid JSON, or NDJSON.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as file:
+        buffer = file.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            # NDJSON: one record per line, the first read one included
+            for line in _lines(buffer, file):
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        position = 1
+        eof = False
+        while True:
+            # Skips the separators up to the next record, or the end
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer, position = file.read(chunk_size), 0
+                eof = not buffer
+
+            if position >= len(buffer):
+                raise ValueError(f"{path}: unterminated JSON array")
+            if buffer[position] == "]":
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            # A record ending with the buffer, such as a number, may go on
+            # in the next chunk
+            if end is None or (end == len(buffer) and not eof):
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            yield record
+            position = end
+
+
+def _lines(head: str, file: TextIO) -> Iterator[str]:
+    # Lines of file, whose first characters were already read into head
+    rest, _, line = head.rpartition("\n")
+    yield from rest.splitlines()
+    yield line + file.readline()
+    yield from file
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def read_snapshot(path: str) -> PictureSnapshot:
+    """Loads a snapshot file written by write_snapshot().
+
+    Raises:
+        ValueError: If the file is not a snapshot, or not in this format.
+    """
+    with _gc_paused(), open(path, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            memoryview(mapped) as view:
+        if view[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a picture snapshot")
+        with view[len(SNAPSHOT_MAGIC):] as payload:
+            try:
+                (keys, columns, sorted_ids, by_location, date_ids,
+                 dates) = marshal.loads(payload)
+            except (EOFError, TypeError, ValueError) as e:
+                raise ValueError(f"{path} is corrupted: {e}") from e
+
+        return PictureSnapshot.from_indexes(
+            dict(zip(keys, PictureRecord.from_columns(columns))), sorted_ids,
+            {field: {value: dict.fromkeys(ids) for value, ids in index.items()}
+             for field, index in by_location.items()},
+            date_ids, dates)
+
+
+def write_snapshot(snapshot: PictureSnapshot, path: str) -> None:
+    """Saves snapshot to path, replacing the file atomically, so that
+    other processes never read a partial snapshot."""
+    keys = list(snapshot.order.values())
+    records = [snapshot.by_id[key] for key in keys]
+    columns = [[record[position] for record in records]
+               for position in range(len(FIELDS) + 1)]
+    entries = list(snapshot.dates.items())
+    payload = (keys, columns, list(snapshot.sorted_ids.values()),
+               {field: {value: list(ids) for value, ids in index.items()}
+                for field, index in snapshot.by_location.items()},
+               [key for _, key in entries], [ordinal for ordinal, _ in entries])
+
+    descriptor, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(SNAPSHOT_MAGIC)
+            marshal.dump(payload, file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_catalogue(json_path: str,
+                   snapshot_path: Optional[str] = None) -> PictureSnapshot:
+    """Builds the catalogue of the seed file json_path.
+
+    Args:
+        json_path (str): The seed file, a JSON array or NDJSON.
+        snapshot_path (str): Where the snapshot of the seed file is kept,
+            None not to use one. A snapshot older than the seed file, or
+            which cannot be read, is replaced.
+
+    Returns:
+        PictureSnapshot: The pictures of the seed file.
+    """
+    if snapshot_path:
+        try:
+            if os.path.getmtime(snapshot_path) >= os.path.getmtime(json_path):
+                return read_snapshot(snapshot_path)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring the picture snapshot: %s", e)
+
+    with _gc_paused():
+        snapshot = PictureSnapshot.build(iter_json_records(json_path))
+    if snapshot_path:
+        try:
+            write_snapshot(snapshot, snapshot_path)
+        except OSError as e:
+            logger.warning("Cannot write the picture snapshot: %s", e)
+    return snapshot
@@ -0,0 +1,99 @@
+"""Compact in-memory representation of the pictures.
+
+A picture held as a dict costs a hash table sized for its six keys on top
+of its values. A PictureRecord is a tuple holding the same values at
+fixed positions, and shares the strings which repeat from one picture to
+the next, such as countries, states, cities and dates, through the intern
+table. Fields other than the usual six, which clients may send, are kept
+in a dict of their own. Records are converted back to dicts when they are
+served, so the JSON representation is unchanged.
+"""
+import sys
+from itertools import repeat
+from typing import Any, Dict, Iterable, Iterator, Sequence
+
+# Fields held at fixed positions, in the order of pictures.json
+FIELDS = ("id", "pic_url", "event_country", "event_state", "event_city",
+          "event_date")
+
+# Fields whose values repeat across pictures, and are interned
+SHARED_FIELDS = ("event_country", "event_state", "event_city",
+                 "event_date")
+
+# Marks a field absent from the picture, as opposed to set to None. JSON
+# has no such value, and marshal can store it, see backend/loader.py.
+MISSING = ...
+
+_POSITIONS = {field: position for position, field in enumerate(FIELDS)}
+_SHARED_POSITIONS = tuple(_POSITIONS[field] for field in SHARED_FIELDS)
+_FIELD_SET = frozenset(FIELDS)
+_EXTRA = len(FIELDS)
+_item = tuple.__getitem__
+
+
+def _field(position: int) -> property:
+    return property(lambda record: _item(record, position))
+
+
+class PictureRecord(tuple):
+    """A picture, read-only once created: the values of FIELDS, followed
+    by the dict of the other fields, or None."""
+
+    __slots__ = ()
+
+    def __new__(cls, picture: Dict[str, Any]) -> "PictureRecord":
+        values = [picture.get(field, MISSING) for field in FIELDS]
+        for position in _SHARED_POSITIONS:
+            if type(values[position]) is str:
+                values[position] = sys.intern(values[position])
+
+        extra = None
+        if not picture.keys() <= _FIELD_SET:
+            extra = {field: value for field, value in picture.items()
+                     if field not in _FIELD_SET}
+        values.append(extra)
+        return tuple.__new__(cls, values)
+
+    @classmethod
+    def from_columns(cls, columns: Sequence[Iterable[Any]]
+                     ) -> Iterator["PictureRecord"]:
+        """Builds records from one sequence of values per position, as
+        stored in a snapshot file, without going through dicts."""
+        return map(tuple.__new__, repeat(cls), zip(*columns))
+
+    id = _field(0)
+    pic_url = _field(1)
+    event_country = _field(2)
+    event_state = _field(3)
+    event_city = _field(4)
+    event_date = _field(5)
+    extra = _field(_EXTRA)
+
+    def get(self, field: str, default: Any = None) -> Any:
+        """Returns the value of field, or default if it is absent."""
+        position = _POSITIONS.get(field)
+        if position is not None:
+            value = _item(self, position)
+            return default if value is MISSING else value
+        extra = _item(self, _EXTRA)
+        if extra is None:
+            return default
+        return extra.get(field, default)
+
+    def __getitem__(self, field: Any) -> Any:
+        # Fields are read by name, and positions as in any tuple
+        if type(field) is not str:
+            return _item(self, field)
+        value = self.get(field, MISSING)
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the picture as the dict it was created from."""
+        picture = {field: value for field, value in zip(FIELDS, self)
+                   if value is not MISSING}
+        extra = _item(self, _EXTRA)
+        if extra is not None:
+            picture.update(extra)
+        return picture
@@ -1,11 +1,228 @@
 from . import app
 import os
-import json
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 from flask import jsonify, request, make_response, abort, url_for  # noqa; F401
+from flask import Response, json as flask_json, stream_with_context
+from .cache import ResponseCache
+from .compression import compress_response
+from .loader import iter_json_records, load_catalogue
+from .storage import PersistentPictureStore, SQLiteStorage
+from .store import (LOCATION_FIELDS, ORDERS, PictureStore, is_picture_id,
+                    parse_event_date)
 
 SITE_ROOT = os.path.realpath(os.path.dirname(__file__))
 json_url = os.path.join(SITE_ROOT, "data", "pictures.json")
-data: list = json.load(open(json_url))
+
+# PICTURES_DB_PATH: the SQLite database where the catalogue is persisted
+# and shared by the worker processes, seeded from pictures.json when it is
+# empty. Without it, the catalogue only lives in the memory of a process,
+# and PICTURES_SNAPSHOT_PATH may name the binary snapshot of pictures.json
+# it is loaded from, see backend/loader.py. The snapshot is not used with
+# PICTURES_DB_PATH: the catalogue is then loaded from the database rows.
+db_path = os.environ.get("PICTURES_DB_PATH")
+if db_path:
+    storage = SQLiteStorage(db_path)
+    if storage.is_empty():
+        storage.seed(iter_json_records(json_url))
+    data: PictureStore = PersistentPictureStore(storage)
+else:
+    data = PictureStore()
+    data.publish(load_catalogue(json_url,
+                                os.environ.get("PICTURES_SNAPSHOT_PATH")))
+
+# Encoded forms of the catalogue and pictures, refreshed after each write
+response_cache = ResponseCache(data)
+
+# Number of pictures encoded together in each chunk of a streamed response
+STREAM_CHUNK_SIZE = 500
+
+
+def parse_non_negative_int(name: str) -> Optional[int]:
+    """Reads a non-negative integer from the query string argument name.
+
+    Returns:
+        Optional[int]: The value of the argument, or None if it is absent.
+
+    Raises:
+        ValueError: If the argument is not a non-negative integer.
+    """
+    value_str = request.args.get(name)
+    if value_str is None:
+        return None
+
+    try:
+        value = int(value_str)
+    except ValueError:
+        value = -1
+
+    if value < 0:
+        raise ValueError(f"'{name}' shall be a non-negative integer. "
+                         f"Its actual value is '{value_str}'")
+    return value
+
+
+def parse_filter_args() -> Dict[str, Any]:
+    """Reads the filters of GET /picture from the query string.
+
+    Returns:
+        Dict[str, Any]: The keyword arguments of PictureStore.filter() for
+        the filters given in the request, empty if there are none.
+
+    Raises:
+        ValueError: If 'from' or 'to' is not a valid date, or if 'sort' is
+        not one of ORDERS.
+    """
+    filters: Dict[str, Any] = {}
+
+    order = request.args.get("sort")
+    if order is not None:
+        if order not in ORDERS:
+            raise ValueError(f"'sort' shall be one of {', '.join(ORDERS)}. "
+                             f"Its actual value is '{order}'")
+        filters["order"] = order
+
+    locations = {field: request.args[name]
+                 for name, field in LOCATION_FIELDS.items()
+                 if name in request.args}
+    if locations:
+        filters["locations"] = locations
+
+    for name, argument in (("from", "date_from"), ("to", "date_to")):
+        value_str = request.args.get(name)
+        if value_str is None:
+            continue
+        ordinal = parse_event_date(value_str)
+        if ordinal is None:
+            raise ValueError(f"'{name}' shall be a date in the M/D/YYYY or "
+                             f"YYYY-MM-DD format. Its actual value is "
+                             f"'{value_str}'")
+        filters[argument] = ordinal
+
+    return filters
+
+
+def stream_json_array(pictures: Iterable[dict]) -> Iterator[str]:
+    """Yields a JSON array of pictures chunk by chunk, encoding
+    STREAM_CHUNK_SIZE pictures at a time instead of the whole list."""
+    yield "["
+    pictures = iter(pictures)
+    separator = ""
+    while True:
+        chunk = list(islice(pictures, STREAM_CHUNK_SIZE))
+        if not chunk:
+            break
+        yield separator + ",".join(flask_json.dumps(picture)
+                                   for picture in chunk)
+        separator = ","
+    yield "]\n"
+
+
+######################################################################
+# STORE OPERATIONS SHARED BY THE SINGLE AND BATCH ROUTES
+######################################################################
+def add_picture(new_picture: dict) -> Tuple[dict, int]:
+    """Add a new picture to the data store.
+
+    Returns:
+        Tuple[dict, int]: The JSON body and the HTTP status code of the
+        outcome: 201 if the picture is added, 302 if its ID is already
+        used, 400 if the picture is invalid, e.g. if its ID is neither an
+        integer nor a string holding one.
+    """
+    # Validate the data (you can add additional validations here)
+    if (not isinstance(new_picture, dict) or 'id' not in new_picture
+            or not is_picture_id(new_picture['id'])):
+        return {"Message": "Invalid picture data"}, 400
+
+    # Add the new picture to the data store, unless its ID is already used
+    if not data.add(new_picture):
+        msg_str = f"picture with id {new_picture['id']} already present"
+        return {"Message": msg_str,
+                "picture": new_picture,
+                'id': new_picture['id']}, 302
+
+    msg_str = "Picture added successfully"
+    return {
+        "Message": msg_str,
+        "picture": new_picture,
+        'id': new_picture['id']
+    }, 201
+
+
+def change_picture(id: int, request_picture: dict) -> Tuple[dict, int]:
+    """Update the picture whose ID is id with the fields of request_picture.
+
+    Returns:
+        Tuple[dict, int]: The JSON body and the HTTP status code of the
+        outcome: 200 if the picture is updated, 400 if the data or one of
+        the IDs is invalid, 404 if the picture is not found, 409 if the
+        new ID is used by another picture.
+    """
+    # Validate the request data
+    if (not is_picture_id(id) or not isinstance(request_picture, dict)
+            or 'id' not in request_picture
+            or not is_picture_id(request_picture['id'])):
+        return {"Message": "Invalid data in request"}, 400
+
+    try:
+        picture = data.update(id, request_picture)
+    except KeyError:
+        msg_str = f"picture with id {request_picture['id']} already present"
+        return {
+            "Message": msg_str,
+            "picture": request_picture,
+            'id': id
+        }, 409
+
+    if picture is None:
+        msg_str = f"Picture whose id is {id} not found"
+        return {
+            "Message": msg_str,
+            "picture": request_picture,
+            'id': id
+        }, 404
+
+    msg_str = "Picture updated successfully"
+    return {
+        "Message": msg_str,
+        "picture": picture,
+        'id': id
+    }, 200
+
+
+def remove_picture(id: int) -> Tuple[dict, int]:
+    """Delete the picture whose ID is id from the data store.
+
+    Returns:
+        Tuple[dict, int]: The JSON body and the HTTP status code of the
+        outcome: 204 if the picture is deleted, 400 if the ID is invalid,
+        404 if the picture is not found.
+    """
+    # Validate the request data
+    if not isinstance(id, int) or isinstance(id, bool) or id < 0:
+        return {"Message": "Invalid data in request"}, 400
+
+    if data.remove(id) is not None:
+        message_str = f"Picture whose id is {id} removed"
+        return {"Message": message_str}, 204
+
+    return {"Message": f"Picture whose id is {id} not found"}, 404
+
+
+######################################################################
+# APPLY THE WRITES OF THE OTHER WORKERS BEFORE EACH REQUEST
+######################################################################
+@app.before_request
+def sync_store():
+    data.sync()
+
+
+######################################################################
+# COMPRESS THE JSON RESPONSES FOR THE CLIENTS WHICH ACCEPT IT
+######################################################################
+app.after_request(compress_response)
+
 
 ######################################################################
 # RETURN HEALTH OF THE APP
@@ -35,17 +252,76 @@ def count():
 ######################################################################
 @app.route("/picture", methods=["GET"])
 def get_pictures():
-    """Retrieve all pictures.
+    """Retrieve all pictures, or a page of them.
+
+    Query string arguments:
+    - country, state, city: return the pictures whose event_country,
+      event_state and event_city match, ignoring case and extra spaces.
+    - from, to: return the pictures whose event_date is within the range,
+      bounds included, given as M/D/YYYY or YYYY-MM-DD.
+    - sort: return the pictures in ascending ID order ("id"), or by
+      ascending ("event_date") or descending ("-event_date") event date,
+      pictures without a valid date coming last.
+    - offset, limit: skip the first offset pictures and return at most
+      limit of them, in catalogue order.
+    - after_id: return the pictures whose ID is greater than after_id, in
+      ascending ID order (keyset pagination, combined with limit). When
+      the page is full, the ID to send back for the next page is given in
+      the X-Next-After-Id header.
+    - stream=1: send the JSON array in chunks while it is being encoded.
+
+    Filtered and sorted pictures are read from the secondary indexes of
+    the store, in ascending ID order unless sorted otherwise, and may be
+    paginated with the arguments above, except after_id, which is only
+    meaningful in ID order.
+    The full catalogue is served from its cached encoded form, with an
+    ETag so that clients sending If-None-Match get 304 Not Modified.
 
     Returns:
         Response: A Flask response object containing the list of pictures
         in JSON format if available, or an empty list with a 200 status code
-        if no pictures are found.
+        if no pictures are found. A 400 status code is returned if one of
+        the query string arguments is invalid.
     """
-    if data:
-        return jsonify(data), 200
+    try:
+        offset = parse_non_negative_int("offset")
+        limit = parse_non_negative_int("limit")
+        after_id = parse_non_negative_int("after_id")
+        filters = parse_filter_args()
+    except ValueError as e:
+        return jsonify({"Message": str(e)}), 400
+
+    if after_id is not None and filters.get("order", "id") != "id":
+        msg_str = "'after_id' can only be used with the 'id' sort order"
+        return jsonify({"Message": msg_str}), 400
+
+    stream = request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+    headers = {}
+    if filters:
+        # Only the pictures of the page are read and converted to dicts
+        pictures = data.filter(after_id=after_id, offset=offset or 0,
+                               limit=limit, **filters)
+    elif after_id is not None:
+        pictures = data.after(after_id, limit)
+    elif offset is not None or limit is not None:
+        pictures = data.slice(offset or 0, limit)
+    elif stream:
+        # The pictures of the current snapshot are converted to dicts
+        # while they are streamed
+        pictures = data.snapshot()
     else:
-        return jsonify([]), 200
+        return response_cache.catalogue().to_response()
+
+    if after_id is not None and limit and len(pictures) == limit:
+        headers["X-Next-After-Id"] = str(pictures[-1]["id"])
+
+    if stream:
+        body = stream_with_context(stream_json_array(pictures))
+        return Response(body, mimetype="application/json",
+                        headers=headers), 200
+
+    return jsonify(pictures), 200, headers
 
 
 ######################################################################
@@ -61,17 +337,12 @@ def get_picture_by_id(id):
     Returns:
         Response: A Flask response object containing the picture data
         in JSON format if found, or an error message if the picture
-        is not found.
+        is not found. The picture is served from its cached encoded form,
+        with an ETag honoured through If-None-Match.
     """
-    if data:
-        for picture in data:
-            try:
-                if int(picture["id"]) == id:
-                    return jsonify(picture), 200
-            except (KeyError, ValueError):
-                # Handle the case where 'id' key is missing or cannot
-                # be converted to an integer
-                continue
+    encoded = response_cache.picture(id)
+    if encoded is not None:
+        return encoded.to_response()
 
     return jsonify({"message": f"Picture with id {id} not found"}), 404
 
@@ -81,7 +352,7 @@ def get_picture_by_id(id):
 ######################################################################
 @app.route("/picture", methods=["POST"])
 def create_picture():
-    """Create a new picture and add it to the data list.
+    """Create a new picture and add it to the data store.
 
     Expects:
         JSON data representing the new picture.
@@ -98,27 +369,8 @@ def create_picture():
     # Extract JSON data from the request
     new_picture = request.get_json()
 
-    # Validate the data (you can add additional validations here)
-    if not new_picture:
-        return jsonify({"Message": "Invalid picture data"}), 400
-
-    for picture in data:
-        if new_picture['id'] == picture['id']:
-            msg_str = f"picture with id {picture['id']} already present"
-            return jsonify({"Message": msg_str,
-                            "picture": new_picture,
-                            'id': new_picture['id']}), 302
-
-    # Add the new picture to the data list
-    data.append(new_picture)
-
-    # Return a success response with the new picture data
-    msg_str = "Picture added successfully"
-    return jsonify({
-        "Message": msg_str,
-        "picture": new_picture,
-        'id': new_picture['id']
-    }), 201
+    body, status = add_picture(new_picture)
+    return jsonify(body), status
 
 
 ######################################################################
@@ -127,7 +379,7 @@ def create_picture():
 @app.route("/picture/<int:id>", methods=["PUT"])
 def update_picture(id):
     """
-    Update a picture in the data list based on the provided ID.
+    Update a picture in the data store based on the provided ID.
 
     This function handles PUT requests to update the details of a
     specific picture. It checks if the request contains valid JSON data,
@@ -143,6 +395,7 @@ def update_picture(id):
                 200 if the picture is successfully deleted.
                 400 if the ID is invalid.
                 404 if the picture with the specified ID is not found.
+                409 if the new ID in the body is used by another picture.
     """
 
     # Check if the request contains JSON data
@@ -152,28 +405,8 @@ def update_picture(id):
     # Extract JSON data from the request
     request_picture = request.get_json()
 
-    # Validate the request data
-    if not request_picture or 'id' not in request_picture:
-        return jsonify({"Message": "Invalid data in request"}), 400
-
-    for picture in data:
-        if id == picture['id']:
-            for key in request_picture.keys():
-                picture[key] = request_picture[key]
-
-            msg_str = "Picture updated successfully"
-            return jsonify({
-                "Message": msg_str,
-                "picture": picture,
-                'id': id
-            }), 200
-        else:
-            msg_str = f"Picture whose id is {id} not found"
-            return jsonify({
-                "Message": msg_str,
-                "picture": request_picture,
-                'id': id
-            }), 404
+    body, status = change_picture(id, request_picture)
+    return jsonify(body), status
 
 
 ######################################################################
@@ -182,7 +415,7 @@ def update_picture(id):
 @app.route("/picture/<int:id>", methods=["DELETE"])
 def delete_picture(id: int):
     """
-    Delete a picture from the data list based on the provided ID.
+    Delete a picture from the data store based on the provided ID.
     This function handles DELETE requests to remove a specific picture by
     its ID. It checks if the ID is valid, searches for the picture by ID,
     and removes it if found. If the picture is not found, it returns
@@ -198,14 +431,64 @@ def delete_picture(id: int):
                 400 if the ID is invalid.
                 404 if the picture with the specified ID is not found.
     """
-    # Validate the request data
-    if not isinstance(id, int) or id < 0:
-        return jsonify({"Message": "Invalid data in request"}), 400
+    body, status = remove_picture(id)
+    return jsonify(body), status
+
+
+######################################################################
+# CREATE, UPDATE AND DELETE PICTURES IN BATCH
+######################################################################
+@app.route("/picture/batch", methods=["POST"])
+def batch_pictures():
+    """
+    Apply a list of create, update and delete operations in one request.
 
-    for picture in data:
-        if picture['id'] == id:
-            data.remove(picture)
-            message_str = f"Picture whose id is {id} removed"
-            return jsonify({"Message": message_str}), 204
+    Expects:
+        A JSON array of operations, applied in order:
+        - {"op": "create", "picture": {...}}
+        - {"op": "update", "id": <id>, "picture": {...}}
+        - {"op": "delete", "id": <id>}
+
+    Each operation behaves like the matching single-picture route, and a
+    failing operation does not prevent the next ones from being applied:
+    the IDs and pictures of each operation are validated before it is
+    applied, and an invalid one only gets a 400 of its own.
+    Other requests see either none or all of the operations.
+
+    Returns:
+    - Response: A Flask response object with a JSON body holding, for each
+                operation, its index, HTTP status code and JSON body,
+                and a return status code which is:
+                200 if the operations were processed.
+                400 if the request is not a JSON array of operations.
+    """
+    # Check if the request contains JSON data
+    if not request.is_json:
+        return jsonify({"Message": "Missing JSON in request"}), 400
+
+    operations = request.get_json()
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"Message": "Invalid data in request"}), 400
 
-    return jsonify({"Message": f"Picture whose id is {id} not found"}), 404
+    results = []
+    # The operations are published together, with a single copy of the
+    # catalogue
+    with data.batch():
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                operation = {}
+
+            op = operation.get("op")
+            if op == "create":
+                body, status = add_picture(operation.get("picture"))
+            elif op == "update":
+                body, status = change_picture(operation.get("id"),
+                                              operation.get("picture"))
+            elif op == "delete":
+                body, status = remove_picture(operation.get("id"))
+            else:
+                body, status = {"Message": f"Unknown operation '{op}'"}, 400
+
+            results.append({"index": index, "status": status, "body": body})
+
+    return jsonify({"results": results}), 200
@@ -0,0 +1,276 @@
+"""Durable storage of the picture catalogue in an embedded SQLite database.
+
+The database, opened in WAL mode so that readers never wait for writers,
+holds two tables:
+
+- pictures: the current catalogue, one JSON record per picture, with its
+  position in the catalogue order;
+- changes: the log of the writes, numbered by an increasing sequence.
+
+Each process keeps the catalogue in memory, in a PersistentPictureStore.
+Its writes are committed to both tables in a single transaction before
+they succeed, and sync() replays the changes logged by the other
+processes since the last sequence it has seen. The log is compacted as it
+grows: a process which has fallen behind the oldest change kept reloads
+the whole catalogue instead.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .store import PictureSnapshot, PictureStore, picture_key
+
+# Number of most recent changes kept in the log when it is compacted,
+# which happens every COMPACT_EVERY changes
+LOG_KEEP = 10000
+COMPACT_EVERY = 1000
+
+# A logged change: sequence, "put" or "delete", ID and record
+Change = Tuple[int, str, Any, Optional[Dict[str, Any]]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pictures (
+    key TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pictures_position ON pictures (position);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY,
+    op TEXT NOT NULL,
+    key TEXT NOT NULL,
+    body TEXT
+);
+"""
+
+
+class SQLiteStorage:
+    """The SQLite database of a picture catalogue.
+
+    Connections are opened on first use by each thread, and again after a
+    fork, since an SQLite connection must not be shared between processes.
+    """
+
+    def __init__(self, path: str, log_keep: int = LOG_KEEP) -> None:
+        self.path = path
+        self.log_keep = log_keep
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread."""
+        if getattr(self._local, "pid", None) != os.getpid():
+            # Transactions are managed explicitly, see transaction()
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # A commit is only acknowledged once it is on disk
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    @contextmanager
+    def transaction(self, write: bool = False) -> Iterator[None]:
+        """Runs the enclosed statements in one transaction. Write
+        transactions take the write lock at once, so that the data read
+        within them cannot be changed by another process. Within an
+        enclosing transaction, the statements are simply part of it."""
+        connection = self.connection()
+        if connection.in_transaction:
+            yield
+            return
+
+        connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def is_empty(self) -> bool:
+        row = self.connection().execute(
+            "SELECT 1 FROM pictures LIMIT 1").fetchone()
+        return row is None
+
+    def seed(self, pictures: Iterable[Dict[str, Any]]) -> int:
+        """Stores pictures if the catalogue is empty.
+
+        Returns:
+            int: The number of stored pictures, 0 if the catalogue was not
+            empty.
+        """
+        with self.transaction(write=True):
+            if not self.is_empty():
+                return 0
+            # Rows are encoded as they are inserted, so that pictures may
+            # be streamed from the seed file
+            rows = ((json.dumps(picture_key(picture["id"])), position,
+                     json.dumps(picture))
+                    for position, picture in enumerate(pictures))
+            cursor = self.connection().executemany(
+                "INSERT OR IGNORE INTO pictures VALUES (?, ?, ?)", rows)
+        return cursor.rowcount
+
+    def load(self) -> Tuple[List[Dict[str, Any]], int]:
+        """Returns the pictures in catalogue order, and the sequence of the
+        last change they include."""
+        connection = self.connection()
+        with self.transaction():
+            rows = connection.execute(
+                "SELECT body FROM pictures ORDER BY position").fetchall()
+            seq = self.last_seq()
+        return [json.loads(body) for body, in rows], seq
+
+    def last_seq(self) -> int:
+        row = self.connection().execute(
+            "SELECT MAX(seq) FROM changes").fetchone()
+        return row[0] or 0
+
+    def changes_since(self, seq: int) -> Optional[List[Change]]:
+        """Returns the changes logged after seq, in order, or None if some
+        of them were already compacted away."""
+        rows = self.connection().execute(
+            "SELECT seq, op, key, body FROM changes WHERE seq > ? "
+            "ORDER BY seq", (seq,)).fetchall()
+        if rows and rows[0][0] != seq + 1:
+            return None
+        return [(row_seq, op, json.loads(key),
+                 None if body is None else json.loads(body))
+                for row_seq, op, key, body in rows]
+
+    def put(self, picture: Dict[str, Any]) -> int:
+        """Inserts or replaces a picture, within a write transaction. New
+        pictures are placed at the end of the catalogue.
+
+        Returns:
+            int: The sequence of the logged change.
+        """
+        key = json.dumps(picture_key(picture["id"]))
+        body = json.dumps(picture)
+        connection = self.connection()
+        updated = connection.execute(
+            "UPDATE pictures SET body = ? WHERE key = ?", (body, key))
+        if updated.rowcount == 0:
+            connection.execute(
+                "INSERT INTO pictures SELECT ?, COALESCE(MAX(position), -1) "
+                "+ 1, ? FROM pictures", (key, body))
+        return self._log("put", key, body)
+
+    def delete(self, picture_id: Any) -> int:
+        """Deletes a picture, within a write transaction.
+
+        Returns:
+            int: The sequence of the logged change.
+        """
+        key = json.dumps(picture_key(picture_id))
+        self.connection().execute("DELETE FROM pictures WHERE key = ?",
+                                  (key,))
+        return self._log("delete", key, None)
+
+    def _log(self, op: str, key: str, body: Optional[str]) -> int:
+        connection = self.connection()
+        seq = self.last_seq() + 1
+        connection.execute("INSERT INTO changes VALUES (?, ?, ?, ?)",
+                           (seq, op, key, body))
+        if seq % COMPACT_EVERY == 0:
+            connection.execute("DELETE FROM changes WHERE seq <= ?",
+                               (seq - self.log_keep,))
+        return seq
+
+
+class PersistentPictureStore(PictureStore):
+    """A PictureStore whose writes are committed to an SQLiteStorage, and
+    which replays the writes of the other processes sharing it.
+
+    Each batch of writes runs within a transaction which holds the write
+    lock of the database, and first replays the pending changes, so that
+    the writes are checked against the latest catalogue: two processes
+    cannot add the same ID. Readers keep using the published snapshot
+    meanwhile.
+    """
+
+    def __init__(self, storage: SQLiteStorage) -> None:
+        self._storage = storage
+        pictures, self._seq = storage.load()
+        super().__init__(pictures)
+
+    def sync(self) -> None:
+        """Replays the changes committed by other processes."""
+        # Only the sequence is read when there is nothing to replay
+        if self._storage.last_seq() == self._seq:
+            return
+
+        with self._lock, PictureStore.batch(self), \
+                self._storage.transaction():
+            self._replay()
+
+    @contextmanager
+    def batch(self) -> Iterator[PictureSnapshot]:
+        with self._lock:
+            if self._pending is not None:
+                yield self._pending
+                return
+
+            seq = self._seq
+            try:
+                with super().batch(), \
+                        self._storage.transaction(write=True):
+                    self._replay()
+                    yield self._pending
+            except sqlite3.Error:
+                # The database may not match the memory any more: the
+                # catalogue is reloaded from it
+                self._reload()
+                raise
+            except BaseException:
+                self._seq = seq
+                raise
+
+    def add(self, picture: Dict[str, Any]) -> bool:
+        with self.batch() as pending:
+            added = pending._add(picture)
+            if added:
+                self._seq = self._storage.put(picture)
+            return added
+
+    def update(self, picture_id: Any,
+               changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self.batch() as pending:
+            picture = pending._update(picture_id, changes)
+            if picture is not None:
+                if picture_key(picture["id"]) != picture_key(picture_id):
+                    self._storage.delete(picture_id)
+                self._seq = self._storage.put(picture)
+            return picture
+
+    def remove(self, picture_id: Any) -> Optional[Dict[str, Any]]:
+        with self.batch() as pending:
+            picture = pending._remove(picture_id)
+            if picture is not None:
+                self._seq = self._storage.delete(picture_id)
+            return picture
+
+    def _replay(self) -> None:
+        # Applies the changes logged since self._seq to the pending copy
+        changes = self._storage.changes_since(self._seq)
+        if changes is None:
+            self._reload()
+            return
+
+        for seq, op, key, picture in changes:
+            if op == "delete":
+                self._pending._remove(key)
+            elif key in self._pending:
+                self._pending._update(key, picture)
+            else:
+                self._pending._add(picture)
+            self._seq = seq
+
+    def _reload(self) -> None:
+        pictures, self._seq = self._storage.load()
+        self.replace(pictures)
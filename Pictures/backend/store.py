@@ -0,0 +1,623 @@
+import threading
+from datetime import date
+from contextlib import contextmanager
+from itertools import count, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .chunked import ShardedDict, SortedChunks
+from .records import PictureRecord
+
+# Query string argument of each location field with a secondary index
+LOCATION_FIELDS = {
+    "country": "event_country",
+    "state": "event_state",
+    "city": "event_city",
+}
+
+# Orders in which filter() may return the pictures, "-" meaning descending
+ORDERS = ("id", "event_date", "-event_date")
+
+
+def picture_key(picture_id: Any) -> Any:
+    """Normalises a picture ID so that 2 and "2" address the same record.
+
+    Args:
+        picture_id (Any): The ID as found in a record or in a request.
+
+    Returns:
+        Any: The integer form of the ID when it has one, the ID unchanged
+        otherwise. Floats with a fractional part are not truncated.
+    """
+    if isinstance(picture_id, float) and not picture_id.is_integer():
+        return picture_id
+    try:
+        return int(picture_id)
+    except (TypeError, ValueError, OverflowError):
+        return picture_id
+
+
+def is_picture_id(value: Any) -> bool:
+    """Tells whether value may be the ID of a picture sent by a client: an
+    integer, a float without a fractional part, or a string holding an
+    integer. Booleans, None and the other JSON values are not IDs.
+    """
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return True
+    if isinstance(value, float):
+        return value.is_integer()
+    if isinstance(value, str):
+        try:
+            int(value)
+        except ValueError:
+            return False
+        return True
+    return False
+
+
+def location_key(value: Any) -> Any:
+    """Normalises a location so that "new york" matches "New  York"."""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    return value
+
+
+def parse_event_date(value: Any) -> Optional[int]:
+    """Converts a date to its proleptic Gregorian ordinal.
+
+    Args:
+        value (Any): A date in the "M/D/YYYY" format of event_date, or in
+            the ISO "YYYY-MM-DD" format.
+
+    Returns:
+        Optional[int]: The ordinal of the date, or None if value is not a
+        valid date in either format.
+    """
+    if not isinstance(value, str):
+        return None
+
+    try:
+        if "/" in value:
+            month, day, year = value.split("/")
+        else:
+            year, month, day = value.split("-")
+        return date(int(year), int(month), int(day)).toordinal()
+    except ValueError:
+        return None
+
+
+def _id_order(key: Any) -> Any:
+    # Integer IDs first, in numeric order, then the others as strings
+    return (0, key) if isinstance(key, int) else (1, str(key))
+
+
+def _is_after(key: Any, after_id: Optional[int]) -> bool:
+    return after_id is None or isinstance(key, int) and key > after_id
+
+
+class PictureSnapshot:
+    """A version of the picture catalogue, with its indexes.
+
+    Records are kept as PictureRecord, converted to dicts when they are
+    read, in a ShardedDict keyed by their normalised ID, so lookups,
+    duplicate checks, updates and deletes are all O(1). Each picture also
+    gets a sequence number when it is added, and the IDs are kept in a
+    SortedChunks by sequence number, which is the insertion order returned
+    by GET /picture.
+
+    Integer IDs are also kept sorted, which serves keyset pagination ("the
+    pictures whose ID is greater than N") by bisection.
+
+    Secondary indexes serve filter(): for each field of LOCATION_FIELDS,
+    a hash map from the normalised location to the set of the IDs of its
+    pictures, and for event_date, the date ordinals kept sorted next to the
+    IDs of their pictures, so that a date range is found by bisection.
+    Pictures of the same date are kept in insertion order.
+
+    The "M/D/YYYY" event_date strings are only parsed when a picture is
+    written: the ordinal of each picture is kept by ID, and is the key
+    used to sort by date. The records themselves are left unchanged, so
+    that they are served in their original format.
+
+    A snapshot published by a PictureStore is never modified: the write
+    methods, prefixed with an underscore, are only called by the store on
+    a copy() that readers cannot see yet. The indexes are copy-on-write
+    containers, see backend/chunked.py, so that the copy and the writes
+    only copy the pieces of the indexes they change.
+
+    A whole catalogue is loaded with build(), which sorts the indexes once
+    at the end rather than inserting each picture at its sorted position.
+    """
+
+    def __init__(self) -> None:
+        self.by_id = ShardedDict()
+        # Sequence number of each picture, and the IDs by sequence number
+        self.seq_of = ShardedDict()
+        self.order = SortedChunks()
+        self.sorted_ids = SortedChunks()
+        # Location field -> normalised location -> set of IDs, as the keys
+        # of a ShardedDict
+        self.by_location: Dict[str, ShardedDict] = {
+            field: ShardedDict() for field in LOCATION_FIELDS.values()}
+        # Sorted date ordinals, with the ID of the picture of each of them
+        self.dates = SortedChunks()
+        # Date ordinal of each picture with a valid event_date
+        self.date_of = ShardedDict()
+        # Incremented on every change, so that derived data such as
+        # pre-encoded responses can tell when they are stale
+        self.version: int = 0
+        self._next_seq: int = 0
+        # (field, location) of the sets of IDs created by this snapshot,
+        # which unlike those shared with other snapshots may be changed
+        self._owned: Set[Tuple[str, Any]] = set()
+
+    @classmethod
+    def build(cls, pictures: Iterable[Dict[str, Any]]) -> "PictureSnapshot":
+        """Returns a snapshot of pictures, skipping the duplicate IDs."""
+        by_id: Dict[Any, PictureRecord] = {}
+        by_location: Dict[str, Dict[Any, Dict[Any, None]]] = {
+            field: {} for field in LOCATION_FIELDS.values()}
+        date_of: Dict[Any, int] = {}
+        for picture in pictures:
+            key = picture_key(picture["id"])
+            if key in by_id:
+                continue
+
+            record = by_id[key] = PictureRecord(picture)
+            for field, index in by_location.items():
+                value = location_key(record.get(field))
+                if isinstance(value, str):
+                    index.setdefault(value, {})[key] = None
+            ordinal = parse_event_date(record.get("event_date"))
+            if ordinal is not None:
+                date_of[key] = ordinal
+
+        sorted_ids = sorted(key for key in by_id if isinstance(key, int))
+        # The sort is stable: pictures of the same date stay in insertion
+        # order, as when they are inserted one by one
+        date_ids = sorted(date_of, key=date_of.__getitem__)
+        return cls.from_indexes(by_id, sorted_ids, by_location, date_ids,
+                                [date_of[key] for key in date_ids])
+
+    @classmethod
+    def from_indexes(cls, by_id: Dict[Any, PictureRecord],
+                     sorted_ids: List[int],
+                     by_location: Dict[str, Dict[Any, Dict[Any, None]]],
+                     date_ids: List[Any],
+                     dates: List[int]) -> "PictureSnapshot":
+        """Returns the snapshot of the records of by_id, in its order,
+        given the plain forms of its indexes, as built by build() or read
+        by backend/loader.py. The dicts are taken over, not copied."""
+        snapshot = cls()
+        snapshot.by_id = ShardedDict(by_id)
+        snapshot.seq_of = ShardedDict(dict(zip(by_id, count())))
+        snapshot.order = SortedChunks(range(len(by_id)), by_id)
+        snapshot.sorted_ids = SortedChunks(sorted_ids)
+        snapshot.by_location = {
+            field: ShardedDict({value: ShardedDict(keys)
+                                for value, keys in index.items()})
+            for field, index in by_location.items()}
+        snapshot.dates = SortedChunks(dates, date_ids)
+        snapshot.date_of = ShardedDict(dict(zip(date_ids, dates)))
+        snapshot._next_seq = len(by_id)
+        return snapshot
+
+    def copy(self) -> "PictureSnapshot":
+        """Returns a copy which may be changed without affecting this
+        snapshot. Records, the pieces of the indexes and the sets of IDs
+        of each location are shared, and only copied when they are
+        changed."""
+        snapshot = PictureSnapshot.__new__(PictureSnapshot)
+        snapshot.by_id = self.by_id.copy()
+        snapshot.seq_of = self.seq_of.copy()
+        snapshot.order = self.order.copy()
+        snapshot.sorted_ids = self.sorted_ids.copy()
+        snapshot.by_location = {field: index.copy()
+                                for field, index in self.by_location.items()}
+        snapshot.dates = self.dates.copy()
+        snapshot.date_of = self.date_of.copy()
+        snapshot.version = self.version
+        snapshot._next_seq = self._next_seq
+        snapshot._owned = set()
+        self._owned = set()
+        return snapshot
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return (self.by_id[key].to_dict() for key in self.order.values())
+
+    def __contains__(self, picture_id: Any) -> bool:
+        return picture_key(picture_id) in self.by_id
+
+    def get(self, picture_id: Any) -> Optional[Dict[str, Any]]:
+        """Returns the picture whose ID is picture_id, or None."""
+        record = self.by_id.get(picture_key(picture_id))
+        return None if record is None else record.to_dict()
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Returns the pictures as a list, in insertion order."""
+        return list(self)
+
+    def slice(self, offset: int = 0,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Returns at most limit pictures, in insertion order, skipping the
+        first offset ones."""
+        stop = None if limit is None else offset + limit
+        return [self.by_id[key].to_dict()
+                for key in self.order.values(offset, stop)]
+
+    def after(self, after_id: int,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Returns at most limit pictures whose integer ID is greater than
+        after_id, in ascending ID order."""
+        start = self.sorted_ids.bisect_right(after_id)
+        stop = None if limit is None else start + limit
+        return [self.by_id[key].to_dict()
+                for key in self.sorted_ids.values(start, stop)]
+
+    def filter(self, locations: Optional[Dict[str, Any]] = None,
+               date_from: Optional[int] = None,
+               date_to: Optional[int] = None,
+               after_id: Optional[int] = None,
+               order: str = "id", offset: int = 0,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Returns a page of the pictures matching every given criterion,
+        in the given order.
+
+        The candidates are read from the index of the criterion matching
+        the fewest pictures, and checked against the others, so the cost
+        depends on the number of matches and not on the size of the
+        catalogue. When the matches are frequent enough to fill the page
+        quickly, the index of the requested order is read instead, up to
+        the end of the page only. Only the pictures of the page are
+        converted to dicts.
+
+        Args:
+            locations (Dict[str, Any]): The values that fields of
+                LOCATION_FIELDS shall have, compared once normalised.
+            date_from (int): The ordinal of the first date of the range.
+            date_to (int): The ordinal of the last date of the range.
+            after_id (int): Only keep the pictures whose integer ID is
+                greater than after_id.
+            order (str): One of ORDERS. Pictures without a valid date are
+                returned last when sorting by date.
+            offset (int): The number of matching pictures to skip.
+            limit (int): The maximum number of pictures returned, None
+                for all of them.
+
+        Returns:
+            List[Dict[str, Any]]: The matching pictures of the page.
+        """
+        buckets = sorted((self.by_location[field].get(location_key(value), {})
+                          for field, value in (locations or {}).items()),
+                         key=len)
+        dated = date_from is not None or date_to is not None
+        start = 0 if date_from is None else self.dates.bisect_left(date_from)
+        stop = (len(self.dates) if date_to is None
+                else self.dates.bisect_right(date_to))
+
+        sizes = [len(bucket) for bucket in buckets[:1]]
+        if dated:
+            sizes.append(stop - start)
+        size = min(sizes, default=len(self))
+        # Reading in order takes about (offset + limit) * len(self) / size
+        # candidates to fill the page, sorting the matches about size
+        in_order = (limit is not None
+                    and (offset + limit) * len(self) < size * size)
+
+        keys: Iterable[Any]
+        if dated and order != "id" and (in_order or stop - start == size):
+            keys = (key for key in self._by_date(start, stop, order)
+                    if self._matches(key, buckets, None, None, after_id))
+        elif dated and stop - start == size and not in_order:
+            keys = sorted((key for key in self.dates.values(start, stop)
+                           if self._matches(key, buckets, None, None,
+                                            after_id)),
+                          key=_id_order)
+        elif buckets and not in_order:
+            keys = self._sort([key for key in buckets[0]
+                               if self._matches(key, buckets[1:], date_from,
+                                                date_to, after_id)], order)
+        else:
+            keys = (key for key in self._all_keys(order, after_id)
+                    if self._matches(key, buckets, date_from, date_to,
+                                     after_id))
+
+        page = islice(keys, offset, None if limit is None else offset + limit)
+        return [self.by_id[key].to_dict() for key in page]
+
+    def _matches(self, key: Any, buckets: List[ShardedDict],
+                 date_from: Optional[int], date_to: Optional[int],
+                 after_id: Optional[int]) -> bool:
+        # Whether the picture key is in every bucket, dated within the
+        # range if any, and after after_id
+        if not all(key in bucket for bucket in buckets):
+            return False
+        if date_from is not None or date_to is not None:
+            ordinal = self.date_of.get(key)
+            if (ordinal is None
+                    or date_from is not None and ordinal < date_from
+                    or date_to is not None and ordinal > date_to):
+                return False
+        return _is_after(key, after_id)
+
+    def _by_date(self, start: int, stop: int, order: str) -> Iterator[Any]:
+        # IDs of the positions start to stop of the date index, in date
+        # order, descending for "-event_date"
+        if not order.startswith("-"):
+            yield from self.dates.values(start, stop)
+            return
+
+        # Pictures of the same date stay in index order, as after a stable
+        # sort in descending order
+        run: List[Any] = []
+        run_date = None
+        for ordinal, key in self.dates.items(start, stop, reverse=True):
+            if ordinal != run_date:
+                yield from reversed(run)
+                run, run_date = [], ordinal
+            run.append(key)
+        yield from reversed(run)
+
+    def _all_keys(self, order: str, after_id: Optional[int]) -> Iterator[Any]:
+        # Every ID, in the given order, each index being read lazily
+        if order == "id":
+            start = (0 if after_id is None
+                     else self.sorted_ids.bisect_right(after_id))
+            yield from self.sorted_ids.values(start)
+            if after_id is None and len(self.sorted_ids) < len(self.by_id):
+                yield from sorted((key for key in self.by_id
+                                   if not isinstance(key, int)),
+                                  key=_id_order)
+            return
+
+        yield from self._by_date(0, len(self.dates), order)
+        yield from (key for key in self.order.values()
+                    if key not in self.date_of)
+
+    def _sort(self, keys: List[Any], order: str) -> List[Any]:
+        if order == "id":
+            return sorted(keys, key=_id_order)
+
+        # Pictures of the same date, and those without one, stay in
+        # insertion order, as in the date index
+        keys.sort(key=self.seq_of.__getitem__)
+        dated = sorted((key for key in keys if key in self.date_of),
+                       key=self.date_of.__getitem__,
+                       reverse=order.startswith("-"))
+        return dated + [key for key in keys if key not in self.date_of]
+
+    def _add(self, picture: Dict[str, Any]) -> bool:
+        key = picture_key(picture["id"])
+        if key in self.by_id:
+            return False
+
+        record = PictureRecord(picture)
+        self.by_id[key] = record
+        self._append(key)
+        self._index(key, record)
+        self.version += 1
+        return True
+
+    def _update(self, picture_id: Any,
+                changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = picture_key(picture_id)
+        old_record = self.by_id.get(key)
+        if old_record is None:
+            return None
+
+        new_key = picture_key(changes.get("id", old_record["id"]))
+        if new_key != key and new_key in self.by_id:
+            raise KeyError(new_key)
+
+        # The record may be read from older snapshots: it is replaced, not
+        # changed in place
+        picture = old_record.to_dict()
+        picture.update(changes)
+        record = PictureRecord(picture)
+
+        self._unindex(key, old_record)
+        if new_key != key:
+            # Moved to the end, as a removal followed by an addition
+            del self.by_id[key]
+            self.order.remove(self.seq_of.pop(key), key)
+            self._append(new_key)
+        self.by_id[new_key] = record
+        self._index(new_key, record)
+
+        self.version += 1
+        return picture
+
+    def _remove(self, picture_id: Any) -> Optional[Dict[str, Any]]:
+        key = picture_key(picture_id)
+        record = self.by_id.pop(key)
+        if record is None:
+            return None
+
+        self._unindex(key, record)
+        self.order.remove(self.seq_of.pop(key), key)
+        self.version += 1
+        return record.to_dict()
+
+    def _append(self, key: Any) -> None:
+        self.seq_of[key] = self._next_seq
+        self.order.insert(self._next_seq, key)
+        self._next_seq += 1
+
+    def _own(self, field: str, value: Any) -> ShardedDict:
+        # Returns the set of IDs of a location, copied first if it may be
+        # shared with older snapshots, which only copies its list of shards
+        index = self.by_location[field]
+        keys = index.get(value)
+        if (field, value) not in self._owned:
+            keys = ShardedDict() if keys is None else keys.copy()
+            index[value] = keys
+            self._owned.add((field, value))
+        return keys
+
+    def _index(self, key: Any, picture: PictureRecord) -> None:
+        if isinstance(key, int):
+            self.sorted_ids.insert(key, key)
+
+        for field in self.by_location:
+            value = location_key(picture.get(field))
+            if isinstance(value, str):
+                self._own(field, value)[key] = None
+
+        ordinal = parse_event_date(picture.get("event_date"))
+        if ordinal is not None:
+            self.date_of[key] = ordinal
+            self.dates.insert(ordinal, key, self.seq_of.__getitem__)
+
+    def _unindex(self, key: Any, picture: PictureRecord) -> None:
+        if isinstance(key, int):
+            self.sorted_ids.remove(key, key)
+
+        for field, index in self.by_location.items():
+            value = location_key(picture.get(field))
+            keys = index.get(value) if isinstance(value, str) else None
+            if keys is not None and key in keys:
+                keys = self._own(field, value)
+                del keys[key]
+                if not keys:
+                    del index[value]
+                    self._owned.discard((field, value))
+
+        ordinal = self.date_of.pop(key)
+        if ordinal is not None:
+            self.dates.remove(ordinal, key, self.seq_of.__getitem__)
+
+
+class PictureStore:
+    """In-memory picture catalogue, safe to share between threads.
+
+    Readers never wait: every read goes to the current PictureSnapshot,
+    which is never modified once published. Writers are serialised by a
+    lock, apply their changes to a copy of the snapshot, and publish it by
+    replacing the reference to the current snapshot, which is atomic. A
+    reader that must see a consistent catalogue across several calls
+    should call them on the result of snapshot().
+
+    Copying the snapshot only copies the lists of the pieces of its
+    indexes, and each write the few pieces it changes, so a write takes
+    about the square root of the size of the catalogue. batch() lets
+    several writes share one copy, and publishes them all at once.
+    """
+
+    def __init__(self, pictures: Iterable[Dict[str, Any]] = ()) -> None:
+        self._lock = threading.RLock()
+        self._state = PictureSnapshot()
+        # Copy being changed by the write in progress, if any
+        self._pending: Optional[PictureSnapshot] = None
+        self.replace(pictures)
+
+    @property
+    def version(self) -> int:
+        return self._state.version
+
+    def snapshot(self) -> PictureSnapshot:
+        """Returns the current version of the catalogue."""
+        return self._state
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._state)
+
+    def __contains__(self, picture_id: Any) -> bool:
+        return picture_id in self._state
+
+    def get(self, picture_id: Any) -> Optional[Dict[str, Any]]:
+        """Returns the picture whose ID is picture_id, or None."""
+        return self._state.get(picture_id)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Returns the pictures as a list, in insertion order."""
+        return self._state.to_list()
+
+    def slice(self, offset: int = 0,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """See PictureSnapshot.slice()."""
+        return self._state.slice(offset, limit)
+
+    def after(self, after_id: int,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """See PictureSnapshot.after()."""
+        return self._state.after(after_id, limit)
+
+    def filter(self, *args: Any, **kwargs: Any) -> List[Dict[str, Any]]:
+        """See PictureSnapshot.filter()."""
+        return self._state.filter(*args, **kwargs)
+
+    def sync(self) -> None:
+        """Applies the writes made by other processes sharing the store.
+        An in-memory store is not shared, so there are none."""
+
+    @contextmanager
+    def batch(self) -> Iterator[PictureSnapshot]:
+        """Groups the writes made within it: readers see either none or
+        all of them, and none if an exception is raised. Yields the copy
+        of the catalogue being changed."""
+        with self._lock:
+            if self._pending is not None:
+                yield self._pending
+                return
+
+            self._pending = self._state.copy()
+            try:
+                yield self._pending
+                self._state = self._pending
+            finally:
+                self._pending = None
+
+    def add(self, picture: Dict[str, Any]) -> bool:
+        """Appends a picture to the catalogue.
+
+        Returns:
+            bool: False if a picture with the same ID is already present,
+            in which case the catalogue is left unchanged.
+        """
+        with self.batch() as pending:
+            return pending._add(picture)
+
+    def update(self, picture_id: Any,
+               changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merges changes into the picture whose ID is picture_id.
+
+        If changes carries a new ID, the record is re-indexed under it.
+
+        Returns:
+            Optional[Dict[str, Any]]: The updated picture, or None if no
+            picture has this ID.
+
+        Raises:
+            KeyError: If the new ID is already used by another picture.
+        """
+        with self.batch() as pending:
+            return pending._update(picture_id, changes)
+
+    def remove(self, picture_id: Any) -> Optional[Dict[str, Any]]:
+        """Deletes and returns the picture whose ID is picture_id, or None."""
+        with self.batch() as pending:
+            return pending._remove(picture_id)
+
+    def replace(self, pictures: Iterable[Dict[str, Any]]) -> None:
+        """Replaces the whole catalogue with pictures."""
+        self.publish(PictureSnapshot.build(pictures))
+
+    def publish(self, state: PictureSnapshot) -> None:
+        """Replaces the whole catalogue with a snapshot built beforehand,
+        e.g. by PictureSnapshot.build(), which must not be changed
+        afterwards."""
+        with self._lock:
+            state._owned = set()
+            # Keeps the version increasing, so that caches see the change
+            state.version = (self._pending or self._state).version + 1
+            if self._pending is not None:
+                self._pending = state
+            else:
+                self._state = state
@@ -0,0 +1,85 @@
+"""
+Memory benchmark of the in-memory representation of the pictures.
+
+Loads the same catalogue, decoded from JSON, as plain dicts (the former
+representation) and as the PictureRecord held by the store now, each in a
+child process, and reports the memory allocated for the pictures and the
+growth of the resident set size (RSS) of the process (Linux only). The
+RSS growth of the dicts includes the JSON text decoded at once.
+
+Usage, from the Pictures directory:
+    python -m benchmarks.bench_memory [number of pictures]
+"""
+import json
+import multiprocessing
+import os
+import sys
+import tracemalloc
+
+from backend.records import PictureRecord
+
+
+def make_catalogue(count: int) -> list:
+    """Returns count pictures built from pictures.json, each with its own
+    ID and URL, encoded as one JSON document per picture."""
+    site_root = os.path.realpath(os.path.dirname(__file__))
+    json_path = os.path.join(site_root, "..", "backend", "data",
+                             "pictures.json")
+    with open(json_path) as json_file:
+        seed = json.load(json_file)
+
+    pictures = []
+    for index in range(count):
+        picture = dict(seed[index % len(seed)])
+        picture["id"] = index + 1
+        picture["pic_url"] += f"?picture={index + 1}"
+        pictures.append(json.dumps(picture))
+    return pictures
+
+
+def current_rss() -> int:
+    """Returns the resident set size of the process, in bytes."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def measure(representation: str, catalogue: list, queue) -> None:
+    # Runs in a child process, so that each representation starts from
+    # the same resident set
+    rss_before = current_rss()
+    tracemalloc.start()
+    if representation == "PictureRecord":
+        pictures = [PictureRecord(json.loads(line)) for line in catalogue]
+    else:
+        # Decoded as one array, like json.load did, which shares the keys
+        # of the dicts
+        pictures = json.loads("[" + ",".join(catalogue) + "]")
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    queue.put((allocated, current_rss() - rss_before))
+    del pictures
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    catalogue = make_catalogue(count)
+    print(f"Holding {count} pictures")
+    print(f"{'':<20}{'allocated':>14}{'per picture':>14}{'RSS growth':>14}")
+
+    results = {}
+    for representation in ("dict", "PictureRecord"):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=measure, args=(representation, catalogue, queue))
+        process.start()
+        allocated, rss = results[representation] = queue.get()
+        process.join()
+        print(f"{representation:<20}{allocated / 2 ** 20:>11.1f} MB"
+              f"{allocated / count:>12.0f} B{rss / 2 ** 20:>11.1f} MB")
+
+    ratio = results["PictureRecord"][0] / results["dict"][0]
+    print(f"{'PictureRecord / dict':<20}{ratio:>13.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+#!/bin/sh
+# Starts the Pictures service with the server selected by SERVER_MODE:
+# - development (default): Flask's built-in development server;
+# - production: gunicorn, configured by gunicorn.conf.py.
+
+if [ "$SERVER_MODE" = "production" ]; then
+  echo "Starting the Pictures API with gunicorn..."
+  exec gunicorn -c gunicorn.conf.py backend:app
+fi
+
+echo "Starting the Pictures API with the development server..."
+exec flask run --host=0.0.0.0 --port="${PORT:-3000}"
@@ -1,6 +1,13 @@
+import gzip
 import json
 import pytest
+import threading
 from backend import app
+from backend.compression import ENCODINGS, choose_encoding
+from backend.loader import iter_json_records, load_catalogue, read_snapshot
+from backend.records import PictureRecord
+from backend.storage import PersistentPictureStore, SQLiteStorage
+from backend.store import PictureSnapshot, PictureStore, parse_event_date
 
 
 @pytest.fixture()
@@ -88,6 +95,25 @@ def test_post_picture_duplicate(picture, client):
     assert res.json['Message'] == message_str
 
 
+def test_post_picture_invalid_id(picture, client):
+    for picture_id in ([1], {"a": 1}, 1.5, None, True, "one"):
+        picture["id"] = picture_id
+        res = client.post("/picture", data=json.dumps(picture),
+                          content_type="application/json")
+        assert res.status_code == 400
+        res = client.put("/picture/2", data=json.dumps(picture),
+                         content_type="application/json")
+        assert res.status_code == 400
+
+    # IDs in a string, or as a float without a fractional part, are
+    # normalised
+    for picture_id in ("2", 2.0):
+        picture["id"] = picture_id
+        res = client.post("/picture", data=json.dumps(picture),
+                          content_type="application/json")
+        assert res.status_code == 302
+
+
 def test_update_picture_by_id(client, picture):
     id = '2'
     res = client.get(f'/picture/{id}')
@@ -112,3 +138,519 @@ def test_delete_picture_by_id(client):
     assert res.json['length'] == 10
     res = client.delete("/picture/100")
     assert res.status_code == 404
+
+
+def test_update_picture_not_found(client, picture):
+    res = client.put('/picture/404', data=json.dumps(picture),
+                     content_type="application/json")
+    assert res.status_code == 404
+    res = client.get("/count")
+    assert res.json['length'] == 10
+
+
+def test_picture_store_keeps_order_and_ids():
+    store = PictureStore([{"id": 3}, {"id": 1}, {"id": 2}])
+    assert [p["id"] for p in store] == [3, 1, 2]
+    assert store.get("1") == {"id": 1}
+    assert not store.add({"id": 1})
+    assert store.remove(1) == {"id": 1}
+    assert 1 not in store
+    assert store.update(3, {"id": 4})["id"] == 4
+    assert store.get(3) is None and store.get(4) == {"id": 4}
+
+
+def test_get_pictures_paginated(client):
+    res = client.get("/picture?offset=2&limit=3")
+    assert res.status_code == 200
+    assert [p["id"] for p in res.json] == [4, 5, 6]
+
+    res = client.get("/picture?after_id=5&limit=3")
+    assert [p["id"] for p in res.json] == [6, 7, 8]
+    assert res.headers["X-Next-After-Id"] == "8"
+
+    # Picture 1 was deleted and picture 200 created by the previous tests
+    res = client.get("/picture?after_id=8&limit=5")
+    assert [p["id"] for p in res.json] == [9, 10, 200]
+    assert "X-Next-After-Id" not in res.headers
+
+    res = client.get("/picture?limit=-1")
+    assert res.status_code == 400
+
+
+def test_get_pictures_stream(client):
+    res = client.get("/picture?stream=1")
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == "application/json"
+    assert res.json == client.get("/picture").json
+
+
+def test_get_pictures_etag(client, picture):
+    res = client.get("/picture")
+    etag = res.headers["ETag"]
+    res = client.get("/picture", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+
+    res = client.get("/picture/2")
+    picture_etag = res.headers["ETag"]
+    res = client.get("/picture/2", headers={"If-None-Match": picture_etag})
+    assert res.status_code == 304
+
+    # A write must invalidate the cached bodies
+    picture["id"] = 201
+    client.post("/picture", data=json.dumps(picture),
+                content_type="application/json")
+    res = client.get("/picture", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json[-1]["id"] == 201
+    client.delete("/picture/201")
+
+
+def test_get_pictures_gzip(client):
+    res = client.get("/picture", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(res.data)) == client.get("/picture").json
+
+
+def test_batch_pictures(client, picture):
+    picture["id"] = 300
+    operations = [
+        {"op": "create", "picture": picture},
+        {"op": "create", "picture": picture},
+        {"op": "update", "id": 300,
+         "picture": {"id": 300, "event_city": "Oakland"}},
+        {"op": "delete", "id": 404},
+        {"op": "rename"},
+        {"op": "delete", "id": 300}
+    ]
+    res = client.post("/picture/batch", data=json.dumps(operations),
+                      content_type="application/json")
+    assert res.status_code == 200
+    statuses = [result["status"] for result in res.json["results"]]
+    assert statuses == [201, 302, 200, 404, 400, 204]
+    assert res.json["results"][2]["body"]["picture"]["event_city"] == "Oakland"
+    assert client.get("/picture/300").status_code == 404
+
+    res = client.post("/picture/batch", data=json.dumps({"op": "create"}),
+                      content_type="application/json")
+    assert res.status_code == 400
+
+
+def test_batch_pictures_invalid_ids(client, picture):
+    picture["id"] = 301
+    operations = [
+        {"op": "create", "picture": picture},
+        {"op": "create", "picture": dict(picture, id=[1])},
+        {"op": "update", "id": {"a": 1}, "picture": {"id": 301}},
+        {"op": "update", "id": 301, "picture": {"id": [301]}},
+        {"op": "delete", "id": [301]},
+        {"op": "update", "id": 301,
+         "picture": {"id": 301, "event_city": "Oakland"}},
+    ]
+    res = client.post("/picture/batch", data=json.dumps(operations),
+                      content_type="application/json")
+    assert res.status_code == 200
+    statuses = [result["status"] for result in res.json["results"]]
+    assert statuses == [201, 400, 400, 400, 400, 200]
+    # The valid operations were applied
+    assert client.get("/picture/301").json["event_city"] == "Oakland"
+    assert client.delete("/picture/301").status_code == 204
+
+
+def test_get_pictures_filtered(client):
+    res = client.get("/picture?state=florida")
+    assert res.status_code == 200
+    assert [picture["id"] for picture in res.json] == [8, 10]
+
+    # Picture 2 was moved to "*Florida" by test_update_picture_by_id
+    res = client.get("/picture?state=*Florida")
+    assert [picture["id"] for picture in res.json] == [2]
+
+    res = client.get("/picture?country=United%20States&city=Miami%20Beach")
+    assert [picture["id"] for picture in res.json] == [10]
+
+    res = client.get("/picture?from=7/1/2022&to=2022-08-31")
+    assert [picture["id"] for picture in res.json] == [3, 6, 8, 9]
+
+    res = client.get("/picture?state=Florida&from=7/1/2022&limit=1")
+    assert [picture["id"] for picture in res.json] == [8]
+
+    res = client.get("/picture?state=Florida&after_id=8")
+    assert [picture["id"] for picture in res.json] == [10]
+
+    res = client.get("/picture?city=Paris")
+    assert res.json == []
+
+    res = client.get("/picture?from=31/12/2022")
+    assert res.status_code == 400
+
+
+def test_picture_store_filter_indexes_follow_writes():
+    store = PictureStore([
+        {"id": 1, "event_city": "Paris", "event_date": "1/5/2022"},
+        {"id": 2, "event_city": "Lyon", "event_date": "1/5/2022"},
+    ])
+    assert store.filter({"event_city": "paris"}) == [store.get(1)]
+
+    store.update(1, {"id": 3, "event_city": "Lyon", "event_date": "2/1/2022"})
+    assert [p["id"] for p in store.filter({"event_city": "Lyon"})] == [2, 3]
+    assert store.filter({"event_city": "Paris"}) == []
+    january = store.filter(date_from=parse_event_date("2022-01-01"),
+                           date_to=parse_event_date("1/31/2022"))
+    assert [p["id"] for p in january] == [2]
+
+    store.remove(2)
+    january_end = parse_event_date("1/31/2022")
+    assert [p["id"] for p in store.filter({"event_city": "Lyon"})] == [3]
+    assert [p["id"] for p in store.filter(date_to=january_end)] == []
+
+
+def test_picture_store_filter_only_builds_the_page(monkeypatch):
+    store = PictureStore({"id": i, "event_city": f"City {i % 100}",
+                          "event_date": f"1/{i % 28 + 1}/2022"}
+                         for i in range(1000))
+    built = []
+    to_dict = PictureRecord.to_dict
+    monkeypatch.setattr(PictureRecord, "to_dict",
+                        lambda record: built.append(record.id)
+                        or to_dict(record))
+
+    page = store.filter({"event_city": "city 7"}, offset=2, limit=3)
+    assert [picture["id"] for picture in page] == [207, 307, 407]
+    assert built == [207, 307, 407]
+
+    # A city within a wide date range is read from the city index
+    built.clear()
+    page = store.filter({"event_city": "city 7"},
+                        date_from=parse_event_date("1/1/2022"),
+                        date_to=parse_event_date("1/8/2022"), limit=2)
+    assert [picture["id"] for picture in page] == [7, 507]
+    assert built == [7, 507]
+
+
+def test_get_pictures_sorted_by_date(client):
+    res = client.get("/picture?sort=event_date")
+    assert res.status_code == 200
+    dates = [picture["event_date"] for picture in res.json]
+    # Dates keep their original format, but are ordered as dates
+    assert dates[:3] == ["3/10/2022", "4/1/2022", "7/11/2022"]
+    assert len(dates) == len(client.get("/picture").json)
+
+    res = client.get("/picture?sort=-event_date&state=Florida")
+    assert [picture["id"] for picture in res.json] == [10, 8]
+
+    res = client.get("/picture?sort=event_date&from=8/1/2022&limit=2")
+    assert [picture["id"] for picture in res.json] == [6, 9]
+
+    res = client.get("/picture?sort=date")
+    assert res.status_code == 400
+    res = client.get("/picture?sort=event_date&after_id=3")
+    assert res.status_code == 400
+
+
+def test_picture_store_sorts_by_date():
+    store = PictureStore([
+        {"id": 1, "event_date": "12/1/2021"},
+        {"id": 2, "event_date": "not a date"},
+        {"id": 3, "event_date": "2/1/2021"},
+        {"id": 4, "event_date": "12/1/2021"},
+    ])
+    ids = [picture["id"] for picture in store.filter(order="event_date")]
+    assert ids == [3, 1, 4, 2]
+    ids = [picture["id"] for picture in store.filter(order="-event_date")]
+    assert ids == [1, 4, 3, 2]
+
+    store.update(3, {"event_date": "1/1/2022"})
+    ids = [picture["id"] for picture in store.filter(order="event_date")]
+    assert ids == [1, 4, 3, 2]
+
+
+def test_picture_store_sorted_pages_only_read_the_page(monkeypatch):
+    pictures = [{"id": i, "event_country": "France",
+                 "event_date": f"{i % 12 + 1}/1/2022"} for i in range(600)]
+    pictures.append({"id": 600, "event_date": "not a date"})
+    store = PictureStore(pictures)
+
+    def date_order(picture):
+        return parse_event_date(picture["event_date"])
+
+    dated = pictures[:600]
+    expected = {
+        "id": list(range(601)),
+        "event_date": [p["id"] for p in sorted(dated, key=date_order)],
+        "-event_date": [p["id"] for p in sorted(dated, key=date_order,
+                                                reverse=True)],
+    }
+    for order, ids in expected.items():
+        ids = [picture_id for picture_id in ids if picture_id != 600]
+        page = store.filter(order=order, offset=5, limit=4)
+        assert [picture["id"] for picture in page] == ids[5:9]
+        # Read from the date or ID index, or sorted, the same pictures
+        page = store.filter({"event_country": "france"}, order=order,
+                            offset=5, limit=4)
+        assert [picture["id"] for picture in page] == ids[5:9]
+        everything = store.filter({"event_country": "france"}, order=order)
+        assert [picture["id"] for picture in everything] == ids
+
+    built = []
+    to_dict = PictureRecord.to_dict
+    monkeypatch.setattr(PictureRecord, "to_dict",
+                        lambda record: built.append(record.id)
+                        or to_dict(record))
+    page = store.filter(order="-event_date", offset=1, limit=2)
+    assert built == [picture["id"] for picture in page] == \
+        expected["-event_date"][1:3]
+
+
+def test_persistent_store_is_shared_and_durable(tmp_path):
+    path = str(tmp_path / "pictures.db")
+    storage = SQLiteStorage(path)
+    assert storage.seed([{"id": 1, "event_city": "Paris"},
+                         {"id": 2, "event_city": "Lyon"}]) == 2
+    assert storage.seed([{"id": 3}]) == 0
+
+    # Two workers sharing the same database
+    first = PersistentPictureStore(storage)
+    second = PersistentPictureStore(SQLiteStorage(path))
+    assert first.add({"id": 3, "event_city": "Nice"})
+    assert first.update(1, {"id": 4})["id"] == 4
+    assert first.remove(2) is not None
+
+    version = second.version
+    second.sync()
+    assert [picture["id"] for picture in second] == [3, 4]
+    assert second.filter({"event_city": "Paris"}) == [second.get(4)]
+    assert second.version > version
+
+    # The second worker sees the IDs added by the first one
+    assert not second.add({"id": 3})
+
+    # A restart reloads the catalogue in the same order
+    restarted = PersistentPictureStore(SQLiteStorage(path))
+    assert restarted.to_list() == first.to_list()
+
+
+def test_persistent_store_reloads_after_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr("backend.storage.COMPACT_EVERY", 2)
+    path = str(tmp_path / "pictures.db")
+    writer = PersistentPictureStore(SQLiteStorage(path, log_keep=1))
+    reader = PersistentPictureStore(SQLiteStorage(path))
+    for picture_id in range(1, 5):
+        writer.add({"id": picture_id})
+
+    # The first changes were compacted away: the reader reloads everything
+    reader.sync()
+    assert reader.to_list() == writer.to_list()
+
+
+def test_picture_store_readers_see_consistent_snapshots():
+    store = PictureStore({"id": i, "event_city": "Paris"} for i in range(500))
+    errors = []
+    done = threading.Event()
+
+    def write():
+        for i in range(500, 700):
+            with store.batch():
+                store.add({"id": i, "event_city": "Paris"})
+                store.remove(i - 500)
+        done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                snapshot = store.snapshot()
+                pictures = snapshot.to_list()
+                # Readers are never exposed to a half-applied write
+                assert len(pictures) == len(snapshot) == 500
+                assert len(snapshot.filter({"event_city": "paris"})) == 500
+        except AssertionError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [picture["id"] for picture in store] == list(range(200, 700))
+
+
+def test_picture_store_batch_is_atomic():
+    store = PictureStore([{"id": 1}])
+    version = store.version
+    with pytest.raises(KeyError):
+        with store.batch():
+            store.add({"id": 2})
+            store.update(2, {"id": 1})
+    assert store.to_list() == [{"id": 1}]
+    assert store.version == version
+
+    with store.batch():
+        store.add({"id": 2})
+        store.remove(1)
+        # Not published before the end of the batch
+        assert store.to_list() == [{"id": 1}]
+    assert store.to_list() == [{"id": 2}]
+
+
+def test_picture_store_write_only_copies_what_it_changes():
+    store = PictureStore({"id": i, "event_city": f"City {i % 10}",
+                          "event_date": "1/1/2020"} for i in range(5000))
+    before = store.snapshot()
+    store.add({"id": 5000, "event_city": "City 3"})
+    after = store.snapshot()
+    assert len(before) == 5000 and len(after) == 5001
+
+    # One shard of the records is copied, the others are shared
+    assert _copied_shards(before.by_id, after.by_id) == 1
+    # So are the sets of IDs of the other cities, and the date index
+    cities = (before.by_location["event_city"],
+              after.by_location["event_city"])
+    assert cities[0]["city 4"] is cities[1]["city 4"]
+    assert cities[0]["city 3"] is not cities[1]["city 3"]
+    assert all(old is new
+               for old, new in zip(before.dates.chunks, after.dates.chunks))
+
+
+def test_picture_store_write_to_a_large_location_copies_one_shard():
+    # Every picture but a few is in the same country
+    store = PictureStore({"id": i, "event_city": f"City {i % 10}",
+                          "event_country": "Canada" if i % 1000 == 0
+                          else "United States",
+                          "event_date": f"1/{i % 28 + 1}/2020"}
+                         for i in range(20000))
+    writes = [
+        lambda: store.add({"id": 20000, "event_country": "United States",
+                           "event_date": "1/5/2020"}),
+        lambda: store.update(20000, {"event_city": "City 3"}),
+        lambda: store.update(7, {"event_date": "1/5/2020"}),
+        lambda: store.remove(11),
+    ]
+    for write in writes:
+        before = store.snapshot()
+        write()
+        after = store.snapshot()
+        countries = (before.by_location["event_country"],
+                     after.by_location["event_country"])
+        assert _copied_shards(countries[0]["united states"],
+                              countries[1]["united states"]) <= 1
+        assert countries[0]["canada"] is countries[1]["canada"]
+        changed = [old is not new for old, new in zip(before.dates.chunks,
+                                                      after.dates.chunks)]
+        assert sum(changed) <= 2
+
+    assert len(store.filter({"event_country": "united states"})) == 19980
+    # Pictures of the same date stay in insertion order, whichever index
+    # the candidates are read from
+    by_date = store.filter({"event_country": "United States"},
+                           order="event_date")
+    assert by_date == store.filter({"event_country": "United States"},
+                                   order="event_date", limit=len(store))
+    assert [picture["id"] for picture in by_date
+            if picture["event_date"] == "1/5/2020"] == [
+        i for i in range(20001)
+        if i % 1000 and i % 28 == 4 or i in (7, 20000)]
+
+
+def _copied_shards(before, after):
+    # Number of shards of the ShardedDict after not shared with before
+    return sum(before.shards.get(index) is not shard
+               for index, shard in after.shards.items())
+
+
+def test_picture_record_round_trip(picture):
+    record = PictureRecord(json.loads(json.dumps(picture)))
+    assert record.to_dict() == picture
+    assert record["event_city"] == "Fremont"
+    # Repeated locations are shared between records
+    other = PictureRecord(json.loads(json.dumps(picture)))
+    assert other.event_city is record.event_city
+
+    partial = {"id": 1, "event_city": None, "tags": ["concert"]}
+    record = PictureRecord(partial)
+    assert record.to_dict() == partial
+    assert record.get("pic_url", "none") == "none"
+    with pytest.raises(KeyError):
+        record["pic_url"]
+    with pytest.raises(AttributeError):
+        record.event_city = "Paris"
+
+
+def test_iter_json_records_streams_arrays_and_ndjson(tmp_path, picture):
+    pictures = [picture, {"id": 201, "tags": ["a]", "{b"]}, {"id": 202}]
+    array_path = tmp_path / "pictures.json"
+    array_path.write_text(" \n" + json.dumps(pictures, indent=2))
+    # Small chunks, so that records span several of them
+    assert list(iter_json_records(str(array_path), chunk_size=7)) == pictures
+
+    ndjson_path = tmp_path / "pictures.ndjson"
+    ndjson_path.write_text("".join(json.dumps(p) + "\n\n" for p in pictures))
+    assert list(iter_json_records(str(ndjson_path), chunk_size=7)) == pictures
+
+    array_path.write_text(json.dumps(pictures)[:-1])
+    with pytest.raises(ValueError):
+        list(iter_json_records(str(array_path), chunk_size=7))
+
+
+def test_picture_store_build_matches_incremental_writes():
+    pictures = [{"id": i, "event_city": f"City {i % 3}",
+                 "event_date": f"1/{i % 5 + 1}/2020"} for i in range(30, 0, -1)]
+    built = PictureSnapshot.build(pictures)
+    store = PictureStore()
+    for picture in pictures:
+        store.add(picture)
+
+    incremental = store.snapshot()
+    assert built.to_list() == incremental.to_list()
+    assert built.sorted_ids == incremental.sorted_ids
+    # The ordinals, with the IDs of their pictures
+    assert built.dates == incremental.dates
+    assert built.by_location == incremental.by_location
+
+
+def test_load_catalogue_writes_and_reads_a_snapshot(tmp_path, picture):
+    json_path = tmp_path / "pictures.json"
+    json_path.write_text(json.dumps([picture, {"id": "x", "extra": 1}]))
+    snapshot_path = str(tmp_path / "pictures.snap")
+
+    built = load_catalogue(str(json_path), snapshot_path)
+    loaded = read_snapshot(snapshot_path)
+    assert loaded.to_list() == built.to_list()
+    assert loaded.filter({"event_city": "fremont"}) == [picture]
+    assert loaded.date_of == built.date_of
+    assert load_catalogue(str(json_path), snapshot_path).to_list() == \
+        built.to_list()
+
+    # A snapshot which cannot be read is rebuilt from the seed file
+    with open(snapshot_path, "wb") as snapshot_file:
+        snapshot_file.write(b"garbage")
+    assert load_catalogue(str(json_path), snapshot_path).to_list() == \
+        built.to_list()
+    assert read_snapshot(snapshot_path).to_list() == built.to_list()
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("*") == ENCODINGS[0]
+    assert choose_encoding(None) is None
+    assert choose_encoding("br;q=0.5, gzip;q=0.8") == "gzip"
+
+
+def test_get_pictures_compressed_when_filtered_or_streamed(client):
+    expected = client.get("/picture?sort=event_date").json
+    res = client.get("/picture?sort=event_date",
+                     headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in res.headers["Vary"]
+    assert json.loads(gzip.decompress(res.data)) == expected
+
+    res = client.get("/picture?stream=1", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(res.data)) == \
+        client.get("/picture").json
+
+    # Small bodies are sent as they are
+    res = client.get("/count", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in res.headers
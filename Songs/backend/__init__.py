@@ -1,9 +1,11 @@
 # backend/__init__.py
 import os
-import json
 from flask import Flask
-from pymongo import MongoClient
-from pymongo.errors import OperationFailure
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from .commands import register_commands
+from .compression import compress_response
+from .db import (AUTHENTICATION_ERROR_CODES, INDEX_CONFLICT_ERROR_CODES,
+                 LazyDatabase, client_options_from_env, ensure_indexes)
 from .routes import register_routes
 
 
@@ -17,6 +19,9 @@ def create_app(test_config=None):
     # Default configuration
     app.config.from_mapping(
         SECRET_KEY='dev',
+        # Keyword arguments of MongoClient, such as maxPoolSize, added to
+        # the ones set through the MONGODB_* environment variables
+        MONGODB_CLIENT_OPTIONS={},
         # Additional default configurations can be placed here
     )
 
@@ -59,6 +64,9 @@ def create_app(test_config=None):
         msg_str = "Application in test mode, DB will be injected by Pytest."
         app.logger.info(msg_str)
         app.db = None  # Will be replaced by the fixture test_db
+
+        # Test databases may lack the text index of GET /song/search
+        app.config.setdefault('SONGS_SEARCH_BACKEND', 'memory')
     else:
         # Connection for the production/development environment
         if mongodb_username and mongodb_password:
@@ -67,58 +75,54 @@ def create_app(test_config=None):
         else:
             url = f"mongodb://{mongodb_service}:{mongodb_port}/"
 
-        app.logger.info(f"Connecting to production MongoDB at: {url}")
-        try:
-            client = MongoClient(url)
-            app.db = client[db_name]  # The production/development database
+        # The MongoClient is only created when the database is first used,
+        # once per process, so that creating the application (e.g. in the
+        # gunicorn master, before forking the workers) costs no round trip.
+        # The initial songs are loaded by the one-shot 'flask seed-db'
+        # command, not on every startup.
+        client_options = client_options_from_env(os.environ)
+        client_options.update(app.config.get('MONGODB_CLIENT_OPTIONS', {}))
+
+        def on_connect(db):
             app.logger.info(f"Connected to MongoDB database: {db_name}")
 
-            # Initial data cleanup / reloading for the development environment
-            # WARNING: This is EXTREMELY DANGEROUS IN PRODUCTION!
-            # In production, NEVER clear and reload the DB on every startup.
-            # This is a dev practice to ensure fresh data.
-            SITE_ROOT = os.path.realpath(os.path.dirname(__file__))
-            json_url = os.path.join(SITE_ROOT, "data", "songs.json")
+            # Creates the unique index on songs.id, which the write routes
+            # rely on to reject duplicates
             try:
-                with open(json_url, 'r') as f:
-                    songs_list: list = json.load(f)
-
-                # Load only if the collection is empty
-                if app.db.songs.count_documents({}) == 0:
-                    app.db.songs.insert_many(songs_list)
-                    msg_str = f"Inserted {len(songs_list)} initial songs "
-                    msg_str += "into production DB."
-                    app.logger.info(msg_str)
-
-                else:
-                    msg_str = "Production DB already contains songs, "
-                    msg_str += "skipping initial load."
-                    app.logger.info(msg_str)
-
-            except FileNotFoundError:
-                msg_str = f"songs.json not found at {json_url}. "
-                msg_str += "No initial songs loaded in production DB."
-                app.logger.warning(msg_str)
-
-            except Exception as e:
-                msg_str = "Error loading initial songs data "
-                msg_str += f"for production DB: {e}"
+                ensure_indexes(db)
+            except DuplicateKeyError as e:
+                msg_str = "Cannot create the unique index on songs.id, "
+                msg_str += f"the collection holds duplicate IDs: {e}"
                 app.logger.error(msg_str)
+            except OperationFailure as e:
+                if e.code in INDEX_CONFLICT_ERROR_CODES:
+                    # The routes keep working with the existing index
+                    msg_str = "An index of the songs collection conflicts "
+                    msg_str += f"with the expected one, drop it: {e}"
+                    app.logger.error(msg_str)
+                    return
+                if e.code in AUTHENTICATION_ERROR_CODES:
+                    app.logger.critical(
+                        f"MongoDB Authentication error: {str(e)}")
+                else:
+                    app.logger.critical(
+                        f"Cannot create the MongoDB indexes: {str(e)}")
+                raise e
 
-        except OperationFailure as e:
-            app.logger.critical(f"MongoDB Authentication error: {str(e)}")
-            # For a real application, you might want to handle this
-            # more gracefully.
-            # sys.exit(1) or raise a custom exception.
-            raise e
-        except Exception as e:
-            app.logger.critical(f"Failed to connect to MongoDB: {str(e)}")
-            raise e
+        app.logger.info(f"Production MongoDB at: {url}")
+        # The production/development database
+        app.db = LazyDatabase(url, db_name, client_options, on_connect)
 
     # Calls the function register_routes to link the routes
     # with the 'app' instance
     register_routes(app)
 
+    # Compresses the JSON responses for the clients which accept it
+    app.after_request(compress_response)
+
+    # Registers the 'flask seed-db' command
+    register_commands(app)
+
     return app
 
 
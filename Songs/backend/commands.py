@@ -0,0 +1,34 @@
+# backend/commands.py
+import os
+import click
+from flask import Flask, current_app
+from .db import seed_songs
+
+SITE_ROOT = os.path.realpath(os.path.dirname(__file__))
+SONGS_JSON_PATH = os.path.join(SITE_ROOT, "data", "songs.json")
+
+
+# Defines a function that takes a Flask instance as an input parameter and
+# registers all the CLI commands on it
+def register_commands(app_instance: Flask):
+    """
+    Registers the command line commands with the given Flask application
+    instance.
+    """
+
+    @app_instance.cli.command("seed-db")
+    @click.option("--json-path", default=SONGS_JSON_PATH,
+                  show_default=True, help="JSON array of songs to load.")
+    def seed_db(json_path: str) -> None:
+        """
+        Creates the indexes and loads the initial songs into the database
+        if it is empty. Meant to be run once, before starting the
+        workers, e.g. 'flask seed-db' in entrypoint.sh.
+        """
+        try:
+            inserted = seed_songs(current_app.db, json_path,
+                                  current_app.logger)
+        except FileNotFoundError:
+            raise click.ClickException(f"songs.json not found at {json_path}")
+
+        click.echo(f"{inserted} songs inserted.")
@@ -0,0 +1,103 @@
+# backend/compression.py
+"""
+Negotiated compression of the JSON and NDJSON responses, with brotli or
+gzip according to the Accept-Encoding header of the request.
+
+This is a copy of Pictures/backend/compression.py, which documents the
+choices made: each service is built from its own directory, and cannot
+import the code of the others. A change to one copy is to be made to the
+other.
+"""
+import gzip
+import zlib
+from typing import Iterable, Iterator, Optional, Union
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Returns the one of ENCODINGS the Accept-Encoding header prefers, or
+    None."""
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        name, _, value = params.partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    wildcard = qualities.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compresses data with one of ENCODINGS."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def compress_stream(chunks: Iterable[Union[bytes, str]],
+                    encoding: str) -> Iterator[bytes]:
+    """Compresses a streamed body chunk by chunk, flushing each one."""
+    chunks = (chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+              for chunk in chunks)
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def compress_response(response: Response) -> Response:
+    """Compresses the JSON and NDJSON responses for the clients which
+    accept it. Registered with after_request by create_app."""
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.status_code in (204, 304)):
+        return response
+    if (not response.is_streamed
+            and response.calculate_content_length() < COMPRESS_MIN_SIZE):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
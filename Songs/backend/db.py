@@ -0,0 +1,175 @@
+# backend/db.py
+import os
+import threading
+from itertools import islice
+from logging import Logger
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from pymongo import ASCENDING, TEXT, MongoClient
+from pymongo.database import Database
+
+from .loader import iter_json_records
+from .search import FIELD_WEIGHTS
+from .versions import record_change
+
+# Number of songs of the seed file inserted at a time
+SEED_BATCH_SIZE = 1000
+
+# Environment variables exposing the MongoClient options, with the type
+# of their value. Options that are not set keep the PyMongo defaults.
+CLIENT_OPTIONS_FROM_ENV = {
+    'MONGODB_MAX_POOL_SIZE': ('maxPoolSize', int),
+    'MONGODB_MIN_POOL_SIZE': ('minPoolSize', int),
+    'MONGODB_WAIT_QUEUE_TIMEOUT_MS': ('waitQueueTimeoutMS', int),
+    'MONGODB_SERVER_SELECTION_TIMEOUT_MS': ('serverSelectionTimeoutMS', int),
+    # Comma-separated list, e.g. "zstd,snappy,zlib"
+    'MONGODB_COMPRESSORS': ('compressors', str),
+}
+
+
+# Codes of the OperationFailures raised when the credentials are wrong, or
+# lack the required role
+AUTHENTICATION_ERROR_CODES = (13, 18)
+
+# Codes of the OperationFailures raised by create_index when an index of
+# the same name or keys already exists with other options
+INDEX_CONFLICT_ERROR_CODES = (85, 86)
+
+
+def client_options_from_env(environ: Mapping[str, str]) -> Dict[str, Any]:
+    """
+    Reads the MongoClient options set in the environment.
+
+    Args:
+        environ (Mapping[str, str]): The environment variables.
+
+    Returns:
+        Dict[str, Any]: The keyword arguments to pass to MongoClient.
+    """
+    options = {}
+    for variable, (option, option_type) in CLIENT_OPTIONS_FROM_ENV.items():
+        value = environ.get(variable)
+        if value:
+            options[option] = option_type(value)
+    return options
+
+
+def ensure_indexes(db: Database) -> None:
+    """
+    Creates the indexes the routes rely on, if they do not exist yet.
+
+    The unique index on 'id' serves the lookups by ID and the keyset
+    pagination of GET /song, and lets MongoDB itself reject duplicate
+    songs, so that concurrent creations cannot race. The text index on
+    'title' and 'lyrics' serves GET /song/search.
+
+    Args:
+        db (Database): The database holding the 'songs' collection.
+    """
+    db.songs.create_index([('id', ASCENDING)], unique=True, name='id_unique')
+    db.songs.create_index([('title', TEXT), ('lyrics', TEXT)],
+                          weights=FIELD_WEIGHTS, name='title_lyrics_text')
+
+
+class LazyDatabase:
+    """
+    Stands for a MongoDB database whose MongoClient is only created when
+    it is first used, and again in each process the application is
+    forked into.
+
+    MongoClient is not fork-safe: a client created before a fork, e.g. by
+    'gunicorn --preload', must not be used by the worker processes. The
+    proxy therefore remembers the PID of the process that created its
+    client, and creates a new one when it is used from another process.
+    Creating the application does not touch the network either, so that
+    workers start at once.
+    """
+
+    def __init__(self, url: str, db_name: str,
+                 client_options: Optional[Dict[str, Any]] = None,
+                 on_connect: Optional[Callable[[Database], None]] = None
+                 ) -> None:
+        """
+        Args:
+            url (str): The MongoDB connection string.
+            db_name (str): The name of the database.
+            client_options (Dict[str, Any]): Keyword arguments of
+            MongoClient, such as the pool settings.
+            on_connect (Callable[[Database], None]): Called with the
+            database each time a process creates its client. If it
+            raises, the client is closed, and the next use retries.
+        """
+        self._url = url
+        self._db_name = db_name
+        self._client_options = client_options or {}
+        self._on_connect = on_connect
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._db: Optional[Database] = None
+
+    def get(self) -> Database:
+        """Returns the database, through the client of this process."""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    client = MongoClient(self._url, **self._client_options)
+                    try:
+                        db = client[self._db_name]
+                        if self._on_connect is not None:
+                            self._on_connect(db)
+                    except BaseException:
+                        # The next use creates a new client
+                        client.close()
+                        raise
+                    self._db = db
+                    self._pid = pid
+        return self._db
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for the attributes not defined by the proxy itself
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.get()[name]
+
+
+def seed_songs(db: Database, json_path: str, logger: Logger,
+               batch_size: int = SEED_BATCH_SIZE) -> int:
+    """
+    Creates the indexes and, if the 'songs' collection is empty, loads
+    the songs of json_path into it.
+
+    The file is parsed as it is read, and the songs are inserted in
+    batches of batch_size, so that only one batch is held in memory.
+
+    Args:
+        db (Database): The database holding the 'songs' collection.
+        json_path (str): The path of the songs, as a JSON array or NDJSON.
+        logger (Logger): Where progress is reported.
+        batch_size (int): The number of songs sent in each insert_many.
+
+    Returns:
+        int: The number of inserted songs.
+    """
+    ensure_indexes(db)
+
+    if db.songs.count_documents({}, limit=1) != 0:
+        msg_str = "DB already contains songs, skipping initial load."
+        logger.info(msg_str)
+        return 0
+
+    songs = iter_json_records(json_path)
+    inserted = 0
+    while True:
+        batch = list(islice(songs, batch_size))
+        if not batch:
+            break
+        db.songs.insert_many(batch)
+        inserted += len(batch)
+    if inserted:
+        record_change(db)
+    logger.info(f"Inserted {inserted} initial songs into the DB.")
+    return inserted
@@ -0,0 +1,97 @@
+# backend/encoding.py
+"""
+Single-pass JSON encoding of MongoDB documents.
+
+bson.json_util.dumps walks every value through a chain of isinstance
+checks in pure Python, and parse_json used to run it and then parse its
+output back. Here documents are encoded straight to JSON bytes, handing
+only the BSON-specific values (ObjectId, datetime, ...) to a default hook.
+orjson is used when it is installed; the standard library json module is
+the fallback. Both produce the same MongoDB Extended JSON representation
+of BSON values as json_util, e.g. {"$oid": "..."} for an ObjectId.
+"""
+import json
+from typing import Any, Tuple
+
+from bson import ObjectId, json_util
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+JSON_MIMETYPE = 'application/json'
+
+
+def bson_default(value: Any) -> Any:
+    """
+    Converts a BSON-specific value to its Extended JSON form.
+
+    Args:
+        value (Any): A value the JSON encoder cannot serialise by itself.
+
+    Returns:
+        Any: A JSON-compatible object, such as {"$oid": "..."}.
+
+    Raises:
+        TypeError: If the value is not a BSON type either.
+    """
+    # ObjectId is by far the most frequent case: every document has one
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    return json_util.default(value)
+
+
+if orjson is not None:
+    # Lets datetimes through to bson_default, so that they are encoded
+    # as {"$date": ...} like json_util does, not as plain strings
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(data: Any) -> bytes:
+        """Encodes data, which may contain BSON types, to JSON bytes."""
+        return orjson.dumps(data, default=bson_default,
+                            option=_ORJSON_OPTIONS)
+
+else:
+    _encoder = json.JSONEncoder(default=bson_default, separators=(',', ':'))
+
+    def dumps(data: Any) -> bytes:
+        """Encodes data, which may contain BSON types, to JSON bytes."""
+        return _encoder.encode(data).encode('utf-8')
+
+
+def to_json_compatible(data: Any) -> Any:
+    """
+    Converts the BSON-specific values within data to standard
+    JSON-compatible Python types, without going through a JSON string.
+
+    Args:
+        data (Any): The data containing BSON types to be converted.
+
+    Returns:
+        Any: A Python object (dict, list, etc.) with BSON types converted
+        to JSON-friendly formats.
+    """
+    if isinstance(data, dict):
+        return {key: to_json_compatible(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_json_compatible(value) for value in data]
+    if data is None or isinstance(data, (str, int, float)):
+        return data
+    return to_json_compatible(bson_default(data))
+
+
+def json_response(data: Any, status: int = 200) -> Tuple[Response, int]:
+    """
+    Builds a JSON response from data, which may contain BSON types.
+
+    Args:
+        data (Any): The payload of the response.
+        status (int): The HTTP status code.
+
+    Returns:
+        Tuple[Response, int]: A tuple containing a JSON response
+        and an HTTP status code.
+    """
+    return Response(dumps(data), mimetype=JSON_MIMETYPE), status
@@ -0,0 +1,71 @@
+# backend/loader.py
+"""
+Incremental parsing of the seed file of the songs, a JSON array or NDJSON.
+
+iter_json_records() is a copy of the one of Pictures/backend/loader.py,
+which explains how it works: each service is built from its own
+directory, and cannot import the code of the others. A change to one copy
+is to be made to the other.
+"""
+import json
+from typing import Any, Iterator, TextIO
+
+CHUNK_SIZE = 1 << 16
+
+
+def iter_json_records(path: str,
+                      chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Yields the records of a JSON array, or of an NDJSON file, as they are
+    parsed, reading chunk_size characters at a time.
+
+    Raises:
+        ValueError: If the file is not valid JSON, or NDJSON.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as file:
+        buffer = file.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            for line in _lines(buffer, file):
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        position = 1
+        eof = False
+        while True:
+            while True:
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer, position = file.read(chunk_size), 0
+                eof = not buffer
+
+            if position >= len(buffer):
+                raise ValueError(f"{path}: unterminated JSON array")
+            if buffer[position] == ']':
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            if end is None or (end == len(buffer) and not eof):
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            yield record
+            position = end
+
+
+def _lines(head: str, file: TextIO) -> Iterator[str]:
+    rest, _, line = head.rpartition('\n')
+    yield from rest.splitlines()
+    yield line + file.readline()
+    yield from file
@@ -1,7 +1,34 @@
-import json
 from flask import Flask, jsonify, request, make_response, abort, url_for, Response, current_app  # noqa; F401
-from bson import json_util
-from typing import Any, Tuple, Dict
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from .encoding import dumps, json_response, to_json_compatible
+from .search import INDEX_TTL, SearchIndex
+from .versions import (VERSION_FIELDS, changes_filter, collection_version,
+                       not_modified, record_change, set_validators,
+                       song_etag, stamp_new_song, version_update)
+import json
+from itertools import islice
+from typing import Any, Tuple, Dict, Iterator, List, Optional
+
+# Page size used when a client paginates without giving a limit, and the
+# largest page a client may ask for. Both can be overridden in app.config.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Number of documents fetched from MongoDB per round trip when streaming
+# the catalogue. It can be overridden with SONGS_STREAM_BATCH_SIZE.
+STREAM_BATCH_SIZE = 500
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Number of upserts sent to MongoDB per bulk_write by POST /song/bulk.
+# It can be overridden with SONGS_BULK_BATCH_SIZE or '?batch_size='.
+BULK_BATCH_SIZE = 1000
+
+# Number of songs returned by GET /song/search when no limit is given.
+# It can be overridden with SONGS_SEARCH_LIMIT.
+SEARCH_LIMIT = 20
 
 
 def parse_json(data: Any) -> Any:
@@ -16,7 +43,252 @@ def parse_json(data: Any) -> Any:
         Any: A Python object (dict, list, etc.) with BSON types converted
         to JSON-friendly formats.
     """
-    return json.loads(json_util.dumps(data))
+    return to_json_compatible(data)
+
+
+def parse_limit(limit_str: Optional[str], default: int,
+                config: Dict[str, Any]) -> int:
+    """
+    Converts the 'limit' query string argument to a page size, capped at
+    SONGS_MAX_PAGE_SIZE.
+
+    Args:
+        limit_str (Optional[str]): The value of the argument, if given.
+        default (int): The page size used when the argument is absent.
+        config (Dict[str, Any]): The application configuration.
+
+    Returns:
+        int: The page size.
+
+    Raises:
+        ValueError: If 'limit' is not a positive integer.
+    """
+    limit = default
+    if limit_str is not None:
+        try:
+            limit = int(limit_str)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            message_str = "ERROR: 'limit' shall be a positive integer. "
+            message_str += f"Its actual value is '{limit_str}'"
+            raise ValueError(message_str)
+    return min(limit, config.get('SONGS_MAX_PAGE_SIZE', MAX_PAGE_SIZE))
+
+
+def parse_projection(fields_str: Optional[str]) -> Optional[Dict[str, int]]:
+    """
+    Converts the 'fields' query string argument, a comma-separated list
+    of attributes, to a MongoDB projection which always includes 'id'.
+    Returns None, for whole documents, when no fields are given.
+    """
+    if not fields_str:
+        return None
+
+    fields = [name.strip() for name in fields_str.split(',')]
+    projection = {name: 1 for name in fields if name}
+
+    # The cursor of the next page is built from 'id'
+    projection['id'] = 1
+    return projection
+
+
+def parse_page_args(args: Dict[str, str],
+                    config: Dict[str, Any]) -> Tuple[Dict[str, Any],
+                                                     Optional[Dict[str, int]],
+                                                     Optional[int]]:
+    """
+    Builds the MongoDB query, projection and page size matching the
+    'after_id', 'limit' and 'fields' query string arguments of GET /song.
+
+    Args:
+        args (Dict[str, str]): The query string arguments of the request.
+        config (Dict[str, Any]): The application configuration, which may
+        override SONGS_PAGE_SIZE and SONGS_MAX_PAGE_SIZE.
+
+    Returns:
+        Tuple: The query filter, the projection (None for whole documents)
+        and the page size (None when the client did not ask for
+        pagination, in which case every song is returned).
+
+    Raises:
+        ValueError: If 'after_id' or 'limit' is not a valid integer.
+    """
+    query: Dict[str, Any] = {}
+    limit: Optional[int] = None
+
+    after_id_str = args.get('after_id')
+    limit_str = args.get('limit')
+
+    if after_id_str is not None:
+        try:
+            query['id'] = {'$gt': int(after_id_str)}
+        except ValueError:
+            message_str = "ERROR: 'after_id' shall be an integer. "
+            message_str += f"Its actual value is '{after_id_str}'"
+            raise ValueError(message_str)
+
+    if after_id_str is not None or limit_str is not None:
+        limit = parse_limit(
+            limit_str, config.get('SONGS_PAGE_SIZE', DEFAULT_PAGE_SIZE),
+            config)
+
+    projection = parse_projection(args.get('fields'))
+
+    return query, projection, limit
+
+
+def wants_stream(args: Dict[str, str], accept_mimetypes: Any) -> bool:
+    """
+    Tells whether a GET /song request asks for the streaming NDJSON mode,
+    either with '?stream=1' or with an 'Accept: application/x-ndjson'
+    header.
+    """
+    if args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+
+    # JSON is listed first so that wildcard Accept headers keep the
+    # regular response
+    best = accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def text_search(db: Any, query: str, limit: int,
+                projection: Optional[Dict[str, int]]) -> List[Dict[str, Any]]:
+    """
+    Runs a MongoDB $text query on the text index of the songs.
+
+    Args:
+        db (Any): The database holding the 'songs' collection.
+        query (str): The words to search for.
+        limit (int): The maximum number of songs to return.
+        projection (Optional[Dict[str, int]]): The attributes to return,
+        None for whole documents.
+
+    Returns:
+        List[Dict[str, Any]]: The matching songs, best match first, each
+        with its relevance score in 'score'.
+
+    Raises:
+        OperationFailure: If the collection has no text index.
+    """
+    score = {'$meta': 'textScore'}
+    fields = dict(projection or {})
+    fields['score'] = score
+
+    cursor = db.songs.find({'$text': {'$search': query}}, fields)
+    return list(cursor.sort([('score', score)]).limit(limit))
+
+
+def stream_ndjson(cursor: Any) -> Iterator[bytes]:
+    """
+    Yields the documents of a PyMongo cursor as newline-delimited JSON,
+    one document per line, so that only one cursor batch is held in memory
+    at a time.
+    """
+    for document in cursor:
+        yield dumps(document) + b"\n"
+
+
+def parse_song_id(json_data: Dict[str, Any]) -> int:
+    """
+    Converts the 'id' attribute of a song to an integer.
+
+    Args:
+        json_data (Dict[str, Any]): The song, as sent by the client.
+
+    Returns:
+        int: The ID of the song.
+
+    Raises:
+        ValueError: If the ID is missing or is not a valid integer.
+    """
+    try:
+        # Raises a ValueError if the conversion fails (e.g., "abc"), or a
+        # TypeError if the ID is missing (as int(None) is not allowed).
+        return int(json_data.get('id'))
+    except (ValueError, TypeError):
+        message_str = "ERROR: 'id' shall be a valid integer "
+        message_str += "in the request body"
+        raise ValueError(message_str)
+
+
+def iter_bulk_rows(req: Any) -> Iterator[Any]:
+    """
+    Yields the songs sent to POST /song/bulk, either as a JSON array or,
+    with the 'application/x-ndjson' content type, as one JSON document per
+    line. NDJSON bodies are read line by line from the request stream, so
+    they are never held in memory as a whole. A line that is not valid
+    JSON is yielded as the ValueError raised while decoding it.
+    """
+    if req.mimetype == NDJSON_MIMETYPE:
+        for line in req.stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield e
+        return
+
+    rows = req.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise ValueError("ERROR: Request data shall be a JSON array "
+                         "or NDJSON documents")
+    yield from rows
+
+
+def apply_bulk_batch(collection: Collection,
+                     rows: List[Any]) -> Dict[str, Any]:
+    """
+    Upserts a batch of songs, keyed on their 'id', with one unordered
+    bulk_write.
+
+    Args:
+        collection (Collection): The songs collection.
+        rows (List[Any]): The songs of the batch, as sent by the client.
+
+    Returns:
+        Dict[str, Any]: The number of inserted, updated and failed songs,
+        and the errors, each with the index of its row in the batch.
+    """
+    operations = []
+    positions = []   # Index in rows of each operation
+    errors = []
+
+    for index, row in enumerate(rows):
+        try:
+            if isinstance(row, ValueError):
+                raise ValueError(f"ERROR: Invalid JSON document: {row}")
+            if not isinstance(row, dict) or not row:
+                raise ValueError("ERROR: Request data not found")
+            song = dict(row)
+            song['id'] = parse_song_id(song)
+        except ValueError as e:
+            errors.append({"index": index, "message": str(e)})
+            continue
+
+        # The client cannot choose the MongoDB identifier
+        song.pop('_id', None)
+        operations.append(
+            UpdateOne({'id': song['id']}, version_update(song), upsert=True))
+        positions.append(index)
+
+    inserted = updated = 0
+    if operations:
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+            inserted = result.upserted_count
+            updated = result.modified_count
+        except BulkWriteError as e:
+            inserted = e.details.get('nUpserted', 0)
+            updated = e.details.get('nModified', 0)
+            for write_error in e.details.get('writeErrors', []):
+                errors.append({"index": positions[write_error['index']],
+                               "message": write_error.get('errmsg', '')})
+
+    errors.sort(key=lambda error: error['index'])
+    return {"inserted": inserted, "updated": updated,
+            "failed": len(errors), "errors": errors}
 
 
 # Defines a function that takes a Flask instance as an input parameter and
@@ -25,6 +297,9 @@ def register_routes(app_instance: Flask):
     """
     Registers all API routes with the given Flask application instance.
     """
+    # Fallback of GET /song/search, rebuilt after the writes of this app
+    search_index = SearchIndex(
+        app_instance.config.get('SONGS_SEARCH_INDEX_TTL', INDEX_TTL))
 
     ######################################################################
     # INSERT CODE HERE
@@ -38,7 +313,7 @@ def register_routes(app_instance: Flask):
             Tuple[Response, int]: A tuple containing a JSON response
             and an HTTP status code.
         """
-        return {"status": "OK"}, 200
+        return json_response({"status": "OK"}, 200)
 
     @app_instance.route("/count", methods=["GET"])
     def get_count() -> Tuple[Response, int]:
@@ -50,20 +325,124 @@ def register_routes(app_instance: Flask):
             and an HTTP status code.
         """
         count = current_app.db.songs.count_documents({})
-        return jsonify({"count": count}), 200
+        return json_response({"count": count}, 200)
 
     @app_instance.route("/song", methods=["GET"])
     def get_songs() -> Tuple[Response, int]:
         """
-        Retrieves all songs from the database.
+        Retrieves songs from the database.
+
+        Without query string, every song is returned. Clients may instead
+        page through the catalogue, ordered by 'id', with
+        '?after_id=<last id seen>&limit=<page size>', and restrict the
+        returned attributes with '?fields=id,title'. Paginated responses
+        carry 'next_after_id', to be sent back to get the following page,
+        which is null on the last page.
+
+        With '?stream=1' or an 'Accept: application/x-ndjson' header, the
+        songs are instead streamed as newline-delimited JSON documents
+        while the cursor is iterated, without building the whole body.
+
+        The ETag of every response is derived from the change counter of
+        the collection, which is all that is read to answer a client
+        whose copy is still current with "304 Not Modified".
+
+        Returns:
+            Tuple[Response, int]: A tuple containing a JSON response
+            and an HTTP status code.
+        """
+        try:
+            query, projection, limit = parse_page_args(request.args,
+                                                       current_app.config)
+        except ValueError as e:
+            return json_response({"message": str(e)}, 400)
+
+        # Read before the songs: a write in between gives the response an
+        # older ETag, which only costs the client a new download
+        version, updated_at = collection_version(current_app.db)
+        stream = wants_stream(request.args, request.accept_mimetypes)
+        etag = f"songs-{version}" + ("-ndjson" if stream else "")
+        response = not_modified(etag, updated_at, vary=['Accept'])
+        if response is not None:
+            return response, 304
+
+        cursor = current_app.db.songs.find(query, projection)
+
+        if stream:
+            batch_size = current_app.config.get('SONGS_STREAM_BATCH_SIZE',
+                                                STREAM_BATCH_SIZE)
+            cursor = cursor.sort('id', 1).batch_size(batch_size)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            response = Response(stream_ndjson(cursor),
+                                mimetype=NDJSON_MIMETYPE)
+            status = 200
+        elif limit is None:
+            db_songs_list = list(cursor)
+            response, status = json_response({"songs": db_songs_list}, 200)
+        else:
+            db_songs_list = list(cursor.sort('id', 1).limit(limit))
+            next_after_id = None
+            if len(db_songs_list) == limit:
+                next_after_id = db_songs_list[-1]['id']
+
+            response, status = json_response(
+                {"songs": db_songs_list, "next_after_id": next_after_id}, 200)
+
+        set_validators(response, etag, updated_at, vary=['Accept'])
+        return response, status
+
+    @app_instance.route("/song/search", methods=["GET"])
+    def search_songs() -> Tuple[Response, int]:
+        """
+        Searches the titles and lyrics of the songs for the words of
+        '?q='. Songs containing any of them are returned, ordered by
+        relevance score, a word of the title counting ten times as much
+        as a word of the lyrics. '?limit=' bounds the number of songs
+        (SONGS_SEARCH_LIMIT by default), and '?fields=id,title' restricts
+        the returned attributes.
+
+        The query runs on the MongoDB text index, unless the
+        SONGS_SEARCH_BACKEND configuration is 'memory', or is 'auto' (the
+        default) and the database cannot run it: the in-process inverted
+        index of backend/search.py then answers instead.
 
         Returns:
             Tuple[Response, int]: A tuple containing a JSON response
             and an HTTP status code.
         """
-        db_songs_list = list(current_app.db.songs.find({}))
-        songs_json = json_util.dumps({"songs": db_songs_list})
-        return Response(songs_json, mimetype='application/json')
+        query_str = request.args.get('q', '').strip()
+        if not query_str:
+            message_str = "ERROR: 'q' shall contain the words to search for"
+            return json_response({"message": message_str}, 400)
+
+        try:
+            limit = parse_limit(
+                request.args.get('limit'),
+                current_app.config.get('SONGS_SEARCH_LIMIT', SEARCH_LIMIT),
+                current_app.config)
+        except ValueError as e:
+            return json_response({"message": str(e)}, 400)
+
+        projection = parse_projection(request.args.get('fields'))
+        backend = current_app.config.get('SONGS_SEARCH_BACKEND', 'auto')
+
+        songs_list = None
+        if backend != 'memory':
+            try:
+                songs_list = text_search(current_app.db, query_str, limit,
+                                         projection)
+            except OperationFailure as e:
+                if backend == 'mongo':
+                    raise
+                msg_str = "Text index unavailable, searching in memory: "
+                current_app.logger.warning(msg_str + str(e))
+
+        if songs_list is None:
+            songs_list = search_index.search(current_app.db, query_str,
+                                             limit, projection)
+
+        return json_response({"songs": songs_list}, 200)
 
     @app_instance.route("/song/<string:id_str>", methods=["GET"])
     def get_song_by_id(id_str: str) -> Tuple[Response, int]:
@@ -82,21 +461,33 @@ def register_routes(app_instance: Flask):
         except ValueError:
             message_str = "ERROR: Invalid ID format. "
             message_str += f"Its actual value is '{id_str}'"
-            return jsonify({"message": message_str}), 400
+            return json_response({"message": message_str}, 400)
 
         if id <= 0:
             message_str = "ERROR: ID must be a positive integer. "
             message_str += f"Its actual value is {id}"
-            return jsonify({"message": message_str}), 400
+            return json_response({"message": message_str}, 400)
+
+        # A revalidation only reads the version fields of the song
+        if request.if_none_match or request.if_modified_since:
+            versions = current_app.db.songs.find_one(
+                {'id': id}, {'_id': 0, 'id': 1, 'version': 1, 'updated_at': 1})
+            if versions is not None:
+                response = not_modified(song_etag(versions),
+                                        versions.get('updated_at'))
+                if response is not None:
+                    return response, 304
 
         song_by_id = current_app.db.songs.find_one({'id': id})
 
         if (song_by_id is None):
             message_str = f"ERROR: song whose id is {id} not found"
-            return jsonify({"message": message_str}), 404
+            return json_response({"message": message_str}, 404)
 
-        song_json = json_util.dumps(song_by_id)
-        return Response(song_json, mimetype='application/json'), 200
+        response, status = json_response(song_by_id, 200)
+        set_validators(response, song_etag(song_by_id),
+                       song_by_id.get('updated_at'))
+        return response, status
 
     @app_instance.route("/song", methods=["POST"])
     def create_song() -> Tuple[Response, int]:
@@ -111,39 +502,84 @@ def register_routes(app_instance: Flask):
 
         # Checks the existence of some JSON data
         if json_data is None or json_data == {}:
-            return jsonify({"message": "ERROR: Request data not found"}), 400
+            return json_response({"message": "ERROR: Request data not found"}, 400)
 
         # Ensures that the song ID is an integer
         try:
-            # Retrieves the ID from the request body. If absent, returns None.
-            # Then attempts to convert the ID to an integer.
-            # Raises a ValueError if the conversion fails (e.g., "abc").
-            # Raises a TypeError if ID is None (as int(None) is not allowed).
-
-            # Use .get() to avoid KeyError if 'id' is missing
-            song_id = int(json_data.get('id'))
-
-        except (ValueError, TypeError):   # Cases where ID not valid / missing
-            message_str = "ERROR: 'id' shall be a valid integer "
-            message_str += "in the request body"
-            return jsonify({"message": message_str}), 400
+            song_id = parse_song_id(json_data)
+        except ValueError as e:   # Cases where ID not valid / missing
+            return json_response({"message": str(e)}, 400)
 
         # Replaces the ID in json_data with its integer version for insertion
         json_data['id'] = song_id
+        stamp_new_song(json_data)
 
-        # Checks if the song with the specified ID already exists
-        existing_song = current_app.db.songs.find_one({'id': json_data['id']})
-
-        if existing_song is not None:
+        # Inserts the new song. The unique index on 'id' makes MongoDB
+        # reject it atomically if a song with the same ID already exists.
+        try:
+            result = current_app.db.songs.insert_one(json_data)
+        except DuplicateKeyError:
             message_str = f"song with id {json_data['id']} already present"
-            return jsonify({"message": message_str}), 302
+            return json_response({"message": message_str}, 302)
 
-        # Inserts the new song
-        result = current_app.db.songs.insert_one(json_data)
+        record_change(current_app.db)
+        search_index.invalidate()
 
         # Returns the inserted ID
         rtrn_message = {"inserted_id": parse_json(result.inserted_id)}
-        return jsonify(rtrn_message), 201  # 201 Created
+        return json_response(rtrn_message, 201)  # 201 Created
+
+    @app_instance.route("/song/bulk", methods=["POST"])
+    def bulk_upsert_songs() -> Tuple[Response, int]:
+        """
+        Inserts or updates many songs in one request.
+
+        The body is either a JSON array of songs or, with the
+        'application/x-ndjson' content type, one song per line. Each song
+        is validated like in POST /song, then upserted on its 'id'. Songs
+        are written with unordered bulk writes of 'batch_size' songs
+        (query string argument, or SONGS_BULK_BATCH_SIZE).
+
+        Returns:
+            Tuple[Response, int]: A tuple containing a JSON response, with
+            the number of inserted, updated and failed songs per batch and
+            in total, and an HTTP status code.
+        """
+        batch_size_str = request.args.get(
+            'batch_size',
+            current_app.config.get('SONGS_BULK_BATCH_SIZE', BULK_BATCH_SIZE))
+        try:
+            batch_size = int(batch_size_str)
+        except ValueError:
+            batch_size = 0
+        if batch_size <= 0:
+            message_str = "ERROR: 'batch_size' shall be a positive integer. "
+            message_str += f"Its actual value is '{batch_size_str}'"
+            return json_response({"message": message_str}, 400)
+
+        rows = iter_bulk_rows(request)
+        batches = []
+        totals = {"inserted": 0, "updated": 0, "failed": 0}
+        try:
+            while True:
+                batch_rows = list(islice(rows, batch_size))
+                if not batch_rows:
+                    break
+
+                report = apply_bulk_batch(current_app.db.songs, batch_rows)
+                record_change(current_app.db)
+                search_index.invalidate()
+                report['batch'] = len(batches) + 1
+                batches.append(report)
+                for key in totals:
+                    totals[key] += report[key]
+        except ValueError as e:
+            return json_response({"message": str(e)}, 400)
+
+        if not batches:
+            return json_response({"message": "ERROR: Request data not found"}, 400)
+
+        return json_response({"batches": batches, **totals}, 200)
 
     @app_instance.route('/song/<string:id_str>', methods=["PUT"])
     def update_song(id_str: str) -> Tuple[Response, int]:
@@ -162,51 +598,63 @@ def register_routes(app_instance: Flask):
         except ValueError:
             message_str = "ERROR: Invalid ID format. "
             message_str += f"Its actual value is '{id_str}'"
-            return jsonify({"message": message_str}), 400
+            return json_response({"message": message_str}, 400)
 
         if id <= 0:
             message_str = "ERROR: ID must be a positive integer. "
             message_str += f"Its actual value is {id}"
-            return jsonify({"message": message_str}), 400
+            return json_response({"message": message_str}, 400)
 
         json_data: Dict[str, Any] = request.get_json()
 
         # Checks the existence of some JSON data
         if json_data is None:
-            return jsonify({"message": "ERROR: Request data not found"}), 400
+            return json_response({"message": "ERROR: Request data not found"}, 400)
+
+        # Updates the song, if it changes any of its fields, and retrieves
+        # its previous state in a single atomic call
+        query = changes_filter({'id': id}, json_data)
+        existing_song = None
+        if query is not None:
+            try:
+                existing_song = current_app.db.songs.find_one_and_update(
+                    query,
+                    version_update(json_data),
+                    return_document=ReturnDocument.BEFORE
+                )
+            except DuplicateKeyError:
+                message_str = f"song with id {json_data.get('id')} already present"
+                return json_response({"message": message_str}, 302)
 
-        # Checks if the song with the specified ID already exists
-        existing_song = current_app.db.songs.find_one({'id': id})
-        if (existing_song is None):
-            return jsonify({"message": "Song not found"}), 404
-
-        # Updates the song
-        result = current_app.db.songs.update_one(
-            {'id': id},
-            {'$set': {key: json_data[key] for key in json_data.keys()}}
-        )
+        if existing_song is not None:
+            record_change(current_app.db)
+            search_index.invalidate()
+        else:
+            # Either there is no such song, or the update would change
+            # nothing: the song keeps its version
+            existing_song = current_app.db.songs.find_one({'id': id})
+            if existing_song is None:
+                return json_response({"message": "Song not found"}, 404)
+
+        # Compares the data before the update with the values that were set
+        response_message = {
+            key: json_data[key]
+            for key in json_data.keys()
+            if key not in VERSION_FIELDS
+            and json_data[key] != existing_song.get(key)
+        }
 
         status_code: int = 200
-        if result.modified_count == 0:
+        if not response_message:
             response_message = {"message": "Song found, but nothing updated"}
 
         else:
-            # Retrieves the updated song
-            updated_song = current_app.db.songs.find_one({'id': id})
-
-            # Compares the whole data before and after the update
-            response_message = {
-                key: updated_song[key]
-                for key in json_data.keys()
-                if updated_song[key] != existing_song.get(key)
-            }
-
             # Displays the updated attributes
-            response_message['_id'] = parse_json(updated_song['_id'])
+            response_message['_id'] = parse_json(existing_song['_id'])
             response_message['id'] = id
             status_code = 201
 
-        return jsonify(response_message), status_code
+        return json_response(response_message, status_code)
 
     @app_instance.route('/song/<string:id_str>', methods=["DELETE"])
     def delete_song(id_str: str) -> Tuple[Response, int]:
@@ -225,19 +673,22 @@ def register_routes(app_instance: Flask):
         except ValueError:
             message_str = "ERROR: Invalid ID format. "
             message_str += f"Its actual value is '{id_str}'"
-            return jsonify({"message": message_str}), 400
+            return json_response({"message": message_str}, 400)
 
         if id <= 0:
             message_str = "ERROR: ID must be a positive integer. "
             message_str += f"Its value is {id}"
-            return jsonify({"message": message_str}), 400
+            return json_response({"message": message_str}, 400)
 
         # Deletes entity whise ID is id
         result = current_app.db.songs.delete_one({'id': id})
+        if result.deleted_count:
+            record_change(current_app.db)
+        search_index.invalidate()
 
         if result.deleted_count == 0:
-            return jsonify({"message": "Song not found"}), 404
+            return json_response({"message": "Song not found"}, 404)
         elif result.deleted_count == 1:
             return "", 204
         else:
-            return jsonify({"message": "ERROR: Unexpected error"}), 500
+            return json_response({"message": "ERROR: Unexpected error"}, 500)
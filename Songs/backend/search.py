@@ -0,0 +1,137 @@
+# backend/search.py
+"""
+In-process full-text search over the titles and lyrics of the songs.
+
+GET /song/search normally runs a MongoDB $text query on the text index
+created by ensure_indexes. This module is the fallback used when that
+index cannot serve the query, e.g. against a test database: an inverted
+index mapping each word to the IDs of the songs containing it, with the
+number of occurrences weighted like the fields of the text index. A query
+matches the songs containing any of its words, and only costs a lookup
+per word plus the scoring of the matching songs.
+
+Unlike MongoDB, words are not stemmed and stop words are kept, so both
+backends agree on exact words but may rank some songs differently.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo.database import Database
+
+# Weights of the indexed fields, shared with the MongoDB text index
+FIELD_WEIGHTS = {'title': 10, 'lyrics': 1}
+
+# Number of seconds after which the index is rebuilt, so that the songs
+# written by other processes are found too. It can be overridden with
+# SONGS_SEARCH_INDEX_TTL.
+INDEX_TTL = 60
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text: Any) -> List[str]:
+    """Splits text into lower-case words; non-string values have none."""
+    if not isinstance(text, str):
+        return []
+    return _WORD_RE.findall(text.lower())
+
+
+class InvertedIndex:
+    """
+    Maps each word of the indexed fields to the weighted number of its
+    occurrences in each song, keyed by song ID.
+    """
+
+    def __init__(self, documents: Iterable[Dict[str, Any]] = ()) -> None:
+        self._postings: Dict[str, Dict[int, int]] = {}
+        for document in documents:
+            self.add(document)
+
+    def add(self, document: Dict[str, Any]) -> None:
+        """Indexes the words of the title and lyrics of a song."""
+        song_id = document.get('id')
+        if song_id is None:
+            return
+
+        weights: Counter = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for word in tokenize(document.get(field)):
+                weights[word] += weight
+
+        for word, weight in weights.items():
+            self._postings.setdefault(word, {})[song_id] = weight
+
+    def search(self, query: str,
+               limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Finds the songs containing any word of query.
+
+        Args:
+            query (str): The words to search for.
+            limit (int): The maximum number of results, None for all.
+
+        Returns:
+            List[Tuple[int, float]]: The ID and relevance score of each
+            matching song, best match first.
+        """
+        scores: Counter = Counter()
+        for word in set(tokenize(query)):
+            for song_id, weight in self._postings.get(word, {}).items():
+                scores[song_id] += weight
+
+        results = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return results if limit is None else results[:limit]
+
+
+class SearchIndex:
+    """
+    Holds the InvertedIndex of a songs collection, built on first use and
+    rebuilt once it is older than ttl seconds or has been invalidated by
+    a write of this process.
+    """
+
+    def __init__(self, ttl: float = INDEX_TTL) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index: Optional[InvertedIndex] = None
+        self._built_at = 0.0
+
+    def invalidate(self) -> None:
+        """Makes the next search rebuild the index."""
+        self._index = None
+
+    def get(self, db: Database) -> InvertedIndex:
+        """Returns the index of db.songs, rebuilding it if needed."""
+        with self._lock:
+            if (self._index is None
+                    or time.monotonic() - self._built_at >= self.ttl):
+                fields = {'_id': 0, 'id': 1}
+                fields.update({field: 1 for field in FIELD_WEIGHTS})
+                self._index = InvertedIndex(db.songs.find({}, fields))
+                self._built_at = time.monotonic()
+            return self._index
+
+    def search(self, db: Database, query: str, limit: Optional[int],
+               projection: Optional[Dict[str, int]]) -> List[Dict[str, Any]]:
+        """
+        Returns the songs of db matching query, best match first, each
+        with its relevance score in 'score'. Only the matching songs are
+        fetched from the database, restricted to projection.
+        """
+        results = self.get(db).search(query, limit)
+        if not results:
+            return []
+
+        songs = {song['id']: song for song in db.songs.find(
+            {'id': {'$in': [song_id for song_id, _ in results]}}, projection)}
+
+        matches = []
+        for song_id, score in results:
+            song = songs.get(song_id)
+            if song is not None:
+                song['score'] = score
+                matches.append(song)
+        return matches
@@ -0,0 +1,180 @@
+# backend/versions.py
+"""
+Versions of the songs, which let clients revalidate their copies cheaply.
+
+Each song written through the API carries a 'version', incremented by
+every write which changes it, and the 'updated_at' time of its last
+write. The 'meta'
+collection holds a change counter of the whole collection, incremented
+after every write, with the time of the last one.
+
+GET /song/<id> and GET /song derive their ETag and Last-Modified headers
+from them, and include both fields in every song they return. A client
+sending back the ETag in If-None-Match, or a date in If-Modified-Since,
+gets "304 Not Modified" after a lookup of these fields alone: the songs
+are neither fetched nor encoded. Dates only have a one-second resolution,
+so a copy dated the very second of the last write is never assumed
+current: only the ETag tells whether it is.
+
+Songs written to MongoDB without going through the API, e.g. from the
+mongo shell, do not update the counter: clients keep being answered 304
+for the list until the next write through the API.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from flask import Response, request
+from pymongo.database import Database
+
+from .compression import ENCODINGS
+
+# Fields maintained by the server, which clients cannot set
+VERSION_FIELDS = ('version', 'updated_at')
+
+# Document of the 'meta' collection holding the change counter of 'songs'
+COUNTER_ID = 'songs'
+
+
+def now() -> datetime:
+    """Returns the current time, to the millisecond stored by MongoDB."""
+    moment = datetime.now(timezone.utc)
+    return moment.replace(microsecond=moment.microsecond // 1000 * 1000)
+
+
+def version_update(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the MongoDB update setting fields, and stamping the song with a
+    new version.
+
+    Args:
+        fields (Dict[str, Any]): The fields sent by the client, without
+        the ones of VERSION_FIELDS, which are ignored.
+
+    Returns:
+        Dict[str, Any]: The update document.
+    """
+    values = {key: value for key, value in fields.items()
+              if key not in VERSION_FIELDS}
+    values['updated_at'] = now()
+    return {'$set': values, '$inc': {'version': 1}}
+
+
+def changes_filter(query: Dict[str, Any],
+                   fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Restricts query to the songs which setting fields would change, so
+    that an update which changes nothing leaves the version, and the ETags,
+    as they are.
+
+    Args:
+        query (Dict[str, Any]): The filter of the song to update.
+        fields (Dict[str, Any]): The fields sent by the client, without
+        the ones of VERSION_FIELDS, which are ignored.
+
+    Returns:
+        Optional[Dict[str, Any]]: The filter, or None if there is no field
+        to set.
+    """
+    differences = [{key: {'$ne': value}} for key, value in fields.items()
+                   if key not in VERSION_FIELDS]
+    if not differences:
+        return None
+    return {**query, '$or': differences}
+
+
+def stamp_new_song(song: Dict[str, Any]) -> None:
+    """Sets the version fields of a song about to be inserted."""
+    song['version'] = 1
+    song['updated_at'] = now()
+
+
+def record_change(db: Database) -> None:
+    """Increments the change counter, after a write to db.songs."""
+    db.meta.update_one({'_id': COUNTER_ID},
+                       {'$inc': {'version': 1}, '$set': {'updated_at': now()}},
+                       upsert=True)
+
+
+def collection_version(db: Database) -> Tuple[int, Optional[datetime]]:
+    """
+    Reads the change counter of db.songs.
+
+    Returns:
+        Tuple[int, Optional[datetime]]: The counter, 0 if nothing was
+        written yet, and the time of the last write, or None.
+    """
+    counter = db.meta.find_one({'_id': COUNTER_ID}) or {}
+    return counter.get('version', 0), counter.get('updated_at')
+
+
+def song_etag(song: Dict[str, Any]) -> str:
+    """
+    Returns the ETag of a song, from its version fields. The time of the
+    last write tells apart the songs recreated with the same ID.
+    """
+    updated_at = song.get('updated_at')
+    if updated_at is None:
+        return f"{song.get('id')}-{song.get('version', 0)}"
+    millis = int(_as_utc(updated_at).timestamp() * 1000)
+    return f"{song.get('id')}-{song.get('version', 0)}-{millis}"
+
+
+def _as_utc(moment: datetime) -> datetime:
+    # PyMongo returns naive datetimes, in UTC, unless tz_aware is set
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def not_modified(etag: str, last_modified: Optional[datetime],
+                 vary: Iterable[str] = ()) -> Optional[Response]:
+    """
+    Answers a conditional GET whose copy is still current.
+
+    Args:
+        etag (str): The ETag of the current representation, before
+        compression, which appends the encoding to it.
+        last_modified (datetime): The time of its last change, or None.
+        vary (Iterable[str]): The request headers, other than
+        Accept-Encoding, the representation depends on.
+
+    Returns:
+        Optional[Response]: A "304 Not Modified" response, or None if the
+        client has no copy, a stale one, or one whose date is the second of
+        the last write. If-None-Match takes precedence over
+        If-Modified-Since.
+    """
+    if request.if_none_match:
+        for tag in [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]:
+            if request.if_none_match.contains_weak(tag):
+                response = Response(status=304)
+                response.set_etag(tag)
+                break
+        else:
+            return None
+    elif (last_modified is not None and request.if_modified_since is not None
+          and _as_utc(last_modified).replace(microsecond=0)
+          < request.if_modified_since):
+        # A write within the second of the client's copy would not show in
+        # the date: a copy of that second is treated as modified
+        response = Response(status=304)
+        response.set_etag(etag)
+    else:
+        return None
+
+    set_validators(response, None, last_modified, vary)
+    return response
+
+
+def set_validators(response: Response, etag: Optional[str],
+                   last_modified: Optional[datetime],
+                   vary: Iterable[str] = ()) -> Response:
+    """Sets the ETag and Last-Modified headers of a response."""
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _as_utc(last_modified)
+    response.vary.add('Accept-Encoding')
+    for header in vary:
+        response.vary.add(header)
+    return response
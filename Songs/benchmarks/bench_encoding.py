@@ -0,0 +1,62 @@
+"""
+Microbenchmark of the encoding of song documents to JSON.
+
+Compares the former path (bson.json_util.dumps, and parse_json as
+json.loads(json_util.dumps(...))) with backend.encoding.
+
+Usage, from the Songs directory:
+    python -m benchmarks.bench_encoding [number of songs]
+"""
+import json
+import os
+import sys
+import timeit
+
+from bson import ObjectId, json_util
+
+from backend.encoding import dumps, to_json_compatible
+
+
+def load_songs(count: int) -> list:
+    """Returns count songs built from songs.json, each with an ObjectId."""
+    site_root = os.path.realpath(os.path.dirname(__file__))
+    json_path = os.path.join(site_root, "..", "backend", "data", "songs.json")
+    with open(json_path, 'r') as f:
+        seed = json.load(f)
+
+    songs = []
+    for index in range(count):
+        song = dict(seed[index % len(seed)])
+        song['id'] = index + 1
+        song['_id'] = ObjectId()
+        songs.append(song)
+    return songs
+
+
+def bench(label: str, statement, repeat: int = 5) -> float:
+    best = min(timeit.repeat(statement, number=1, repeat=repeat))
+    print(f"{label:<45}{best * 1000:>10.2f} ms")
+    return best
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    songs = load_songs(count)
+    payload = {"songs": songs}
+    print(f"Encoding {count} songs (best of 5 runs)")
+
+    old = bench("json_util.dumps (GET /song before)",
+                lambda: json_util.dumps(payload))
+    new = bench("encoding.dumps (GET /song now)",
+                lambda: dumps(payload))
+    print(f"{'speedup':<45}{old / new:>10.1f} x")
+
+    old = bench("json.loads(json_util.dumps()) (parse_json)",
+                lambda: json.loads(json_util.dumps(songs)))
+    new = bench("encoding.to_json_compatible (parse_json now)",
+                lambda: to_json_compatible(songs))
+    print(f"{'speedup':<45}{old / new:>10.1f} x")
+
+
+if __name__ == '__main__':
+    main()
@@ -15,10 +15,10 @@ done
 
 echo "MongoDB is up and running!"
 
-# --- Optional: Data Initialization Step ---
-# If your application needs the songs.json data loaded, 
-# you would run a Python script here to insert the data.
-# For example: python /app/load_initial_data.py
+# --- Data Initialization Step ---
+# Creates the indexes and loads songs.json if the collection is empty,
+# once, before the application workers start.
+FLASK_APP="${FLASK_APP:-app.py}" flask seed-db
 
 echo "Starting the Flask Songs API..."
 
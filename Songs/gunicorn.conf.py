@@ -0,0 +1,42 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings of the production serving mode of the Songs service
+(SERVER_MODE=production, see serve.sh).
+
+Each setting can be overridden with the environment variable named in
+its comment. Sending SIGHUP to the master process reloads the
+configuration and replaces the workers gracefully.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# GUNICORN_WORKERS, GUNICORN_THREADS: the usual (2 x cores) + 1 processes,
+# each serving requests from a few threads
+workers = int(os.environ.get("GUNICORN_WORKERS",
+                             multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+
+# GUNICORN_PRELOAD: imports the application once in the master process;
+# each worker then creates its own MongoClient on first use, see
+# backend.db.LazyDatabase
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# GUNICORN_KEEPALIVE: seconds an idle client connection is kept open
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+# GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT: a silent worker is killed
+# after timeout seconds; on reload or shutdown, workers get
+# graceful_timeout seconds to finish their in-flight requests
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# GUNICORN_MAX_REQUESTS: workers are recycled after this many requests,
+# with some jitter so that they do not all restart at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
@@ -0,0 +1,12 @@
+#!/bin/sh
+# Starts the Songs service with the server selected by SERVER_MODE:
+# - development (default): Flask's built-in server, with the reloader;
+# - production: gunicorn, configured by gunicorn.conf.py.
+
+if [ "$SERVER_MODE" = "production" ]; then
+  echo "Starting the Flask Songs API with gunicorn..."
+  exec gunicorn -c gunicorn.conf.py backend:app
+fi
+
+echo "Starting the Flask Songs API with the development server..."
+exec python app.py
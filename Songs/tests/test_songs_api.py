@@ -1,12 +1,22 @@
+import gzip
 import pytest
 import os
 import json   # To load songs.json
 from pymongo import MongoClient
 from pymongo.database import Database   # Imports this type for type hinting
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId, json_util
+from werkzeug.http import http_date, parse_date
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 # Imports the create_app function from the backend package, instead
 # of the app instance directly.
 from backend import create_app
+from backend.db import (LazyDatabase, client_options_from_env,
+                        ensure_indexes, seed_songs)
+from backend.encoding import dumps, to_json_compatible
+from backend.loader import iter_json_records
+from backend.search import InvertedIndex
 
 
 # --- Fixtures for the test database ---
@@ -65,6 +75,9 @@ def test_collection(test_db):
             songs_list = json.load(f)
         if songs_list:
             collection.insert_many(songs_list)
+
+        # Mirrors the indexes created by create_app in production
+        ensure_indexes(test_db)
         str_msg = f"[Pytest Fixture] Inserted {len(songs_list)} documents "
         str_msg += f"into {collection_name}"
         print(str_msg)
@@ -125,6 +138,134 @@ def picture():
     return dict(picture)
 
 
+def test_encoding_matches_json_util():
+    document = {
+        "_id": ObjectId(),
+        "id": 1,
+        "title": "Song",
+        "released": datetime(2020, 1, 2, tzinfo=timezone.utc),
+        "tags": ["a", {"nested_id": ObjectId()}]
+    }
+    expected = json.loads(json_util.dumps(document))
+    assert json.loads(dumps(document)) == expected
+    assert to_json_compatible(document) == expected
+
+
+def test_client_options_from_env():
+    options = client_options_from_env({
+        'MONGODB_MAX_POOL_SIZE': '50',
+        'MONGODB_MIN_POOL_SIZE': '5',
+        'MONGODB_WAIT_QUEUE_TIMEOUT_MS': '',
+        'MONGODB_COMPRESSORS': 'zlib'
+    })
+    assert options == {'maxPoolSize': 50, 'minPoolSize': 5,
+                       'compressors': 'zlib'}
+
+
+def test_lazy_database_connects_on_first_use(monkeypatch):
+    created = []
+    monkeypatch.setattr('backend.db.MongoClient',
+                        lambda url, **options: created.append(options)
+                        or {'songs': 'songs database'})
+    db = LazyDatabase('mongodb://localhost:27017/', 'songs',
+                      {'maxPoolSize': 10})
+    assert created == []
+    assert db.get() == 'songs database'
+    assert db.get() == 'songs database'
+    assert created == [{'maxPoolSize': 10}]
+
+    # A forked worker gets its own client
+    monkeypatch.setattr('backend.db.os.getpid', lambda: -1)
+    db.get()
+    assert len(created) == 2
+
+
+class FakeMongoClient(dict):
+    # Stands for a MongoClient holding the 'songs' database
+    def __init__(self, url, **options):
+        super().__init__(songs='songs database')
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_lazy_database_closes_client_when_on_connect_fails(monkeypatch):
+    clients = []
+
+    def create_client(url, **options):
+        clients.append(FakeMongoClient(url, **options))
+        return clients[-1]
+
+    def on_connect(db):
+        if len(clients) == 1:
+            raise OperationFailure('Authentication failed.', code=18)
+
+    monkeypatch.setattr('backend.db.MongoClient', create_client)
+    db = LazyDatabase('mongodb://localhost:27017/', 'songs',
+                      on_connect=on_connect)
+    with pytest.raises(OperationFailure):
+        db.get()
+    assert clients[0].closed
+
+    # The next use creates a new client
+    assert db.get() == 'songs database'
+    assert len(clients) == 2 and not clients[1].closed
+
+
+def test_index_conflict_is_not_an_authentication_error(monkeypatch, caplog):
+    failures = [OperationFailure('Index already exists with different '
+                                 'options', code=85)]
+
+    def ensure_indexes(db):
+        raise failures[0]
+
+    monkeypatch.setattr('backend.db.MongoClient', FakeMongoClient)
+    monkeypatch.setattr('backend.ensure_indexes', ensure_indexes)
+    app = create_app()
+    # A conflicting index is reported, and the database is still usable
+    assert app.db.get() == 'songs database'
+    assert 'conflicts with the expected one' in caplog.text
+    assert 'Authentication' not in caplog.text
+
+    app = create_app()
+    failures[0] = OperationFailure('Authentication failed.', code=18)
+    with pytest.raises(OperationFailure):
+        app.db.get()
+    assert 'MongoDB Authentication error' in caplog.text
+
+
+def test_seed_db_command(app, test_db):
+    test_db.songs.drop()
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["seed-db"])
+    assert result.exit_code == 0
+    assert "20 songs inserted." in result.output
+    assert test_db.songs.count_documents({}) == 20
+
+    # Songs are only loaded into an empty collection
+    result = runner.invoke(args=["seed-db"])
+    assert "0 songs inserted." in result.output
+    test_db.songs.drop()
+
+
+def test_seed_songs_from_ndjson_in_batches(app, test_db, tmp_path):
+    test_db.songs.drop()
+    songs = [{'id': song_id, 'title': f"Song {song_id}"}
+             for song_id in range(1, 8)]
+    ndjson_path = tmp_path / "songs.ndjson"
+    ndjson_path.write_text("".join(json.dumps(song) + "\n" for song in songs))
+    # Small chunks, so that songs span several of them
+    assert list(iter_json_records(str(ndjson_path), chunk_size=5)) == songs
+
+    inserted = seed_songs(test_db, str(ndjson_path), app.logger, batch_size=3)
+    assert inserted == 7
+    assert [song['id'] for song in test_db.songs.find({}, {'_id': 0})] == \
+        list(range(1, 8))
+    test_db.songs.drop()
+
+
 def test_health(client):
     res = client.get("/health")
     assert res.status_code == 200
@@ -153,6 +294,147 @@ def test_get_all_songs(client, test_collection):
         assert '_id' in song
 
 
+def test_get_songs_paginated(client, test_collection):
+    res = client.get('/song?limit=8')
+    assert res.status_code == 200
+    data = res.get_json()
+    assert [song['id'] for song in data['songs']] == list(range(1, 9))
+    assert data['next_after_id'] == 8
+
+    res = client.get(f"/song?after_id={data['next_after_id']}&limit=8")
+    data = res.get_json()
+    assert [song['id'] for song in data['songs']] == list(range(9, 17))
+
+    res = client.get('/song?after_id=16&limit=8')
+    data = res.get_json()
+    assert [song['id'] for song in data['songs']] == list(range(17, 21))
+    assert data['next_after_id'] is None
+
+
+def test_get_songs_projection(client, test_collection):
+    res = client.get('/song?fields=title&limit=5')
+    assert res.status_code == 200
+    for song in res.get_json()['songs']:
+        assert set(song.keys()) == {'_id', 'id', 'title'}
+
+
+def test_get_songs_invalid_page_args(client):
+    res = client.get('/song?limit=0')
+    assert res.status_code == 400
+    msg_str = "ERROR: 'limit' shall be a positive integer. "
+    msg_str += "Its actual value is '0'"
+    assert res.json['message'] == msg_str
+
+    res = client.get('/song?after_id=abc')
+    assert res.status_code == 400
+    msg_str = "ERROR: 'after_id' shall be an integer. "
+    msg_str += "Its actual value is 'abc'"
+    assert res.json['message'] == msg_str
+
+
+def test_get_songs_stream(client, test_collection):
+    res = client.get('/song?stream=1')
+    assert res.status_code == 200
+    assert res.mimetype == 'application/x-ndjson'
+    songs = [json.loads(line) for line in res.data.decode().splitlines()]
+    assert [song['id'] for song in songs] == list(range(1, 21))
+
+    res = client.get('/song?fields=title&limit=3',
+                     headers={'Accept': 'application/x-ndjson'})
+    songs = [json.loads(line) for line in res.data.decode().splitlines()]
+    assert [song['id'] for song in songs] == [1, 2, 3]
+    assert 'lyrics' not in songs[0]
+
+    res = client.get('/song', headers={'Accept': '*/*'})
+    assert res.mimetype == 'application/json'
+
+
+def test_get_songs_compressed(client, test_collection):
+    expected = client.get('/song').get_json()
+    res = client.get('/song', headers={'Accept-Encoding': 'gzip, br;q=0'})
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in res.headers['Vary']
+    assert json.loads(gzip.decompress(res.data)) == expected
+
+    res = client.get('/song?stream=1', headers={'Accept-Encoding': 'gzip'})
+    assert res.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(res.data).decode().splitlines()
+    assert [json.loads(line)['id'] for line in lines] == \
+        [song['id'] for song in expected['songs']]
+
+    # Clients which do not accept it get the identity encoding
+    res = client.get('/song', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in res.headers
+
+
+def test_get_songs_conditional(client, test_collection):
+    res = client.get('/song', headers={'Accept-Encoding': 'gzip'})
+    etag = res.headers['ETag']
+    assert res.headers['Content-Encoding'] == 'gzip'
+
+    res = client.get('/song', headers={'If-None-Match': etag,
+                                       'Accept-Encoding': 'gzip'})
+    assert res.status_code == 304
+    assert res.data == b''
+    assert res.headers['ETag'] == etag
+
+    # The NDJSON stream is another representation
+    res = client.get('/song?stream=1', headers={'If-None-Match': etag})
+    assert res.status_code == 200
+    assert res.headers['ETag'] != etag
+
+    # Any write changes the ETag of the list
+    client.delete('/song/20')
+    res = client.get('/song', headers={'If-None-Match': etag,
+                                       'Accept-Encoding': 'gzip'})
+    assert res.status_code == 200
+    assert res.headers['ETag'] != etag
+
+
+def test_get_song_by_id_conditional(client, test_collection):
+    client.put('/song/1', json={'title': 'Revised'})
+    res = client.get('/song/1')
+    etag = res.headers['ETag']
+    last_modified = res.headers['Last-Modified']
+    assert res.get_json()['version'] == 1
+
+    res = client.get('/song/1', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+    assert res.data == b''
+
+    # A copy of the second of the last write may miss a write made later
+    # within that second: only the ETag can tell
+    res = client.get('/song/1', headers={'If-Modified-Since': last_modified})
+    assert res.status_code == 200
+    later = http_date(parse_date(last_modified) + timedelta(seconds=1))
+    res = client.get('/song/1', headers={'If-Modified-Since': later})
+    assert res.status_code == 304
+    res = client.get('/song/1', headers={'If-Modified-Since': last_modified,
+                                         'If-None-Match': etag})
+    assert res.status_code == 304
+
+    # Clients cannot choose the version
+    client.put('/song/1', json={'title': 'Revised again', 'version': 7})
+    res = client.get('/song/1', headers={'If-None-Match': etag})
+    assert res.status_code == 200
+    assert res.get_json()['version'] == 2
+    assert res.headers['ETag'] != etag
+
+
+def test_update_song_unchanged_keeps_etags(client, test_collection):
+    client.put('/song/1', json={'title': 'Revised'})
+    etag = client.get('/song/1').headers['ETag']
+    list_etag = client.get('/song').headers['ETag']
+
+    # Repeating the same update changes nothing, even the version
+    res = client.put('/song/1', json={'title': 'Revised', 'version': 9})
+    assert res.status_code == 200
+    assert res.json['message'] == "Song found, but nothing updated"
+    assert client.get('/song/1').headers['ETag'] == etag
+    assert client.get('/song').headers['ETag'] == list_etag
+    assert test_collection.find_one({'id': 1})['version'] == 1
+
+
 def test_get_song_by_id_success(client, test_collection):
     res = client.get('/song/1')
     assert res.status_code == 200
@@ -215,6 +497,43 @@ def test_create_song_already_exists(client, test_collection):
     assert res.json['message'] == "song with id 1 already present"
 
 
+def test_bulk_upsert_songs_json(client, test_collection):
+    rows = [
+        {"id": 1, "title": "Bulk Updated Title"},
+        {"id": "301", "title": "Bulk Song 301", "lyrics": "la"},
+        {"id": "abc", "title": "Invalid"},
+        {"id": 302, "title": "Bulk Song 302", "lyrics": "la"}
+    ]
+    res = client.post('/song/bulk?batch_size=2', json=rows)
+    assert res.status_code == 200
+    data = res.get_json()
+    assert (data['inserted'], data['updated'], data['failed']) == (2, 1, 1)
+    assert len(data['batches']) == 2
+    assert data['batches'][1]['errors'][0]['index'] == 0
+
+    assert test_collection.find_one({'id': 1})['title'] == "Bulk Updated Title"
+    assert test_collection.find_one({'id': 301}) is not None
+    assert test_collection.count_documents({}) == 22
+
+
+def test_bulk_upsert_songs_ndjson(client, test_collection):
+    body = '{"id": 303, "title": "NDJSON"}\n\nnot json\n{"id": 2}\n'
+    res = client.post('/song/bulk', data=body,
+                      content_type='application/x-ndjson')
+    assert res.status_code == 200
+    data = res.get_json()
+    assert (data['inserted'], data['failed']) == (1, 1)
+    assert test_collection.find_one({'id': 303})['title'] == "NDJSON"
+
+
+def test_bulk_upsert_songs_no_data(client):
+    res = client.post('/song/bulk', json={"id": 1})
+    assert res.status_code == 400
+    res = client.post('/song/bulk', json=[])
+    assert res.status_code == 400
+    assert res.json['message'] == "ERROR: Request data not found"
+
+
 def test_create_song_no_data(client):
     # or simply client.post('/song') if the body is truly empty
     res = client.post('/song', json={})
@@ -240,6 +559,18 @@ def test_update_song_success(client, test_collection):
     assert updated_in_db['title'] == "Updated Test Song Title"
 
 
+def test_update_song_nothing_updated(client, test_collection):
+    song = test_collection.find_one({'id': 2})
+    res = client.put('/song/2', json={"title": song['title']})
+    assert res.status_code == 200
+    assert res.json['message'] == "Song found, but nothing updated"
+
+
+def test_create_song_duplicate_rejected_by_index(test_collection):
+    with pytest.raises(DuplicateKeyError):
+        test_collection.insert_one({"id": 1, "title": "Duplicate"})
+
+
 def test_update_song_not_found(client, test_collection):
     updated_data = {"title": "Non Existent Song"}
     res = client.put('/song/99999', json=updated_data)
@@ -306,3 +637,45 @@ def test_delete_song_invalid_id(client):
     assert res.status_code == 400
     str_msg = "ERROR: Invalid ID format. Its actual value is 'xyz'"
     assert res.json['message'] == str_msg
+
+
+def test_inverted_index_ranks_title_words_first():
+    index = InvertedIndex([
+        {'id': 1, 'title': 'Blue moon', 'lyrics': 'Under the sky'},
+        {'id': 2, 'title': 'Sky high', 'lyrics': 'A blue, blue sea'},
+        {'id': 3, 'title': 'Nothing', 'lyrics': None},
+    ])
+    # 'blue' weighs 10 in the title of song 1, 2 x 1 in the lyrics of song 2
+    assert index.search('BLUE') == [(1, 10), (2, 2)]
+    assert index.search('blue sky', limit=1) == [(2, 12)]
+    assert index.search('missing') == []
+
+
+def test_search_songs(client, test_collection):
+    res = client.get('/song/search?q=faucibus&fields=title')
+    assert res.status_code == 200
+    songs = res.json['songs']
+    assert sorted(song['id'] for song in songs) == [1, 2, 3, 10, 11, 12]
+    # Songs with the word in their title rank before the others
+    assert sorted(song['id'] for song in songs[:4]) == [1, 2, 3, 12]
+    assert all(set(song) == {'_id', 'id', 'title', 'score'} for song in songs)
+
+    res = client.get('/song/search?q=faucibus&limit=2')
+    assert len(res.json['songs']) == 2
+
+    # Writes are visible to the next search
+    client.post('/song', json={'id': 300, 'title': 'Faucibus'})
+    res = client.get('/song/search?q=faucibus&fields=id')
+    assert 300 in [song['id'] for song in res.json['songs']]
+    client.delete('/song/300')
+
+
+def test_search_songs_invalid_args(client):
+    res = client.get('/song/search?q=%20')
+    assert res.status_code == 400
+
+    res = client.get('/song/search?q=duis&limit=0')
+    assert res.status_code == 400
+    str_msg = "ERROR: 'limit' shall be a positive integer. "
+    str_msg += "Its actual value is '0'"
+    assert res.json['message'] == str_msg